@@ -2,13 +2,13 @@
 import socket
 import threading
 import time
-import json
 import argparse
 import pygame
 import sys
+from grid_state import GridState
 
 try:   
-    from client import ClientFSM, ClientState, ClientHeaders, MSG_ACQUIRE_EVENT
+    from client import ClientFSM, ClientState, ClientHeaders
     client_available = True
 except ImportError:
     client_available = False
@@ -21,7 +21,7 @@ class GridClashGUI:
         self.grid_size = 20
         
         # Game state
-        self.grid = [[0 for _ in range(self.grid_size)] for _ in range(self.grid_size)]
+        self.grid = GridState(self.grid_size, self.grid_size)
         self.player_id = None
         self.score = 0
         self.running = True
@@ -66,13 +66,8 @@ class GridClashGUI:
             # Get player ID
             player_id = self.fsm.my_id
             
-            # Calculate score
-            score = 0
-            if player_id:
-                for row in grid:
-                    for cell in row:
-                        if cell == player_id:
-                            score += 1
+            # Score is kept up to date by the grid
+            score = grid.score(player_id)
             
     
             state = self.fsm.state
@@ -85,12 +80,7 @@ class GridClashGUI:
                 leaderboard_data = self.fsm.scores
 
             if state == ClientState.GAME_OVER and leaderboard_data is None:
-                player_scores = {}
-                for y in range(len(grid)):
-                    for x in range(len(grid[y])):
-                        player = grid[y][x]
-                        if player > 0:
-                            player_scores[str(player)] = player_scores.get(str(player), 0) + 1
+                player_scores = {str(player): count for player, count in grid.scores().items()}
                 if player_scores:
                     leaderboard_data = player_scores
             
@@ -109,10 +99,8 @@ class GridClashGUI:
             if self.fsm.state != ClientState.IN_GAME_LOOP:
                 return False
             
-            payload_dictionary = {"x": x, "y": y}
-            payload = json.dumps(payload_dictionary).encode()
-            
-            self.fsm.send_packet(MSG_ACQUIRE_EVENT, payload=payload)
+            # Shown as predicted from the next frame, until a snapshot settles it
+            self.fsm.request_acquire(x, y)
             return True
             
         except Exception as e:
@@ -221,8 +209,12 @@ def run_pygame_gui(gui_client):
         # Get window size
         current_width, current_height = screen.get_size()
         
-        # Calculate unclaimed cells
-        unclaimed_count = sum(1 for row in grid for cell in row if cell == 0)
+        # Unclaimed cells are counted by the grid; cells are read once per frame
+        unclaimed_count = grid.unclaimed
+        cells = grid.view.tolist()
+        # Our claims not yet confirmed by the server (copied in one step, the
+        # FSM thread updates it)
+        predicted = grid.predicted.copy()
         
         # Draw status
         status_text = state.name.replace('_', ' ') if state else "Unknown"
@@ -242,7 +234,7 @@ def run_pygame_gui(gui_client):
         
         for y in range(20):
             for x in range(20):
-                cell_value = grid[y][x] if y < len(grid) and x < len(grid[y]) else 0
+                cell_value = cells[y][x] if y < len(cells) and x < len(cells[y]) else 0
                 cell_color = get_color(cell_value)
                 
                 rect = pygame.Rect(
@@ -252,11 +244,19 @@ def run_pygame_gui(gui_client):
                     CELL_SIZE
                 )
                 
+                predicted_owner = predicted.get(y * 20 + x) if cell_value == 0 else None
+                if predicted_owner:
+                    # Predicted cells are a dimmed player color with a light border
+                    cell_color = tuple(c // 2 for c in get_color(predicted_owner))
+
                 pygame.draw.rect(screen, cell_color, rect)
                 
                 # Border
-                border_color = (90, 90, 90) if cell_value == 0 else (40, 40, 40)
-                pygame.draw.rect(screen, border_color, rect, 1)
+                if predicted_owner:
+                    pygame.draw.rect(screen, (230, 230, 230), rect, 2)
+                else:
+                    border_color = (90, 90, 90) if cell_value == 0 else (40, 40, 40)
+                    pygame.draw.rect(screen, border_color, rect, 1)
                 
                 # Player number
                 if cell_value > 0 and CELL_SIZE > 15:
@@ -275,7 +275,7 @@ def run_pygame_gui(gui_client):
         info_lines = [
             f"Player ID: {player_id if player_id else 'None'}",
             f"Your Score: {score}",
-            f"Cells Left: {unclaimed_count}/400",
+            f"Cells Left: {unclaimed_count}/{grid.size}",
             "",
             "Controls:",
             "• Click: Ready/Claim",
@@ -338,13 +338,8 @@ def run_pygame_gui(gui_client):
                 
                 for rank, (player_id_entry, player_score) in enumerate(sorted_leaderboard, 1):
                     # Calculate player's cells from grid
-                    player_cells = 0
                     if player_id_entry.isdigit():
-                        player_num = int(player_id_entry)
-                        for row in grid:
-                            for cell in row:
-                                if cell == player_num:
-                                    player_cells += 1
+                        player_cells = grid.score(int(player_id_entry))
                     else:
                         player_cells = player_score
                     
@@ -392,7 +387,7 @@ def run_pygame_gui(gui_client):
                         screen.blit(your_rank_text, (current_width // 2 - your_rank_text.get_width() // 2, your_rank_y))
                         
                         your_score = leaderboard_data.get(str(player_id), 0)
-                        your_cells = sum(1 for row in grid for cell in row if cell == player_id)
+                        your_cells = grid.score(player_id)
                         your_stats = font.render(f"Score: {your_score}, Cells: {your_cells}", True, (200, 200, 200))
                         screen.blit(your_stats, (current_width // 2 - your_stats.get_width() // 2, your_rank_y + 30))
             else:
@@ -0,0 +1,102 @@
+import dataclasses
+from header import *
+
+
+class ReceiveWindow:
+    # Server side: which sequenced acquires of one player have arrived. Only
+    # sequence numbers a SACK can describe are taken; the client's window
+    # never reaches past them.
+
+    def __init__(self):
+        # Every request up to here arrived
+        self.cumulative = 0
+        # Arrived requests above the cumulative point
+        self.received = set()
+        # Set by every arrival, duplicates included, until the SACK goes out
+        self.ack_due = False
+        # Newest request header timestamp since the last SACK, echoed in it
+        self.echo = 0.0
+
+    def receive(self, seq, timestamp):
+        # True when the request is new and should be resolved
+        if seq > self.cumulative + SACK_BITS:
+            return False
+        self.ack_due = True
+        self.echo = max(self.echo, timestamp)
+        if seq <= self.cumulative or seq in self.received:
+            return False
+        self.received.add(seq)
+        while self.cumulative + 1 in self.received:
+            self.cumulative += 1
+            self.received.remove(self.cumulative)
+        return True
+
+    def take_sack(self):
+        # ((cumulative, bitmap), echoed timestamp) for this tick's SACK
+        bitmap = 0
+        for seq in self.received:
+            bitmap |= 1 << (seq - self.cumulative - 1)
+        echo = self.echo
+        self.ack_due = False
+        self.echo = 0.0
+        return (self.cumulative, bitmap), echo
+
+
+@dataclasses.dataclass
+class AcquireRequest:
+    seq: int
+    x: int
+    y: int
+    payload: bytes
+    # Header timestamps of every copy sent
+    sent: list = dataclasses.field(default_factory=list)
+    retransmit_at: float = 0.0
+    # Once ACKed, the first snapshot that shows how the server resolved it
+    covered_by: int = None
+
+
+class SendWindow:
+    # Client side: acquires in flight by sequence number. A new request may
+    # only be opened within size of the oldest one still unacked, so the
+    # whole window fits in one SACK bitmap.
+
+    def __init__(self, size=8):
+        self.size = max(1, min(size, SACK_BITS))
+        self.next_seq = 1
+        self.in_flight = {}
+
+    def oldest(self):
+        return min(self.in_flight, default=self.next_seq)
+
+    def has_room(self):
+        return self.next_seq - self.oldest() < self.size
+
+    def open(self, x, y, payload):
+        request = AcquireRequest(self.next_seq, x, y, payload)
+        self.in_flight[request.seq] = request
+        self.next_seq += 1
+        return request
+
+    def expired(self, now):
+        return [request for request in self.in_flight.values() if now >= request.retransmit_at]
+
+    def on_sack(self, cumulative, bitmap):
+        # Requests newly covered by a SACK, removed from the window
+        acked = []
+        for seq in list(self.in_flight):
+            offset = seq - cumulative - 1
+            if offset < 0 or (offset < SACK_BITS and bitmap >> offset & 1):
+                acked.append(self.in_flight.pop(seq))
+        return acked
+
+    def on_cell_acks(self, cells):
+        # Servers that do not know sequence numbers ACK by cell
+        acked = [request for request in self.in_flight.values() if (request.x, request.y) in cells]
+        for request in acked:
+            del self.in_flight[request.seq]
+        return acked
+
+    def lost_before(self, delivered_at):
+        # Requests whose last copy went out before one the server has seen,
+        # yet are still missing from its SACK
+        return [request for request in self.in_flight.values() if request.sent[-1] < delivered_at]
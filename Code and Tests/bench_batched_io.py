@@ -0,0 +1,121 @@
+import argparse
+import contextlib
+import json
+import os
+import random
+import socket
+import time
+import numpy as np
+
+from header import *
+from batched_io import IO_MMSG, IO_PLAIN, MmsgSocketIO
+from game_room import ServerState
+from server import GameServer
+
+
+# Rate of the bot clients in client.py (about 5 claims per second each)
+ACQUIRES_PER_SECOND = 5
+
+
+def make_players(count):
+    socks = []
+    for _ in range(count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", 0))
+        sock.setblocking(False)
+        socks.append(sock)
+    return socks
+
+
+def run(backend, player_count, room_size, ticks, tick_rate, port):
+    server = GameServer(port=port, tick_rate=tick_rate, telemetry_log=os.devnull,
+                        room_size=room_size, io_backend=backend)
+    if backend == IO_MMSG and not isinstance(server.io, MmsgSocketIO):
+        server.telemetry.close()
+        server.server_socket.close()
+        return
+    addr = ("127.0.0.1", port)
+    socks = make_players(player_count)
+    free_cells = {sock: list(range(400)) for sock in socks}
+    acquire_chance = ACQUIRES_PER_SECOND / tick_rate
+    selects = 0
+
+    def send_and_serve(packets):
+        # Feeds the server in chunks small enough for its receive buffer
+        nonlocal selects
+        for i in range(0, len(packets), 128):
+            for sock, packet in packets[i:i + 128]:
+                sock.sendto(packet, addr)
+            server.process_network_events(0)
+            selects += 1
+
+    def syscalls():
+        return selects + server.io.recv_calls + server.io.send_calls
+
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for msg_type in (MSG_JOIN_REQ, MSG_READY_REQ):
+                send_and_serve([(sock, make_packet(msg_type)) for sock in socks])
+            while any(room.state != ServerState.GAME_LOOP for room in server.rooms.values()):
+                server.update_rooms()
+                server.io.flush()
+
+        tick_cpu = []
+        tick_syscalls = []
+        snapshot_id = 1
+        for _ in range(ticks):
+            # Every player acks the last snapshot; some of them acquire a cell
+            packets = []
+            for sock in socks:
+                packets.append((sock, make_packet(MSG_SNAPSHOT_ACK, snapshot_id=snapshot_id)))
+                if free_cells[sock] and random.random() < acquire_chance:
+                    cell = free_cells[sock].pop(random.randrange(len(free_cells[sock])))
+                    payload = json.dumps({"x": cell % 20, "y": cell // 20}).encode()
+                    packets.append((sock, make_packet(MSG_ACQUIRE_EVENT, payload)))
+            random.shuffle(packets)
+
+            # Only the server's work is timed: draining the socket, the tick
+            # and flushing its snapshots
+            calls = syscalls()
+            start = time.thread_time()
+            send_and_serve(packets)
+            server.update_rooms()
+            server.io.flush()
+            tick_cpu.append((time.thread_time() - start) * 1000)
+            tick_syscalls.append(syscalls() - calls)
+
+            snapshot_id += 1
+            # Drop what the players were sent so their buffers never fill
+            for sock in socks:
+                with contextlib.suppress(BlockingIOError):
+                    while True:
+                        sock.recv(MAX_DATAGRAM_SIZE)
+    finally:
+        for sock in socks:
+            sock.close()
+        server.telemetry.close()
+        server.server_socket.close()
+
+    tick_cpu = np.array(tick_cpu)
+    print(f"io={backend:5s}  players={player_count:4d}  syscalls/tick={np.mean(tick_syscalls):7.1f}  "
+          f"cpu/tick={tick_cpu.mean():7.3f} ms  p99={np.percentile(tick_cpu, 99):7.3f} ms  "
+          f"dropped={server.io.dropped}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Syscalls and CPU per tick with plain and batched socket I/O")
+    parser.add_argument("--port", type=int, default=9891)
+    parser.add_argument("--players", type=int, nargs="+", default=[128, 256, 512])
+    parser.add_argument("--room-size", type=int, default=4)
+    parser.add_argument("--ticks", type=int, default=100)
+    parser.add_argument("--tick-rate", type=float, default=25)
+    args = parser.parse_args()
+
+    for player_count in args.players:
+        for backend in (IO_PLAIN, IO_MMSG):
+            random.seed(0)
+            run(backend, player_count, args.room_size, args.ticks, args.tick_rate, args.port)
+
+
+if __name__ == "__main__":
+    main()
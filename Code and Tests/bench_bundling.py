@@ -0,0 +1,134 @@
+import argparse
+import contextlib
+import json
+import os
+import random
+import socket
+
+from header import *
+from game_room import ServerState
+from server import GameServer
+
+
+# Rate of the bot clients in client.py (about 5 claims per second each)
+ACQUIRES_PER_SECOND = 5
+# Snapshots per SNAPSHOT_ACK when no acquire carries it (see SnapshotReceipts)
+SNAPSHOTS_PER_ACK = 2
+
+
+def make_players(count):
+    socks = []
+    for _ in range(count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", 0))
+        sock.setblocking(False)
+        socks.append(sock)
+    return socks
+
+
+def delta(after, before):
+    return {key: after[key] - before[key] for key in after}
+
+
+def run(mtu, room_count, room_size, ticks, tick_rate, acquire_rate, port):
+    # Players send what the bot clients send: sequenced acquires and
+    # cumulative snapshot acks, through their own PeerOutbox flushed once a tick.
+    # Bundling only saves where a peer has several messages in one flush: an
+    # acquire with an ack each way. A tick's lone snapshot or lone ack still
+    # needs its own datagram and full header, so the saving grows with the
+    # acquire rate.
+    server = GameServer(port=port, tick_rate=tick_rate, telemetry_log=os.devnull,
+                        room_size=room_size, bundle_mtu=mtu)
+    addr = ("127.0.0.1", port)
+    socks = make_players(room_count * room_size)
+    outboxes = {sock: PeerOutbox(mtu) for sock in socks}
+    free_cells = {sock: list(range(400)) for sock in socks}
+    next_seq = {sock: 1 for sock in socks}
+    acquire_chance = min(1.0, acquire_rate / tick_rate)
+
+    def flush_players():
+        for sock in socks:
+            outboxes[sock].flush(sock.sendto)
+            server.process_network_events(0)
+
+    def drain_players():
+        for sock in socks:
+            with contextlib.suppress(BlockingIOError):
+                while True:
+                    sock.recv(MAX_DATAGRAM_SIZE)
+
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for msg_type in (MSG_JOIN_REQ, MSG_READY_REQ):
+                for sock in socks:
+                    outboxes[sock].queue(addr, message(msg_type))
+                flush_players()
+            while any(room.state != ServerState.GAME_LOOP for room in server.rooms.values()):
+                server.run_due_ticks()
+                server.process_network_events(0.001)
+            drain_players()
+
+            server_before = server.outgoing.stats()
+            client_before = [outbox.stats() for outbox in outboxes.values()]
+            snapshot_id = 1
+            for tick in range(ticks):
+                for sock in socks:
+                    acquired = False
+                    if free_cells[sock] and random.random() < acquire_chance:
+                        cell = free_cells[sock].pop(random.randrange(len(free_cells[sock])))
+                        payload = json.dumps({"x": cell % 20, "y": cell // 20}).encode()
+                        outboxes[sock].queue(addr, message(MSG_ACQUIRE_EVENT, payload, seq_num=next_seq[sock]))
+                        next_seq[sock] += 1
+                        acquired = True
+                    if acquired or tick % SNAPSHOTS_PER_ACK == 0:
+                        outboxes[sock].queue(addr, message(MSG_SNAPSHOT_ACK, SNAPSHOT_ACK_STRUCT.pack(1, 0),
+                                                           snapshot_id=snapshot_id))
+                flush_players()
+                server.update_rooms()
+                server.deliver_encoded()
+                snapshot_id += 1
+                drain_players()
+
+            server_sent = delta(server.outgoing.stats(), server_before)
+            client_sent = {key: 0 for key in server_sent}
+            for before, outbox in zip(client_before, outboxes.values()):
+                for key, value in delta(outbox.stats(), before).items():
+                    client_sent[key] += value
+    finally:
+        for sock in socks:
+            sock.close()
+        server.close()
+
+    seconds = ticks / tick_rate
+    label = f"mtu={mtu}" if mtu else "unbundled"
+    for direction, sent in (("server->clients", server_sent), ("clients->server", client_sent)):
+        print(f"{label:10s}  {direction}  messages/s={sent['messages_sent'] / seconds:8.1f}  "
+              f"packets/s={sent['datagrams_sent'] / seconds:8.1f}  "
+              f"messages/packet={sent['messages_sent'] / max(sent['datagrams_sent'], 1):4.2f}  "
+              f"bytes/s={sent['bytes_sent'] / seconds:9.0f}  "
+              f"header bytes/s={sent['header_bytes'] / seconds:8.0f} "
+              f"({sent['header_bytes'] / max(sent['bytes_sent'], 1) * 100:4.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Datagrams and header bytes with and without message bundling")
+    parser.add_argument("--port", type=int, default=9893)
+    parser.add_argument("--rooms", type=int, default=25)
+    parser.add_argument("--room-size", type=int, default=4)
+    parser.add_argument("--mtus", type=int, nargs="+", default=[0, BUNDLE_MTU],
+                        help="bundle sizes to compare (0: one message per datagram)")
+    parser.add_argument("--ticks", type=int, default=250)
+    parser.add_argument("--tick-rate", type=float, default=25)
+    parser.add_argument("--acquire-rates", type=float, nargs="+", default=[ACQUIRES_PER_SECOND, 25],
+                        help="acquires per second per player")
+    args = parser.parse_args()
+
+    for acquire_rate in args.acquire_rates:
+        print(f"acquires/s per player: {acquire_rate}")
+        for mtu in args.mtus:
+            random.seed(0)
+            run(mtu, args.rooms, args.room_size, args.ticks, args.tick_rate, acquire_rate, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import struct
+import sys
+import time
+
+from header import *
+
+
+# Previous implementation of the header codec, kept here as the reference
+# point for the benchmark.
+def legacy_make_packet(msg_type, payload=b"", snapshot_id=0, seq_num=0):
+    header = struct.pack(HEADER_FORMAT, PROTOCOL_ID, VERSION, msg_type,
+                         snapshot_id, seq_num, time.time(), len(payload))
+    return header + payload
+
+
+def legacy_parse_packet(data):
+    fields = struct.unpack(HEADER_FORMAT, data[:HEADER_SIZE])
+    header = {
+        "protocol_id": fields[0],
+        "version": fields[1],
+        "msg_type": fields[2],
+        "snapshot_id": fields[3],
+        "seq_num": fields[4],
+        "timestamp": fields[5],
+        "payload_len": fields[6],
+    }
+    payload = data[HEADER_SIZE:HEADER_SIZE + header["payload_len"]]
+    return header, payload
+
+
+class NullSocket:
+    # Stands in for a UDP socket so the benchmark measures the codec only
+    def sendto(self, data, addr):
+        return len(data)
+
+
+def bench(fn, count, repeats=5):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(count)
+        best = min(best, time.perf_counter() - start)
+    return count / best
+
+
+def run(payload_size, count):
+    payload = bytes(payload_size)
+    addr = ("127.0.0.1", 8888)
+    sock = NullSocket()
+    wire = make_packet(MSG_SNAPSHOT_DELTA, payload=payload, snapshot_id=7, seq_num=9)
+    # The server parses straight out of its receive buffers (see batched_io.py)
+    wire_view = memoryview(wire)
+
+    def legacy_send(n):
+        for i in range(n):
+            sock.sendto(legacy_make_packet(MSG_SNAPSHOT_DELTA, payload, i, i), addr)
+
+    def codec_send(n):
+        for i in range(n):
+            # As the server frames messages (see frame_messages)
+            sock.sendto(HEADER_STRUCT.pack(PROTOCOL_ID, VERSION, MSG_SNAPSHOT_DELTA, i, i,
+                                           time.time(), len(payload)) + payload, addr)
+
+    def legacy_recv(n):
+        for _ in range(n):
+            header, body = legacy_parse_packet(wire)
+            header["msg_type"]
+
+    def codec_recv(n):
+        for _ in range(n):
+            header, body = parse_packet(wire_view)
+            header.msg_type
+
+    results = [
+        ("send", bench(legacy_send, count), bench(codec_send, count)),
+        ("recv", bench(legacy_recv, count), bench(codec_recv, count)),
+    ]
+    for name, before, after in results:
+        print(f"{name} payload={payload_size:5d}B  before={before:12,.0f} pkt/s  "
+              f"after={after:12,.0f} pkt/s  speedup={after / before:.2f}x")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    for payload_size in (0, 32, 400, 1200):
+        run(payload_size, count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import argparse
+import contextlib
+import json
+import os
+import random
+import socket
+import time
+import numpy as np
+
+from header import *
+from game_room import ServerState
+from server import GameServer
+from encode_pipeline import EncodePool
+from tick_scheduler import DurationHistogram
+
+
+# Rate of the bot clients in client.py (about 5 claims per second each)
+ACQUIRES_PER_SECOND = 5
+
+
+def make_players(count):
+    socks = []
+    for _ in range(count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", 0))
+        sock.setblocking(False)
+        socks.append(sock)
+    return socks
+
+
+def run(workers, room_count, room_size, legacy_share, ticks, tick_rate, port):
+    server = GameServer(port=port, tick_rate=tick_rate, telemetry_log=os.devnull,
+                        room_size=room_size, encode_workers=workers)
+    addr = ("127.0.0.1", port)
+    socks = make_players(room_count * room_size)
+    # Every room gets the same mix of version 1 and version 2 players
+    versions = {sock: LEGACY_VERSION if (i % room_size) < legacy_share * room_size else VERSION
+                for i, sock in enumerate(socks)}
+    free_cells = {sock: list(range(400)) for sock in socks}
+    acquire_chance = ACQUIRES_PER_SECOND / tick_rate
+
+    def send_and_serve(packets):
+        # Feeds the server in chunks small enough for its receive buffer
+        for i in range(0, len(packets), 128):
+            for sock, packet in packets[i:i + 128]:
+                sock.sendto(packet, addr)
+            server.process_network_events(0)
+
+    tick_times = []
+    latencies = []
+    histogram = DurationHistogram()
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for msg_type in (MSG_JOIN_REQ, MSG_READY_REQ):
+                send_and_serve([(sock, make_packet(msg_type, version=versions[sock])) for sock in socks])
+            while any(room.state != ServerState.GAME_LOOP for room in server.rooms.values()):
+                server.run_due_ticks()
+                server.process_network_events(0.001)
+
+            cpu_start = time.process_time()
+            snapshot_id = 1
+            for _ in range(ticks):
+                packets = []
+                for sock in socks:
+                    packets.append((sock, make_packet(MSG_SNAPSHOT_ACK, snapshot_id=snapshot_id,
+                                                      version=versions[sock])))
+                    if free_cells[sock] and random.random() < acquire_chance:
+                        cell = free_cells[sock].pop(random.randrange(len(free_cells[sock])))
+                        payload = json.dumps({"x": cell % 20, "y": cell // 20}).encode()
+                        packets.append((sock, make_packet(MSG_ACQUIRE_EVENT, payload, version=versions[sock])))
+                send_and_serve(packets)
+
+                # Tick thread time: the tick itself, with encoding when inline
+                start = time.perf_counter()
+                server.update_rooms()
+                server.deliver_encoded()
+                tick_time = time.perf_counter() - start
+                tick_times.append(tick_time * 1000)
+                histogram.record(tick_time)
+
+                # Keep serving input until every room's packets are out
+                while getattr(server.encoder, "pending", None):
+                    server.process_network_events(server.interval)
+                latencies.append((time.perf_counter() - start) * 1000)
+
+                snapshot_id += 1
+                for sock in socks:
+                    with contextlib.suppress(BlockingIOError):
+                        while True:
+                            sock.recv(MAX_DATAGRAM_SIZE)
+            cpu = (time.process_time() - cpu_start) / ticks * 1000
+    finally:
+        for sock in socks:
+            sock.close()
+        server.close()
+
+    tick_times = np.array(tick_times)
+    latencies = np.array(latencies)
+    label = f"pool({workers})" if isinstance(server.encoder, EncodePool) else "inline"
+    print(f"encode={label:8s}  rooms={room_count:4d}  "
+          f"tick thread p50={np.percentile(tick_times, 50):6.3f} p99={np.percentile(tick_times, 99):6.3f} ms  "
+          f"sent by p50={np.percentile(latencies, 50):6.3f} p99={np.percentile(latencies, 99):6.3f} ms  "
+          f"process cpu/tick={cpu:6.3f} ms")
+    print("  TICK_HISTOGRAM " + histogram.format())
+    if isinstance(server.encoder, EncodePool):
+        print(f"  ENCODE_HISTOGRAM forced_waits={server.encoder.forced_waits} "
+              + server.encoder.latency.format())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tick thread time with inline and pooled snapshot encoding")
+    parser.add_argument("--port", type=int, default=9892)
+    parser.add_argument("--rooms", type=int, nargs="+", default=[25, 100])
+    parser.add_argument("--room-size", type=int, default=4)
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 2],
+                        help="encode pool sizes to compare (0: inline)")
+    parser.add_argument("--legacy-share", type=float, default=0.25,
+                        help="share of version 1 (JSON+zlib) players in every room")
+    parser.add_argument("--ticks", type=int, default=100)
+    parser.add_argument("--tick-rate", type=float, default=25)
+    args = parser.parse_args()
+
+    print(f"host cores: {os.cpu_count()}")
+    for room_count in args.rooms:
+        for workers in args.workers:
+            random.seed(0)
+            run(workers, room_count, args.room_size, args.legacy_share, args.ticks,
+                args.tick_rate, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import argparse
+import contextlib
+import json
+import os
+import random
+import socket
+import time
+import numpy as np
+
+from header import *
+from game_room import ServerState
+from server import GameServer
+
+
+# Rate of the bot clients in client.py (about 5 claims per second each)
+ACQUIRES_PER_SECOND = 5
+
+
+class RoomPlayers:
+    # The sockets of one room's players. They only send; whatever the server
+    # sends back is dropped once their receive buffers fill up.
+
+    def __init__(self, room_size):
+        self.socks = []
+        for _ in range(room_size):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(("127.0.0.1", 0))
+            sock.setblocking(False)
+            self.socks.append(sock)
+        self.free_cells = list(range(400))
+        random.shuffle(self.free_cells)
+
+    def close(self):
+        for sock in self.socks:
+            sock.close()
+
+
+def run(room_count, room_size, ticks, tick_rate, port):
+    server = GameServer(port=port, tick_rate=tick_rate, telemetry_log=os.devnull, room_size=room_size)
+    addr = ("127.0.0.1", port)
+    rooms = [RoomPlayers(room_size) for _ in range(room_count)]
+    acquire_chance = ACQUIRES_PER_SECOND / tick_rate
+    busy = 0.0
+
+    def send_and_serve(packets):
+        # Feeds the server in chunks small enough for its receive buffer
+        nonlocal busy
+        for i in range(0, len(packets), 128):
+            for sock, packet in packets[i:i + 128]:
+                sock.sendto(packet, addr)
+            start = time.thread_time()
+            server.process_network_events(0)
+            busy += time.thread_time() - start
+
+    try:
+        # Join every room and get them all into the game loop, without the join logs
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for msg_type in (MSG_JOIN_REQ, MSG_READY_REQ):
+                send_and_serve([(sock, make_packet(msg_type)) for room in rooms for sock in room.socks])
+            while any(room.state != ServerState.GAME_LOOP for room in server.rooms.values()):
+                server.update_rooms()
+
+        busy = 0.0
+        tick_times = []
+        snapshot_id = 1
+        for _ in range(ticks):
+            # Every player acks the last snapshot; some of them acquire a cell
+            packets = []
+            for room in rooms:
+                for sock in room.socks:
+                    packets.append((sock, make_packet(MSG_SNAPSHOT_ACK, snapshot_id=snapshot_id)))
+                    if room.free_cells and random.random() < acquire_chance:
+                        cell = room.free_cells.pop()
+                        payload = json.dumps({"x": cell % 20, "y": cell // 20}).encode()
+                        packets.append((sock, make_packet(MSG_ACQUIRE_EVENT, payload)))
+            send_and_serve(packets)
+
+            start = time.thread_time()
+            server.update_rooms()
+            tick_time = time.thread_time() - start
+            busy += tick_time
+            tick_times.append(tick_time * 1000)
+            snapshot_id += 1
+    finally:
+        for room in rooms:
+            room.close()
+        server.telemetry.close()
+        server.server_socket.close()
+
+    per_tick = busy / ticks
+    interval = 1.0 / tick_rate
+    tick_times = np.array(tick_times)
+    print(f"rooms={room_count:4d}  cpu/tick={per_tick * 1000:7.3f} ms  "
+          f"update p50={np.percentile(tick_times, 50):6.3f} p99={np.percentile(tick_times, 99):6.3f} ms  "
+          f"core load={per_tick / interval:6.1%}  rooms/core={room_count * interval / per_tick:7.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rooms one server core can tick at the target rate")
+    parser.add_argument("--port", type=int, default=9889)
+    parser.add_argument("--rooms", type=int, nargs="+", default=[1, 10, 50, 100, 200])
+    parser.add_argument("--room-size", type=int, default=4)
+    parser.add_argument("--ticks", type=int, default=100)
+    parser.add_argument("--tick-rate", type=float, default=25)
+    args = parser.parse_args()
+
+    random.seed(0)
+    for room_count in args.rooms:
+        run(room_count, args.room_size, args.ticks, args.tick_rate, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import numpy as np
+import psutil
+
+from header import *
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class BenchClient:
+    # Minimal protocol client: joins, readies up and times acquire round trips
+
+    def __init__(self, server_addr):
+        self.server_addr = server_addr
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.settimeout(0.25)
+
+    def wait_for(self, msg_type, timeout, match=None):
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            try:
+                data, _ = self.sock.recvfrom(MAX_DATAGRAM_SIZE)
+            except socket.timeout:
+                continue
+            for header, payload in parse_packets(data):
+                if header.msg_type == msg_type and (match is None or match(payload)):
+                    return header, payload
+        return None, None
+
+    def request(self, msg_type, reply_type, retries=20):
+        for _ in range(retries):
+            self.sock.sendto(make_packet(msg_type), self.server_addr)
+            header, payload = self.wait_for(reply_type, 0.25)
+            if header:
+                return header, payload
+        raise RuntimeError(f"No reply of type {reply_type} from server")
+
+    def join(self):
+        self.request(MSG_JOIN_REQ, MSG_JOIN_ACK)
+        self.request(MSG_READY_REQ, MSG_READY_ACK)
+
+    def acquire(self, x, y, timeout=1.0):
+        # Returns the acquire -> ACQUIRE_ACK round trip in seconds
+        start = time.perf_counter()
+        self.sock.sendto(make_packet(MSG_ACQUIRE_EVENT, json.dumps({"x": x, "y": y}).encode()), self.server_addr)
+        header, _ = self.wait_for(MSG_ACQUIRE_ACK, timeout,
+                                  match=lambda payload: any(entry[:2] == (x, y)
+                                                            for entry in decode_acquire_acks(payload)))
+        if header is None:
+            return None
+        return time.perf_counter() - start
+
+    def close(self):
+        self.sock.close()
+
+
+def start_server(mode, port):
+    return subprocess.Popen([sys.executable, "server.py", "--mode", mode, "--port", str(port)],
+                            cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def cpu_percent(proc, seconds):
+    before = proc.cpu_times()
+    time.sleep(seconds)
+    after = proc.cpu_times()
+    used = (after.user - before.user) + (after.system - before.system)
+    return used / seconds * 100
+
+
+def run_mode(mode, port, idle_seconds, acquires):
+    server = start_server(mode, port)
+    clients = []
+    try:
+        time.sleep(1.0)
+        proc = psutil.Process(server.pid)
+        idle_cpu = cpu_percent(proc, idle_seconds)
+
+        clients = [BenchClient(("127.0.0.1", port)) for _ in range(4)]
+        for client in clients:
+            client.join()
+        for client in clients:
+            client.wait_for(MSG_SNAPSHOT_FULL, 2.0)
+
+        # Only half of the grid is used so the game never ends mid-run
+        latencies = []
+        cpu_before = proc.cpu_times()
+        start = time.perf_counter()
+        for i in range(acquires):
+            client = clients[i % len(clients)]
+            cell = i % 200
+            rtt = client.acquire(cell % 20, cell // 20)
+            if rtt is not None:
+                latencies.append(rtt * 1000)
+            time.sleep(random.uniform(0.002, 0.012))
+        elapsed = time.perf_counter() - start
+        cpu_after = proc.cpu_times()
+        game_cpu = ((cpu_after.user - cpu_before.user) + (cpu_after.system - cpu_before.system)) / elapsed * 100
+    finally:
+        for client in clients:
+            client.close()
+        server.terminate()
+        server.wait()
+
+    lat = np.array(latencies)
+    print(f"{mode:6s} idle_cpu={idle_cpu:6.2f}%  game_cpu={game_cpu:6.2f}%  "
+          f"ack_latency_ms mean={lat.mean():.3f} p50={np.percentile(lat, 50):.3f} "
+          f"p95={np.percentile(lat, 95):.3f} p99={np.percentile(lat, 99):.3f} "
+          f"lost={acquires - lat.size}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare server loop modes")
+    parser.add_argument("--port", type=int, default=9888)
+    parser.add_argument("--idle-seconds", type=float, default=5.0)
+    parser.add_argument("--acquires", type=int, default=400)
+    parser.add_argument("--modes", nargs="+", default=["poll", "async"])
+    args = parser.parse_args()
+
+    for mode in args.modes:
+        run_mode(mode, args.port, args.idle_seconds, args.acquires)
+
+
+if __name__ == "__main__":
+    main()
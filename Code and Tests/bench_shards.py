@@ -0,0 +1,106 @@
+import argparse
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from header import *
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def start_server(workers, port, room_size):
+    return subprocess.Popen(
+        [sys.executable, "-u", "sharded_server.py", "--workers", str(workers), "--port", str(port),
+         "--room-size", str(room_size), "--telemetry-log", os.devnull],
+        cwd=HERE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+
+
+def read_shard_stats(server, reports):
+    # Collects (players, snapshots_per_sec) from the supervisor's reports
+    for line in server.stdout:
+        if line.startswith("SHARD_STATS"):
+            fields = dict(re.findall(r"(\w+)=(\d+)", line))
+            reports.append((int(fields["players"]), int(fields["snapshots_per_sec"])))
+
+
+def make_players(count):
+    socks = []
+    for _ in range(count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", 0))
+        sock.setblocking(False)
+        socks.append(sock)
+    return socks
+
+
+def send_paced(socks, packet, addr):
+    # Small bursts so the workers' receive buffers do not overflow
+    for i, sock in enumerate(socks):
+        sock.sendto(packet, addr)
+        if i % 100 == 99:
+            time.sleep(0.005)
+
+
+def run(workers, rooms, room_size, seconds, acquire_rate, port):
+    server = start_server(workers, port, room_size)
+    reports = []
+    reader = threading.Thread(target=read_shard_stats, args=(server, reports), daemon=True)
+    reader.start()
+    socks = make_players(rooms * room_size)
+    addr = ("127.0.0.1", port)
+    try:
+        time.sleep(1.0)
+        # Repeated passes cover joins dropped while the workers were busy;
+        # duplicates are answered and otherwise ignored
+        for msg_type in (MSG_JOIN_REQ,) * 3 + (MSG_READY_REQ,) * 3:
+            send_paced(socks, make_packet(msg_type), addr)
+            time.sleep(0.3)
+
+        # Light acquire traffic keeps the games going; replies are never read
+        start = time.monotonic()
+        measured_from = len(reports) + 2
+        while time.monotonic() - start < seconds:
+            for sock in random.sample(socks, max(1, int(len(socks) * acquire_rate / 10))):
+                cell = random.randrange(400)
+                payload = json.dumps({"x": cell % 20, "y": cell // 20}).encode()
+                sock.sendto(make_packet(MSG_ACQUIRE_EVENT, payload), addr)
+            time.sleep(0.1)
+    finally:
+        server.terminate()
+        server.wait()
+        for sock in socks:
+            sock.close()
+
+    steady = reports[measured_from:] or reports[-1:]
+    players = max((players for players, _ in steady), default=0)
+    rate = sum(rate for _, rate in steady) / max(1, len(steady))
+    print(f"workers={workers}  rooms={rooms}  players_seated={players:5d}  "
+          f"snapshots/sec={rate:9.0f}  target={rooms * room_size * 25:7d}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate snapshot rate of the sharded server by worker count")
+    parser.add_argument("--port", type=int, default=9890)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--rooms", type=int, default=600)
+    parser.add_argument("--room-size", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--acquire-rate", type=float, default=1.0,
+                        help="acquires per player per second")
+    args = parser.parse_args()
+
+    print(f"host cores: {os.cpu_count()}")
+    random.seed(0)
+    for workers in args.workers:
+        run(workers, args.rooms, args.room_size, args.seconds, args.acquire_rate, args.port)
+
+
+if __name__ == "__main__":
+    main()
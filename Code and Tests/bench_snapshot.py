@@ -0,0 +1,59 @@
+import json
+import sys
+import time
+import zlib
+import numpy as np
+
+from snapshot_codec import encode_full_snapshot, decode_full_snapshot
+
+
+def make_grid(size, fill, players, rng):
+    # Random claims by `players` players covering `fill` of the grid
+    grid = np.zeros(size * size, dtype=np.int64)
+    claimed = rng.choice(size * size, int(fill * size * size), replace=False)
+    grid[claimed] = rng.integers(1, players + 1, claimed.size)
+    return grid.reshape(size, size).tolist()
+
+
+def timed(fn, count):
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(count):
+            fn()
+        best = min(best, time.perf_counter() - start)
+    return best / count * 1e6
+
+
+def run(size, fill, players, count, rng):
+    grid = make_grid(size, fill, players, rng)
+    state = {"grid": grid, "timestamp": time.time(), "snapshot_id": 1}
+
+    json_payload = zlib.compress(json.dumps(state).encode())
+    binary_payload = encode_full_snapshot(grid, size, size)
+
+    json_encode = timed(lambda: zlib.compress(json.dumps(state).encode()), count)
+    json_decode = timed(lambda: json.loads(zlib.decompress(json_payload).decode()), count)
+    binary_encode = timed(lambda: encode_full_snapshot(grid, size, size), count)
+    # Encoding straight from an owner array skips the list -> array conversion
+    cells = np.asarray(grid, dtype=np.uint8)
+    array_encode = timed(lambda: encode_full_snapshot(cells, size, size), count)
+    binary_decode = timed(lambda: decode_full_snapshot(binary_payload), count)
+
+    print(f"{size}x{size} fill={fill:4.0%}  "
+          f"json+zlib: {len(json_payload):6d}B enc={json_encode:8.1f}us dec={json_decode:8.1f}us | "
+          f"binary: {len(binary_payload):6d}B enc={binary_encode:8.1f}us "
+          f"(from array {array_encode:8.1f}us) dec={binary_decode:8.1f}us | "
+          f"bytes {len(json_payload) / len(binary_payload):5.1f}x  enc {json_encode / binary_encode:5.1f}x")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rng = np.random.default_rng(0)
+    for size in (20, 100):
+        for fill in (0.0, 0.1, 0.5, 1.0):
+            run(size, fill, 4, count, rng)
+
+
+if __name__ == "__main__":
+    main()
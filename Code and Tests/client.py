@@ -1,3 +1,4 @@
+import argparse
 import socket
 import json
 import uuid
@@ -7,6 +8,12 @@ import zlib
 from collections import deque
 from enum import Enum, auto
 from header import *
+from snapshot_codec import decode_full_snapshot, decode_delta_snapshot
+from grid_state import GridState
+from rtt_estimator import RttEstimator
+from acquire_window import SendWindow
+from snapshot_acks import SnapshotReceipts
+from playout_buffer import PlayoutBuffer
 
 class ClientState(Enum):
     WAIT_FOR_JOIN = 1
@@ -17,10 +24,19 @@ class ClientState(Enum):
 
 
 TICK = 0.05
-JOIN_RESEND = 0.25
-READY_RESEND = 0.25
-ACQUIRE_RESEND = 0.06
-START_TIMEOUT = 2.0
+# Retransmission timeout bounds; join, ready and acquire requests are resent
+# after the RTO estimated from the ACKs (see rtt_estimator.py)
+INITIAL_RTO = 0.25
+MIN_RTO = 0.05
+MAX_RTO = 2.0
+# Acquires in flight at once
+ACQUIRE_WINDOW = 8
+# Snapshot playout delay in multiples of the observed jitter: 0 applies
+# snapshots as they arrive, larger values are smoother but later
+PLAYOUT_FACTOR = 3.0
+# Longest a received snapshot waits for its ack when fewer than two are
+# unacked and no acquire goes out to carry it
+ACK_DELAY = 0.05
 
 
 class ClientHeaders:
@@ -41,13 +57,18 @@ class ClientHeaders:
 
 
 class ClientFSM:
-    def __init__(self, socket, client_headers, server_address):
+    def __init__(self, socket, client_headers, server_address, room=None, window=ACQUIRE_WINDOW,
+                 playout_factor=PLAYOUT_FACTOR, ack_delay=ACK_DELAY, bundle_mtu=BUNDLE_MTU):
         self.sock = socket
         self.server_addr = server_address
+        # Room to join; None lets the server match us into any open room
+        self.room = room
         self.headers = client_headers
         self.state = ClientState.WAIT_FOR_JOIN
-        self.grid = [[0 for _ in range(20)] for _ in range(20)]
+        self.grid = GridState(20, 20)
+        # Newest snapshot received (and ACKed), and the one shown in the grid
         self.last_snapshot_id = 0
+        self.applied_snapshot_id = 0
         self.my_id = None  
         
 
@@ -55,28 +76,222 @@ class ClientFSM:
         self.last_ack_time = 0
         self.last_acquire_time = 0
         self.last_snapshot = 0
-        self.last_acquire_request={}
-        self.snapshot_buffer = deque(maxlen=10)
+        # Received snapshots waiting for their playout time
+        self.snapshot_buffer = PlayoutBuffer(playout_factor)
+        # Received snapshots not yet acked, acked together by one cumulative
+        # SNAPSHOT_ACK, inside the next acquire when one goes out first
+        self.receipts = SnapshotReceipts(ack_delay)
+        self.snapshot_acks = 0
+        self.piggybacked_acks = 0
         self.recent_transition = 0
-        self.pending_acquire = None
+        # Sequenced acquires in flight, SACKed by the server
+        self.acquires = SendWindow(window)
+        # Predicted claims (see GridState.predict) by flat cell index, until a
+        # snapshot confirms or rolls them back
+        self.predictions = {}
+        # Cells requested from other threads (the GUI) with the request time
+        self.clicks = deque()
+        self.confirmed = 0
+        self.rollbacks = 0
+        self.rtt = RttEstimator(INITIAL_RTO, MIN_RTO, MAX_RTO)
+        # Header timestamps of every copy sent of the outstanding request
+        self.request_times = []
+        self.retransmit_at = 0
+        self.retransmits = 0
+        self.fast_retransmits = 0
+        self.spurious_retransmits = 0
+        # Snapshots whose grid hash disagreed with ours, deltas whose base we
+        # never applied, and resyncs asked for; no new request before
+        # resync_at while the grid stays wrong
+        self.hash_mismatches = 0
+        self.gaps = 0
+        self.resync_requests = 0
+        self.resync_at = 0
+        self.full_snapshots = 0
         self.running = True
         self.sock.setblocking(False)
+        # Packets posted from other threads (e.g. the GUI), sent by the FSM thread
+        self.outbox = deque()
+        # Everything sent is queued here and framed into datagrams once per
+        # pass of the FSM loop; bundles only once the server has answered
+        # with a version that reads them
+        self.outgoing = PeerOutbox(bundle_mtu)
+        self.server_version = LEGACY_VERSION
+        # Packets of a datagram recv_packet has not returned yet. Datagrams
+        # are received into fresh bytes rather than a reused buffer:
+        # packets are kept across receives, here and in the game loop.
+        self.received = deque()
 
     def transition(self, new_state):
         print(f" Transition: {self.state.name} → {new_state.name}")
         self.state = new_state
         self.recent_transition = 1
 
-    def send_packet(self, msg_type, payload=b"", snapshot_id=0, seq_num=0):
-        packet = make_packet(msg_type, payload=payload, snapshot_id=snapshot_id, seq_num=seq_num)
-        self.sock.sendto(packet, self.server_addr)
+    def send_packet(self, msg_type, payload=b"", snapshot_id=0, seq_num=0, timestamp=None):
+        self.outgoing.queue(self.server_addr,
+                            message(msg_type, payload, snapshot_id=snapshot_id, seq_num=seq_num,
+                                    timestamp=timestamp),
+                            bundle=self.server_version >= VERSION)
+
+    def flush_outgoing(self):
+        if self.outgoing.pending():
+            self.outgoing.flush(self.sock.sendto)
+
+    def send_request(self, msg_type, payload=b""):
+        # Sends the outstanding request, or resends it when a copy is already
+        # out, and arms the retransmission timer
+        now = time.time()
+        if self.request_times:
+            self.retransmits += 1
+            self.rtt.on_timeout()
+        self.request_times.append(now)
+        self.send_packet(msg_type, payload=payload, timestamp=now)
+        self.retransmit_at = now + self.rtt.rto()
+
+    def request_acked(self, header):
+        # The ACK echoes the timestamp of the copy it answers. An echo of an
+        # older copy than the last one sent means the resend was spurious.
+        echo = header.timestamp
+        if echo in self.request_times:
+            self.rtt.sample(time.time() - echo)
+            if echo != self.request_times[-1]:
+                self.spurious_retransmits += 1
+        else:
+            # Unsolicited ACK, or a server that does not echo
+            self.rtt.reset_backoff()
+        self.request_times = []
+
+    def send_acquire(self, request, timeout=True):
+        # Sends a copy of an acquire and arms its retransmission timer. Only
+        # a timeout of the oldest request backs the RTO off.
+        now = time.time()
+        if request.sent:
+            self.retransmits += 1
+            if not timeout:
+                self.fast_retransmits += 1
+            elif request.seq == self.acquires.oldest():
+                self.rtt.on_timeout()
+        request.sent.append(now)
+        self.send_packet(MSG_ACQUIRE_EVENT, payload=request.payload, seq_num=request.seq, timestamp=now)
+        if self.receipts.ack_due:
+            self.send_snapshot_ack()
+            self.piggybacked_acks += 1
+        request.retransmit_at = now + self.rtt.rto()
+
+    def acquires_acked(self, header, acked):
+        # Samples the RTT when the ACK echoes a copy of a request it covers
+        if not acked:
+            return
+        echo = header.timestamp
+        # Servers that do not name the snapshot sent it just before or just
+        # after the ACK; the next one is safe either way
+        covered_by = header.snapshot_id or self.last_snapshot_id + 1
+        sampled = False
+        for request in acked:
+            request.covered_by = covered_by
+            print(f"Received ACK for ({request.x},{request.y}) recv_time={time.time()}")
+            if echo in request.sent and not sampled:
+                self.rtt.sample(time.time() - echo)
+                sampled = True
+                if echo != request.sent[-1]:
+                    self.spurious_retransmits += 1
+        if not sampled:
+            self.rtt.reset_backoff()
+
+    def post_packet(self, msg_type, payload=b""):
+        # Thread-safe: the outgoing queue is owned by the FSM thread
+        self.outbox.append((msg_type, payload))
+
+    def request_acquire(self, x, y):
+        # Thread-safe: the claim is predicted and sent by the FSM thread
+        self.clicks.append((x, y, time.time()))
+
+    def open_acquire(self, x, y, requested_at):
+        # Predicts the claim and sends it; cells the grid already shows taken
+        # or predicted are not requested again
+        if not self.grid.predict(x, y, self.my_id):
+            return False
+        payload = json.dumps({"x": x, "y": y}).encode()
+        request = self.acquires.open(x, y, payload)
+        self.predictions[y * self.grid.cols + x] = request
+        self.send_acquire(request)
+        self.last_acquire_time = request.sent[0]
+        print(f"Sent ACQUIRE event ({x},{y}) AT {request.sent[0]}")
+        print(f"POS_CLIENT x={x} y={y} ts={time.time()}")
+        print(f"PREDICT x={x} y={y} ts={request.sent[0]} "
+              f"delay_ms={(request.sent[0] - requested_at) * 1000:.1f}")
+        return True
+
+    def send_snapshot_ack(self):
+        newest, bitmap, delay = self.receipts.take_ack(time.time())
+        self.snapshot_acks += 1
+        delay = min(SNAPSHOT_ACK_DELAY_MAX, round(delay / SNAPSHOT_ACK_DELAY_UNIT))
+        self.send_packet(MSG_SNAPSHOT_ACK, payload=SNAPSHOT_ACK_STRUCT.pack(bitmap, delay),
+                         snapshot_id=newest)
+
+    def buffer_snapshot(self, header, packet_len, msg_type, state):
+        # Acked on arrival (give or take the ack delay), so the server's
+        # delta bases and RTT follow the network; applied to the grid when
+        # the playout buffer releases it
+        now = time.time()
+        wait, late = self.snapshot_buffer.push((msg_type, state), header.timestamp, now)
+
+        # Logging for the metrics collection script
+        print(f"SNAPSHOT recv_time={now} server_ts={header.timestamp} snapshot_id={header.snapshot_id} "
+              f"seq={header.seq_num} bytes={packet_len} playout_ms={wait * 1000:.2f} late={int(late)}")
+        self.last_snapshot_id = header.snapshot_id
+        self.last_ack_time = now
+        self.receipts.record(header.snapshot_id, now)
+
+    def play_snapshots(self, now):
+        played = self.snapshot_buffer.pop_due(now)
+        for msg_type, state in played:
+            if msg_type == MSG_SNAPSHOT_FULL:
+                self.apply_full_snapshot(state)
+            else:
+                self.apply_delta_snapshot(state)
+        if played:
+            self.reconcile()
+
+    def reconcile(self):
+        # Settles predictions against the authoritative grid: confirmed once
+        # the cell shows as ours, rolled back once it shows someone else's or
+        # the snapshot covering the request left it unclaimed
+        now = time.time()
+        for index, request in list(self.predictions.items()):
+            owner = int(self.grid.cells[index])
+            if owner == self.my_id:
+                outcome = "CONFIRM"
+                self.confirmed += 1
+            elif owner or (request.covered_by is not None and self.applied_snapshot_id >= request.covered_by):
+                outcome = "ROLLBACK"
+                self.rollbacks += 1
+            else:
+                continue
+            del self.predictions[index]
+            self.grid.unpredict(index)
+            print(f"{outcome} x={request.x} y={request.y} ts={now} "
+                  f"latency_ms={(now - request.sent[0]) * 1000:.1f}")
+
+    def flush_outbox(self):
+        while self.outbox:
+            msg_type, payload = self.outbox.popleft()
+            self.send_packet(msg_type, payload=payload)
 
     def recv_packet(self, block=True):
-     
+        # One packet per call; the rest of a bundled datagram is kept for the
+        # next calls, reported with a size of 0
+        if self.received:
+            header, payload = self.received.popleft()
+            return header, payload, 0
         try:
             data, _ = self.sock.recvfrom(4096)
             packet_len = len(data) 
-            header, payload = parse_packet(data)
+            packets = parse_packets(data)
+            if not packets:
+                return None, None, 0
+            self.received.extend(packets[1:])
+            header, payload = packets[0]
             return header, payload,packet_len
         except (socket.timeout, BlockingIOError):
             if block:
@@ -87,6 +302,21 @@ class ClientFSM:
             print(f"Error while parsing packet: {e}")
             return None, None,0
 
+    def recv_packets(self):
+        # Non-blocking. One datagram can carry several packets (a snapshot with
+        # its ACQUIRE_ACK bundled); the datagram size is reported with the first
+        if self.received:
+            packets = [(header, payload, 0) for header, payload in self.received]
+            self.received.clear()
+            return packets
+        try:
+            data, _ = self.sock.recvfrom(4096)
+        except (socket.timeout, BlockingIOError):
+            raise TimeoutError
+        packets = parse_packets(data)
+        return [(header, payload, len(data) if i == 0 else 0)
+                for i, (header, payload) in enumerate(packets)]
+
     def run(self):
         print(f"client: starting...")
         print(f"client: state: {self.state.name}")
@@ -102,22 +332,24 @@ class ClientFSM:
             elif self.state == ClientState.GAME_OVER:
                 self.handle_game_over()
 
+            self.flush_outgoing()
             time.sleep(0.001)
 
     def handle_join(self):
         now = time.time()
 
-        if self.recent_transition or now - self.last_send_time >= JOIN_RESEND:
+        if self.recent_transition or now >= self.retransmit_at:
             self.recent_transition = 0
-            self.send_packet(MSG_JOIN_REQ, payload=b"")
+            join_payload = json.dumps({"room": self.room}).encode() if self.room is not None else b""
+            self.send_request(MSG_JOIN_REQ, payload=join_payload)
             print("Sent JOIN_REQ")
             self.last_send_time = now
 
         header, payload,packet_len = self.recv_packet()
-        if header and header["msg_type"] == MSG_JOIN_ACK:
+        if header and header.msg_type == MSG_JOIN_ACK:
      
             try:
-                payload_dict = json.loads(payload.decode())
+                payload_dict = json.loads(bytes(payload))
                 self.my_id = payload_dict.get("player_id")
                 if self.my_id is None:
                     print("ERROR: Server JOIN_ACK did not contain player_id")
@@ -125,7 +357,9 @@ class ClientFSM:
                     return
 
                 self.headers.my_id = self.my_id
-                print(f"JOIN_ACK received. ID: {self.my_id}")
+                self.server_version = header.version
+                self.request_acked(header)
+                print(f"JOIN_ACK received. ID: {self.my_id} room: {payload_dict.get('room_id')} (protocol v{header.version})")
                 self.transition(ClientState.WAIT_FOR_READY)
             except Exception as e:
                 print(f"Error parsing JOIN_ACK: {e}")
@@ -134,14 +368,15 @@ class ClientFSM:
     def handle_ready(self):
         now = time.time()
 
-        if self.recent_transition or now - self.last_send_time >= READY_RESEND:
+        if self.recent_transition or now >= self.retransmit_at:
             self.recent_transition = 0
-            self.send_packet(MSG_READY_REQ, payload=b"")
+            self.send_request(MSG_READY_REQ, payload=b"")
             print("→ Sent READY_REQ")
             self.last_send_time = now
 
         header, payload,packet_len = self.recv_packet()
-        if header and header["msg_type"] == MSG_READY_ACK:
+        if header and header.msg_type == MSG_READY_ACK:
+            self.request_acked(header)
             print("READY_ACK received. Waiting for start snapshot.")
             self.transition(ClientState.WAIT_FOR_STARTGAME)
 
@@ -149,21 +384,24 @@ class ClientFSM:
         header, payload,packet_len = self.recv_packet()
         now = time.time()
 
-        if header and header["msg_type"] == MSG_SNAPSHOT_FULL:
-            snap_id = header["snapshot_id"]
+        if header and header.msg_type == MSG_SNAPSHOT_FULL:
+            snap_id = header.snapshot_id
             self.last_snapshot_id = snap_id
             print(f"Received full snapshot #{snap_id}")
 
-            payload=zlib.decompress(payload)
-            self.apply_full_snapshot(json.loads(payload.decode()))
+            self.apply_full_snapshot(self.read_full_snapshot(header, payload))
+            # The start snapshot answers the outstanding READY_REQ
+            self.request_acked(header)
    
-            self.send_packet(MSG_SNAPSHOT_ACK, snapshot_id=snap_id)
+            self.receipts.record(snap_id, now)
+            self.send_snapshot_ack()
             self.transition(ClientState.IN_GAME_LOOP)
 
-        elif now - self.last_send_time >= START_TIMEOUT or self.recent_transition == 1:
+        elif self.recent_transition or now >= self.retransmit_at:
+            # READY_REQ is resent on the RTO until the game starts; the wait
+            # for other players backs it off towards MAX_RTO
             self.recent_transition = 0
-            # FIX 3: Send an empty payload.
-            self.send_packet(MSG_READY_REQ, payload=b"")
+            self.send_request(MSG_READY_REQ, payload=b"")
             print("Waiting for full snapshot")
             self.last_send_time = now
 
@@ -174,9 +412,7 @@ class ClientFSM:
         buffer = deque()
         while True:
             try:
-                header, payload,packet_len = self.recv_packet(block=False)
-                if header:
-                    buffer.append((header, payload,packet_len))
+                buffer.extend(self.recv_packets())
             except TimeoutError:
                 break
             except Exception:
@@ -184,8 +420,8 @@ class ClientFSM:
         while buffer:
             header, payload,packet_len = buffer.popleft()
             now = time.time()
-            msg_type = header["msg_type"]
-            snapshot_id = header["snapshot_id"]
+            msg_type = header.msg_type
+            snapshot_id = header.snapshot_id
 
             if msg_type in (MSG_SNAPSHOT_FULL, MSG_SNAPSHOT_DELTA):
                 if snapshot_id <= self.last_snapshot_id:
@@ -194,43 +430,41 @@ class ClientFSM:
 
             
             if msg_type == MSG_SNAPSHOT_FULL:
-                payload=zlib.decompress(payload)
-                state = json.loads(payload.decode())
-                self.apply_full_snapshot(state)
-                print(f"Applied full snapshot #{snapshot_id}")
-
-                # Logging for the metrics collection script
-                print(f"SNAPSHOT recv_time={time.time()} server_ts={header['timestamp']} snapshot_id={snapshot_id} seq={header['seq_num']} bytes={packet_len}")
-                self.last_snapshot_id = snapshot_id
-                self.last_ack_time = now
-                #self.pending_acquire = None
-                self.send_packet(MSG_SNAPSHOT_ACK, snapshot_id=snapshot_id)
+                state = self.read_full_snapshot(header, payload)
+                self.buffer_snapshot(header, packet_len, MSG_SNAPSHOT_FULL, state)
 
           
             elif msg_type == MSG_SNAPSHOT_DELTA:
-                delta = json.loads(payload.decode())
-                self.apply_delta_snapshot(delta)
-                print(f"Applied delta snapshot #{snapshot_id}")
-
-                print(f"SNAPSHOT recv_time={time.time()} server_ts={header['timestamp']} snapshot_id={snapshot_id} seq={header['seq_num']} bytes={packet_len}" )
-                self.last_snapshot_id = snapshot_id
-                self.last_ack_time = now
-                #self.pending_acquire = None
-                self.send_packet(MSG_SNAPSHOT_ACK, snapshot_id=snapshot_id)
+                delta = self.read_delta_snapshot(header, payload)
+                self.buffer_snapshot(header, packet_len, MSG_SNAPSHOT_DELTA, delta)
             
             elif msg_type == MSG_ACQUIRE_ACK:
-                ack=json.loads(payload.decode())
-                
-                if self.last_acquire_request and ack["x"]==self.last_acquire_request["x"] and ack["y"]==self.last_acquire_request["y"]:
-                    print(f"Received ACK for ({ack['x']},{ack['y']}) recv_time={time.time()}")
-                    self.last_acquire_request = {}
-                    self.pending_acquire = None 
+                if header.version >= VERSION:
+                    # Every request the server resolved for us this tick
+                    acks = [(x, y) for x, y, _ in decode_acquire_acks(payload)]
+                else:
+                    ack = json.loads(bytes(payload))
+                    acks = [(ack["x"], ack["y"])]
+
+                self.acquires_acked(header, self.acquires.on_cell_acks(set(acks)))
+                self.reconcile()
+
+            elif msg_type == MSG_ACQUIRE_SACK:
+                cumulative, bitmap = decode_acquire_sack(payload)
+                self.acquires_acked(header, self.acquires.on_sack(cumulative, bitmap))
+                self.reconcile()
+                # Requests sent before one the server has seen are lost, give
+                # or take some reordering: resend them without waiting the RTO
+                reorder = (self.rtt.srtt or 0.0) / 4
+                for request in self.acquires.lost_before(header.timestamp - reorder):
+                    self.send_acquire(request, timeout=False)
+                    print(f"Sent ACQUIRE event ({request.x},{request.y})")
 
 
             elif msg_type == MSG_LEADERBOARD:
                 print("Game Over message received (Leaderboard)")
                 try:
-                    lb = json.loads(payload.decode())
+                    lb = json.loads(bytes(payload))
                     results = lb.get("results", [])
                     print("Leaderboard:")
                     for entry in results:
@@ -241,6 +475,8 @@ class ClientFSM:
                 except Exception as e:
                     print(f"Failed to parse leaderboard payload: {e}")
 
+                # Show the final grid without waiting for playout
+                self.play_snapshots(float("inf"))
                 self.transition(ClientState.GAME_OVER)
                 return
 
@@ -249,72 +485,170 @@ class ClientFSM:
                 continue
 
 
+        self.play_snapshots(time.time())
+        self.flush_outbox()
         now = time.time()
         
-        if not self.pending_acquire:
+        while self.clicks and self.acquires.has_room():
+            self.open_acquire(*self.clicks.popleft())
+
+        if self.acquires.has_room():
             if random.random() < (TICK / random.uniform(3, 8)):
                 x = random.randint(0, 19)
                 y = random.randint(0, 19)
-                if self.grid[y][x] ==0:
-                    payload_dictionary = {"x": x, "y": y}
-                    payload = json.dumps(payload_dictionary).encode()
-
-                    self.send_packet(MSG_ACQUIRE_EVENT, payload=payload)
-                    self.pending_acquire = payload
-                    self.last_acquire_time = now
-                    self.last_acquire_request={"x":x,"y":y,"time":time.time()}
-                    print(f"Sent ACQUIRE event ({x},{y}) AT {self.last_acquire_time}")
-                    print(f"POS_CLIENT x={x} y={y} ts={time.time()}")
-        
-        elif self.pending_acquire and now-self.last_acquire_time> ACQUIRE_RESEND:
-            payload_dictionary = {"x": self.last_acquire_request["x"], "y": self.last_acquire_request["y"]}
-            payload = json.dumps(payload_dictionary).encode()
+                self.open_acquire(x, y, now)
+
+        for request in self.acquires.expired(now):
             self.last_acquire_time = now
-            self.send_packet(MSG_ACQUIRE_EVENT, payload=payload)
-            print(f"Sent ACQUIRE event ({self.last_acquire_request['x']},{self.last_acquire_request['y']})")
+            self.send_acquire(request)
+            print(f"Sent ACQUIRE event ({request.x},{request.y})")
+
+        # Received snapshots no acquire carried an ack for
+        if self.receipts.due(now):
+            self.send_snapshot_ack()
                 
 
     def handle_game_over(self):
         print("Game Over! Finalizing session...")
+        self.print_stats()
         
         self.send_packet(MSG_END_GAME, payload=b"ACK")
+        self.flush_outgoing()
         print("Sent game over acknowledgment to server.")
         time.sleep(1)
         self.sock.close()
         self.running = False
         print("Client session ended.")
 
+    def print_stats(self):
+        srtt = (self.rtt.srtt or 0.0) * 1000
+        rttvar = (self.rtt.rttvar or 0.0) * 1000
+        print(f"RTT_STATS srtt_ms={srtt:.1f} rttvar_ms={rttvar:.1f} rto_ms={self.rtt.rto() * 1000:.1f} "
+              f"samples={self.rtt.samples} retransmits={self.retransmits} "
+              f"fast={self.fast_retransmits} spurious={self.spurious_retransmits}")
+        predicted = self.confirmed + self.rollbacks
+        rate = self.rollbacks / predicted if predicted else 0.0
+        print(f"PREDICTION_STATS confirmed={self.confirmed} rolled_back={self.rollbacks} "
+              f"rollback_rate={rate:.4f}")
+        playout = self.snapshot_buffer
+        print(f"PLAYOUT_STATS snapshots={playout.received} underruns={playout.underruns} "
+              f"mean_delay_ms={playout.mean_delay() * 1000:.2f} jitter_ms={playout.jitter * 1000:.2f} "
+              f"factor={playout.factor}")
+        print(f"ACK_STATS snapshots={self.snapshot_buffer.received} acks={self.snapshot_acks} "
+              f"piggybacked={self.piggybacked_acks}")
+        outgoing = self.outgoing.stats()
+        print(f"OUTBOUND_STATS messages={outgoing['messages_sent']} datagrams={outgoing['datagrams_sent']} "
+              f"bytes={outgoing['bytes_sent']} header_bytes={outgoing['header_bytes']}")
+        print(f"SYNC_STATS hash_mismatches={self.hash_mismatches} gaps={self.gaps} "
+              f"resync_requests={self.resync_requests} full_snapshots={self.full_snapshots}")
+
+    def read_full_snapshot(self, header, payload):
+        # The header version says which payload format the server used
+        if header.version >= VERSION:
+            state_hash, _ = SNAPSHOT_PREFIX_STRUCT.unpack_from(payload)
+            return {"grid": decode_full_snapshot(payload[SNAPSHOT_PREFIX_STRUCT.size:]),
+                    "snapshot_id": header.snapshot_id, "hash": state_hash}
+        return json.loads(zlib.decompress(payload).decode())
+
+    def read_delta_snapshot(self, header, payload):
+        # Both formats are turned into flat cell indices and owners
+        if header.version >= VERSION:
+            state_hash, base = SNAPSHOT_PREFIX_STRUCT.unpack_from(payload)
+            indices, owners = decode_delta_snapshot(payload[SNAPSHOT_PREFIX_STRUCT.size:], self.grid.size)
+            return {"indices": indices, "owners": owners, "snapshot_id": header.snapshot_id,
+                    "hash": state_hash, "base": base}
+
+        delta = json.loads(bytes(payload))
+        changes_list = delta.get("changes", [])
+        return {
+            "indices": [y * self.grid.cols + x for y, x, _ in changes_list],
+            "owners": [owner for _, _, owner in changes_list],
+            "snapshot_id": delta["snapshot_id"],
+        }
+
     def apply_full_snapshot(self, state):
-        self.grid = state["grid"]
-        self.last_snapshot_id = state["snapshot_id"]
-        print(f"[FULL] Applied full snapshot #{self.last_snapshot_id}")
+        self.grid.apply_full(state["grid"])
+        self.applied_snapshot_id = state["snapshot_id"]
+        print(f"[FULL] Applied full snapshot #{self.applied_snapshot_id}")
+        self.full_snapshots += 1
+        self.resync_at = 0
+        self.verify_hash(state)
         # Placeholder for position error (Required for 2% Loss Test)
         #print(f"POSITION_ERR error=0.0 recv_time={time.time()}")
 
     def apply_delta_snapshot(self, delta):
-        if not hasattr(self, "grid"):
-            print("No base grid, ignoring delta snapshot.")
+        indices = delta.get("indices")
+        if indices is None:
+            print("Delta snapshot missing cell indices.")
             return
-        changes_list = delta.get("changes")
-        if changes_list is None:
-            print("Delta snapshot missing 'changes' key.")
+        base = delta.get("base")
+        if base is not None and base > self.applied_snapshot_id:
+            # Built on a snapshot this grid never got to; applying it would
+            # skip that snapshot's changes
+            self.gaps += 1
+            print(f"GAP snapshot_id={delta['snapshot_id']} base={base} applied={self.applied_snapshot_id}")
+            self.request_resync(self.applied_snapshot_id)
             return
 
-        for (y, x, new_val) in changes_list:
-            self.grid[y][x] = new_val
+        self.grid.apply_delta(indices, delta["owners"])
+
+        self.applied_snapshot_id = delta["snapshot_id"]
+        print(f"[DELTA] Applied {len(indices)} changes (snapshot #{self.applied_snapshot_id})")
+        self.verify_hash(delta)
 
-        self.last_snapshot_id = delta["snapshot_id"]
-        print(f"[DELTA] Applied {len(changes_list)} changes (snapshot #{self.last_snapshot_id})")
+    def verify_hash(self, state):
+        # A grid that no longer hashes like the server's asks for a full
+        # snapshot, again after an RTO if it is still wrong by then
+        expected = state.get("hash")
+        if expected is None or expected == self.grid.hash:
+            return
+        self.hash_mismatches += 1
+        print(f"HASH_MISMATCH snapshot_id={self.applied_snapshot_id} "
+              f"ours={self.grid.hash:016x} server={expected:016x}")
+        self.request_resync(NO_BASE)
+
+    def request_resync(self, base):
+        # Asks for a delta from base (a snapshot our grid still matches) or,
+        # with NO_BASE, a full snapshot; at most once per RTO
+        now = time.time()
+        if now < self.resync_at:
+            return
+        self.resync_at = now + self.rtt.rto()
+        self.resync_requests += 1
+        self.send_packet(MSG_RESYNC_REQ, payload=RESYNC_REQ_STRUCT.pack(base),
+                         snapshot_id=self.last_snapshot_id)
+        kind = "full" if base == NO_BASE else f"from #{base}"
+        print(f"Sent RESYNC request ({kind}) at snapshot #{self.last_snapshot_id}")
 
 
 
 def main():
-    server_address = ("127.0.0.1", 8888)
+    parser = argparse.ArgumentParser(description="Grid Clash bot client")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--room", type=int, default=None,
+                        help="room to join (default: any open room)")
+    parser.add_argument("--window", type=int, default=ACQUIRE_WINDOW,
+                        help="acquire requests in flight at once (at most 32)")
+    parser.add_argument("--playout-factor", type=float, default=PLAYOUT_FACTOR,
+                        help="snapshot playout delay in multiples of the jitter "
+                             "(0: apply on arrival; higher: smoother, more latency)")
+    parser.add_argument("--ack-delay-ms", type=float, default=ACK_DELAY * 1000,
+                        help="longest a snapshot ack is held back to be combined with the next "
+                             "one (0: ack every receive cycle)")
+    parser.add_argument("--bundle-mtu", type=int, default=BUNDLE_MTU,
+                        help="largest datagram the messages of one loop pass may share "
+                             "(0: one message per datagram)")
+    args = parser.parse_args()
+
+    server_address = (args.host, args.port)
     clientSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     clientSocket.settimeout(TICK)
 
     headers = ClientHeaders()
-    fsm = ClientFSM(clientSocket, headers, server_address)
+    fsm = ClientFSM(clientSocket, headers, server_address, room=args.room, window=args.window,
+                    playout_factor=args.playout_factor, ack_delay=args.ack_delay_ms / 1000,
+                    bundle_mtu=args.bundle_mtu)
 
     print(f"Client started.")
     print(f"Initial state: {fsm.state.name}")
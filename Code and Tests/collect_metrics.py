@@ -30,6 +30,7 @@ def parse_client_logs(log_dir):
         
         prev_recv_time = 0
         prev_server_ts = 0
+        prev_shown_time = 0
 
         with open(filepath, 'r') as f:
             for line in f:
@@ -46,14 +47,23 @@ def parse_client_logs(log_dir):
 
                         client_update_counts[c_id].append(recv_time)
                         latency = (recv_time - server_ts) * 1000
+                        # Time held by the client's playout buffer, and whether
+                        # the snapshot arrived after its playout time
+                        playout_ms = parts.get("playout_ms", 0)
+                        underrun = int(parts.get("late", 0))
+                        shown_time = recv_time + playout_ms / 1000
                         jitter = 0
+                        shown_jitter = 0
                         if prev_recv_time > 0:
                             diff_cur = recv_time - server_ts
                             diff_prev = prev_recv_time - prev_server_ts
                             jitter = abs(diff_cur - diff_prev) * 1000
+                            # Same jitter at the time the snapshot reached the grid
+                            shown_jitter = abs((shown_time - server_ts) - (prev_shown_time - prev_server_ts)) * 1000
 
                         prev_recv_time = recv_time
                         prev_server_ts = server_ts
+                        prev_shown_time = shown_time
 
                         packet_size = parts.get("bytes", 0)
                         metrics_rows.append({
@@ -64,6 +74,9 @@ def parse_client_logs(log_dir):
                             "recv_time_ms": recv_time * 1000,
                             "latency_ms": latency,
                             "jitter_ms": jitter,
+                            "playout_ms": playout_ms,
+                            "shown_jitter_ms": shown_jitter,
+                            "underrun": underrun,
                             "packet_size":packet_size
                        
                         })
@@ -94,11 +107,64 @@ def parse_client_logs(log_dir):
 
     return metrics_rows, sent_events, acked_events, client_update_counts,client_positions,clients_received_snapshots_counter
 
+def parse_prediction_logs(log_dir):
+    # Predicted claims and how they settled: PREDICT lines carry the time from
+    # the request to the prediction showing, CONFIRM and ROLLBACK lines the
+    # time from the request to the snapshot that settled it
+    stats = {"predict_delays": [], "confirm_latencies": [], "rollback_latencies": []}
+    keys = {"PREDICT ": ("predict_delays", "delay_ms"),
+            "CONFIRM ": ("confirm_latencies", "latency_ms"),
+            "ROLLBACK ": ("rollback_latencies", "latency_ms")}
+    for cf in os.listdir(log_dir):
+        if not (cf.startswith("client") and cf.endswith("_log.txt")):
+            continue
+        with open(os.path.join(log_dir, cf), 'r') as f:
+            for line in f:
+                for prefix, (name, key) in keys.items():
+                    if line.startswith(prefix):
+                        try:
+                            parts = {k: float(v) for k, v in [x.split('=') for x in line.split() if '=' in x]}
+                            stats[name].append(parts[key])
+                        except (ValueError, KeyError):
+                            pass
+    return stats
+
+def parse_server_events(events_path):
+    # Same rows as parse_server_logs, read from the server's CSV event log
+    metrics_rows = []
+    server_positions=[]
+    snapshots_counter=0
+
+    with open(events_path, 'r', newline='') as f:
+        for row in csv.DictReader(f):
+            event = row["event"]
+            if event == "CPU_USAGE":
+                metrics_rows.append({
+                    "cpu_usage": float(row["percent"]),
+                    "cpu_usage_ts": float(row["ts"]),
+                })
+            elif event == "POS_SERVER":
+                server_positions.append({
+                    "server_x_pos": float(row["x"]),
+                    "server_y_pos": float(row["y"]),
+                    "server_pos_ts": float(row["ts"]),
+                    "client": float(row["player"])
+                })
+            elif event == "SNAPSHOT_SEND":
+                snapshots_counter+=1
+
+    return metrics_rows,server_positions,snapshots_counter
+
 def parse_server_logs(log_dir):
     metrics_rows = []
     server_positions=[]
     snapshots_counter=0
 
+    # Servers started with --telemetry-log write metrics events here
+    events_path = os.path.join(log_dir, "server_events.csv")
+    if os.path.exists(events_path):
+        return parse_server_events(events_path)
+
    
     server_file = [f for f in os.listdir(log_dir) if f.startswith("server") and f.endswith("_log.txt")]
     
@@ -267,6 +333,9 @@ def main():
 
     latencies = [r['latency_ms'] for r in rows]
     jitters = [r['jitter_ms'] for r in rows]
+    playouts = [r['playout_ms'] for r in rows]
+    shown_jitters = [r['shown_jitter_ms'] for r in rows]
+    underruns = sum(r['underrun'] for r in rows)
     errors = [r['perceived_position_error'] for r in rows]
     cpu_usage = [r['cpu'] for r in rows]
     clients_updates = calculate_update_rate(updates)
@@ -279,6 +348,12 @@ def main():
     jitter_med = np.median(jitters) if jitters else 0
     jitter_95 = np.percentile(jitters, 95) if jitters else 0
 
+    playout_mean = np.mean(playouts) if playouts else 0
+    playout_95 = np.percentile(playouts, 95) if playouts else 0
+    shown_jitter_mean = np.mean(shown_jitters) if shown_jitters else 0
+    shown_jitter_95 = np.percentile(shown_jitters, 95) if shown_jitters else 0
+    underrun_rate = underruns / len(rows) * 100
+
     error_mean = np.mean(errors) if errors else 0
     error_med = np.median(errors) if errors else 0
     error_95 = np.percentile(errors, 95) if errors else 0
@@ -296,6 +371,9 @@ def main():
 
     if jitters:
         print(f"Jitter (ms):Mean={jitter_mean:.2f} | Median={jitter_med:.2f} | 95th={jitter_95:.2f}")
+        print(f"Playout Delay (ms):Mean={playout_mean:.2f} | 95th={playout_95:.2f} | "
+              f"Underruns={underruns} ({underrun_rate:.2f} %)")
+        print(f"Shown Jitter (ms):Mean={shown_jitter_mean:.2f} | 95th={shown_jitter_95:.2f}")
     
     if errors:
         print(f"Pos Error:  Mean={error_mean:.4f} | Median={error_med:.4f} | 95th={error_95:.4f}")
@@ -309,16 +387,32 @@ def main():
     for cid in sorted(client_bandwidths.keys()):
         print(f"  Client {cid}: {client_bandwidths[cid]:.2f} kbps")
 
+    predictions = parse_prediction_logs(log_dir)
+    settled = len(predictions["confirm_latencies"]) + len(predictions["rollback_latencies"])
+    rollback_rate = len(predictions["rollback_latencies"]) / settled * 100 if settled else 0
+    if predictions["predict_delays"]:
+        print("-" * 30)
+        print(f"Predicted claims: {len(predictions['predict_delays'])} | "
+              f"shown after Mean={np.mean(predictions['predict_delays']):.2f} ms "
+              f"(plus one frame to draw)")
+        if predictions["confirm_latencies"]:
+            print(f"Confirmed by snapshot after Mean={np.mean(predictions['confirm_latencies']):.2f} | "
+                  f"95th={np.percentile(predictions['confirm_latencies'], 95):.2f} ms")
+        print(f"Rollback Rate: {rollback_rate:.2f} % ({len(predictions['rollback_latencies'])}/{settled})")
+
     avg_bw = np.mean(list(client_bandwidths.values())) if client_bandwidths else 0
     with open(os.path.join(log_dir, "stats_summary.txt"), "w") as f:
         f.write(f"Test: {mode}\n")
         f.write(f"Latency: Mean={latency_mean:.2f}, Median={lattency_med:.2f}, 95th={latency_per95:.2f}\n")
         f.write(f"Jitter: Mean={jitter_mean:.2f}, Median={jitter_med:.2f}, 95th={jitter_95:.2f}\n")
+        f.write(f"Playout: Mean={playout_mean:.2f}, 95th={playout_95:.2f}, Underruns={underruns} ({underrun_rate:.2f}%)\n")
+        f.write(f"Shown Jitter: Mean={shown_jitter_mean:.2f}, 95th={shown_jitter_95:.2f}\n")
         f.write(f"Error: Mean={error_mean:.4f}, Median={error_med:.4f}, 95th={error_95:.4f}\n")
         f.write(f"Bandwidth (Avg Total): {avg_bw:.2f} kbps\n")
         f.write(f"CPU: {cpu_mean:.2f}%\n")
         f.write(f"Update Rate: {clients_updates:.2f} ups\n")
         f.write(f"Loss Rate: {loss_rate:.2f} %\n")
+        f.write(f"Rollback Rate: {rollback_rate:.2f} %\n")
 
 
     print(f"[INFO] Stats saved to {os.path.join(log_dir, 'stats_summary.txt')}")
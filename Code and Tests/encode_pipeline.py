@@ -0,0 +1,223 @@
+import collections
+import concurrent.futures
+import dataclasses
+import json
+import time
+import zlib
+import numpy as np
+from socket import socketpair
+from header import *
+from snapshot_codec import encode_full_snapshot, encode_delta_snapshot, FULL_SNAPSHOT_STRUCT
+from tick_scheduler import DurationHistogram
+
+
+@dataclasses.dataclass(frozen=True)
+class SnapshotTarget:
+    player_id: int
+    address: tuple
+    version: int
+    # Snapshot to send a delta from (the acked baseline, or the base a
+    # resync asked for), or None for a full snapshot
+    from_id: object
+    # Version 2 ACK entries (x, y, result) sent along with the snapshot
+    acks: tuple = ()
+    # Request timestamp echoed in the ACK header
+    ack_timestamp: float = None
+    # (cumulative, bitmap) of the player's sequenced acquires, SACKed instead
+    sack: tuple = None
+
+
+@dataclasses.dataclass(frozen=True)
+class SnapshotJob:
+    # One room broadcast, captured on the tick thread. Nothing in it is
+    # touched by the room afterwards: cells is a copy of the grid and grid
+    # versions are read-only.
+    snapshot_id: int
+    seq_num: int
+    cells: np.ndarray
+    rows: int
+    cols: int
+    # from_id -> (indices, owners) from grid_versions.diff
+    changes: dict
+    targets: tuple
+    piggyback_acks: bool = True
+    submitted: float = 0.0
+    # Zobrist hash of cells, leading every version 2 snapshot payload
+    state_hash: int = 0
+
+
+def full_snapshot_payload(job, version, cache):
+    payload = cache.get(version)
+    if payload is None:
+        if version >= VERSION:
+            payload = encode_full_snapshot(job.cells, job.rows, job.cols)
+        else:
+            legacy_snapshot = {
+                "grid": job.cells.reshape(job.rows, job.cols).tolist(),
+                "timestamp": time.time(),
+                "snapshot_id": job.snapshot_id
+            }
+            payload = zlib.compress(json.dumps(legacy_snapshot).encode())
+        cache[version] = payload
+    return payload
+
+
+def delta_snapshot_payload(job, version, from_id, full_payloads):
+    indices, owners = job.changes[from_id]
+
+    if version < VERSION:
+        changes = [[i // job.cols, i % job.cols, o]
+                   for i, o in zip(indices.tolist(), owners.tolist())]
+        delta_payload = json.dumps({
+            "snapshot_id": job.snapshot_id,
+            "changes": changes
+        }).encode()
+        return MSG_SNAPSHOT_DELTA, delta_payload
+
+    delta_payload = encode_delta_snapshot(indices, owners, job.rows * job.cols)
+
+    # A full snapshot wins once enough of the grid changed; it can never
+    # be smaller than its preamble, so skip encoding it for tiny deltas
+    if len(delta_payload) > FULL_SNAPSHOT_STRUCT.size:
+        full_payload = full_snapshot_payload(job, version, full_payloads)
+        if len(full_payload) < len(delta_payload):
+            return MSG_SNAPSHOT_FULL, full_payload
+    return MSG_SNAPSHOT_DELTA, delta_payload
+
+
+def encode_snapshot_job(job):
+    # [(target, messages)] in target order, messages being (Message, bundle)
+    # pairs for the peer's PeerOutbox. Full payloads are encoded once per
+    # protocol version and delta payloads once per (version, acked snapshot).
+    full_payloads = {}
+    delta_payloads = {}
+    encoded = []
+    for target in job.targets:
+        if target.from_id is None:
+            msg_type = MSG_SNAPSHOT_FULL
+            payload = full_snapshot_payload(job, target.version, full_payloads)
+        else:
+            key = (target.version, target.from_id)
+            if key not in delta_payloads:
+                delta_payloads[key] = delta_snapshot_payload(job, target.version, target.from_id, full_payloads)
+            msg_type, payload = delta_payloads[key]
+        if target.version >= VERSION:
+            base = NO_BASE if msg_type == MSG_SNAPSHOT_FULL else target.from_id
+            payload = SNAPSHOT_PREFIX_STRUCT.pack(job.state_hash, base) + payload
+
+        snapshot = message(msg_type, payload, snapshot_id=job.snapshot_id,
+                           seq_num=job.seq_num, version=target.version)
+        # One ACK per player per tick listing every resolved request, or a
+        # SACK of its sequenced requests. Its snapshot_id is this snapshot,
+        # the first to show the results.
+        if target.sack is not None:
+            ack = message(MSG_ACQUIRE_SACK, encode_acquire_sack(*target.sack),
+                          snapshot_id=job.snapshot_id, seq_num=job.seq_num,
+                          version=target.version, timestamp=target.ack_timestamp)
+        elif target.acks:
+            ack = message(MSG_ACQUIRE_ACK, encode_acquire_acks(target.acks),
+                          snapshot_id=job.snapshot_id, seq_num=job.seq_num,
+                          version=target.version, timestamp=target.ack_timestamp)
+        else:
+            encoded.append((target, [(snapshot, True)]))
+            continue
+        if job.piggyback_acks:
+            encoded.append((target, [(snapshot, True), (ack, True)]))
+        else:
+            encoded.append((target, [(ack, False), (snapshot, True)]))
+    return encoded
+
+
+class InlineEncoder:
+    # Encodes on the tick thread as part of the broadcast
+
+    wake_sockets = []
+
+    def submit(self, job, on_done):
+        on_done(encode_snapshot_job(job))
+
+    def time_until_due(self):
+        return None
+
+    def complete(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class EncodePool:
+    # Encodes snapshot jobs on worker threads while the tick thread goes back
+    # to draining input. Workers wake the server's select() through a
+    # socketpair as they finish, and complete() hands finished jobs back on
+    # the tick thread in submission order. A job still running max_latency
+    # after it was submitted is waited for there, which bounds how long a
+    # tick's packets can be held back.
+
+    def __init__(self, workers=2, max_latency=0.02):
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="encode")
+        self.max_latency = max_latency
+        # (deadline, future, on_done, submitted) in submission order
+        self.pending = collections.deque()
+        self.wake_socket, self.wake_sender = socketpair()
+        self.wake_socket.setblocking(False)
+        self.wake_sender.setblocking(False)
+        self.wake_sockets = [self.wake_socket]
+        # Submit to hand-back time of every job
+        self.latency = DurationHistogram()
+        self.forced_waits = 0
+
+    def submit(self, job, on_done):
+        future = self.executor.submit(encode_snapshot_job, job)
+        self.pending.append((job.submitted + self.max_latency, future, on_done, job.submitted))
+        future.add_done_callback(self.wake)
+
+    def wake(self, future):
+        try:
+            self.wake_sender.send(b"\0")
+        except OSError:
+            # Buffer full: the server is already due to wake up
+            pass
+
+    def time_until_due(self):
+        # Time left before the oldest job must be waited for
+        if not self.pending:
+            return None
+        return max(0.0, self.pending[0][0] - time.monotonic())
+
+    def complete(self):
+        # Hands back finished jobs in order, stopping at the first one that
+        # is still running and not yet due
+        try:
+            while self.wake_socket.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        while self.pending:
+            deadline, future, on_done, submitted = self.pending[0]
+            if not future.done():
+                if time.monotonic() < deadline:
+                    break
+                self.forced_waits += 1
+            self.pending.popleft()
+            try:
+                encoded = future.result()
+            except Exception as e:
+                print(f"Error encoding snapshot: {e}")
+                continue
+            on_done(encoded)
+            self.latency.record(time.monotonic() - submitted)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.wake_socket.close()
+        self.wake_sender.close()
+
+
+def make_encoder(workers=0, max_latency=0.02):
+    # Worker pool when workers > 0, inline encoding otherwise
+    if workers > 0:
+        return EncodePool(workers, max_latency)
+    return InlineEncoder()
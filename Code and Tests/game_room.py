@@ -0,0 +1,546 @@
+import dataclasses
+import enum
+import functools
+import time
+import json
+import numpy as np
+from header import *
+from grid_state import GridState
+from grid_versions import GridVersions
+from encode_pipeline import InlineEncoder, SnapshotJob, SnapshotTarget
+from rate_control import SnapshotRate
+from acquire_window import ReceiveWindow
+from snapshot_acks import SnapshotDelivery, acked_snapshots
+
+
+@dataclasses.dataclass
+class Player:
+    id: int
+    address: tuple
+    ready: bool = False
+    last_update_time: float = 0
+    # Newest acked snapshot with a grid version kept: the player's baseline
+    last_snapshot_id: int = 0
+    # Last snapshot sent to the player in full
+    keyframe_id: int = 0
+    # The player asked for a resync: its next snapshot is a delta from
+    # resync_base, or full when that is None
+    resync_due: bool = False
+    resync_base: int = None
+    # Monotonic time before which no further resync is answered
+    resync_at: float = 0
+    state_data: dict = dataclasses.field(default_factory=dict)
+    score: int = 0
+    version: int = LEGACY_VERSION
+    # Adaptive snapshot rate, when the server runs with a RateConfig
+    rate: SnapshotRate = None
+    # Sequenced acquires received, once the player sends any (version 2)
+    acquire_window: ReceiveWindow = None
+    # Snapshots sent to the player and what its acks reported of them
+    delivery: SnapshotDelivery = dataclasses.field(default_factory=SnapshotDelivery)
+
+
+class ServerState(enum.Enum):
+    WAITING_FOR_JOIN = 1
+    WAITING_FOR_INIT = 2
+    GAME_LOOP = 3
+    GAME_OVER = 4
+
+
+class GameRoom:
+    # One match: its own players, state machine, grid, snapshot ids and grid
+    # versions. The GameServer owns the socket and the tick scheduler, routes
+    # each packet to the room of its sender and ticks every room.
+
+    def __init__(self, room_id, io, telemetry, room_size=4, piggyback_acks=True, delta_depth=32,
+                 encoder=None, rate_config=None, keyframe_interval=0, outgoing=None):
+        self.room_id = room_id
+        # Datagrams go out through io.sendto: the server's batched I/O (see
+        # batched_io.py), which may queue them until it flushes the tick, or a
+        # plain socket
+        self.io = io
+        # Every message is queued per player (see PeerOutbox) and framed into
+        # datagrams when the server flushes the tick; a room given no outbox
+        # flushes its own after each update
+        self.owns_outgoing = outgoing is None
+        self.outgoing = PeerOutbox() if outgoing is None else outgoing
+        # Snapshots are encoded by the encoder (see encode_pipeline.py), inline
+        # or on a worker pool, and sent when it hands them back
+        self.encoder = encoder or InlineEncoder()
+        # Per-player AIMD snapshot rates (see rate_control.py); None sends every tick
+        self.rate_config = rate_config
+        self.telemetry = telemetry
+        self.state = ServerState.WAITING_FOR_JOIN
+        self.seq_num = 0
+        # Set once the game is over and every player has left
+        self.closed = False
+
+        # Game fields
+        self.players = {}
+        # Every address that joined, so the server can drop its routes on close
+        self.addresses = set()
+        self.room_size = room_size
+        self.grid_size = 20
+        self.game_running = False
+        self.ready_count = 0
+
+        # Time fields
+        self.join_start_time = time.time()
+        self.game_start_time = 0
+        self.game_over_time = 0
+        self.last_leaderboard_time = 0
+        self.game_over_patience = 3
+        self.leaderboard_resend = 0.1
+        # Shortest gap between two resyncs answered to one player
+        self.resync_interval = 0.2
+
+        # Snapshot fields
+        self.grid = GridState(self.grid_size, self.grid_size)
+        # Grid at recent snapshots and at every player's baseline, so each
+        # player gets a delta from the last snapshot it acked
+        self.grid_versions = GridVersions(self.grid.size, depth=delta_depth)
+        # Snapshots between forced full snapshots to each player (0: never;
+        # players still get one when they ask for a resync)
+        self.keyframe_interval = keyframe_interval
+        self.snapshot_id = 0
+        self.snapshots_sent = 0
+        # Cells claimed since the last broadcast, as flat indices and owners
+        self.dirty_indices = []
+        self.dirty_owners = []
+
+        # Acquire fields
+        # Acquires received since the last tick, resolved together at tick time
+        self.pending_acquires = []
+        # Send version 2 ACKs inside the player's snapshot datagram
+        self.piggyback_acks = piggyback_acks
+        # Packets received while the game runs, reported at game over
+        self.packets_received = 0
+        self.acquires_received = 0
+        self.resync_requests = 0
+        self.resyncs_ignored = 0
+
+    def is_open(self):
+        # Still taking players
+        return self.state == ServerState.WAITING_FOR_JOIN and len(self.players) < self.room_size
+
+    def update_state(self, ticks=1):
+        
+        if self.state == ServerState.WAITING_FOR_JOIN:
+            self.update_waiting_for_join()
+        
+        elif self.state == ServerState.WAITING_FOR_INIT:
+            self.run_state_waiting_for_init()
+        
+        elif self.state == ServerState.GAME_LOOP:
+            self.update_game_loop(ticks)
+        
+        elif self.state == ServerState.GAME_OVER:
+            self.run_state_game_over()
+
+        if self.owns_outgoing:
+            self.outgoing.flush(self.io.sendto)
+
+    def handle_datagram(self, addr, packets):
+        # Several packets may share a datagram, e.g. an acquire bundled with
+        # the player's SNAPSHOT_ACK
+        if self.state == ServerState.GAME_LOOP:
+            self.packets_received += 1
+        for header, payload in packets:
+            self.handle_packet(addr, header, payload)
+
+    def handle_packet(self, addr, header, payload):
+        msg_type = header.msg_type
+
+        
+        if self.state == ServerState.WAITING_FOR_JOIN:
+            if msg_type == MSG_JOIN_REQ:
+                self.handle_join_req(addr, header)
+            elif msg_type == MSG_READY_REQ:
+                self.handle_ready_req(addr, header)
+        
+        elif self.state == ServerState.GAME_LOOP:
+            if msg_type == MSG_ACQUIRE_EVENT:
+                self.handle_acquire_event(addr, header, payload)
+            elif msg_type == MSG_SNAPSHOT_ACK:
+                self.handle_snapshot_ack(addr, header, payload)
+            elif msg_type == MSG_RESYNC_REQ:
+                self.handle_resync_req(addr, header, payload)
+        
+        elif self.state == ServerState.GAME_OVER:
+            if msg_type==MSG_END_GAME:
+                if self.players.pop(addr, None):
+                    print(f"Player at {addr} acknowledged Game Over.")
+
+    def handle_join_req(self, addr, header):
+        if addr in self.players:
+            print(f"Ignoring duplicate join from {addr}")
+            existing_player = self.players[addr]
+            ack_payload = json.dumps({"player_id": existing_player.id, "room_id": self.room_id}).encode()
+            self.seq_num += 1
+            self.outgoing.queue(addr, message(MSG_JOIN_ACK, ack_payload, seq_num=self.seq_num,
+                                              version=existing_player.version, timestamp=header.timestamp))
+            return
+
+        # Negotiate down to the highest version both sides speak
+        new_id = len(self.players) + 1
+        version = min(header.version, VERSION)
+        player = Player(id=new_id, address=addr, version=version)
+        if self.rate_config is not None:
+            player.rate = SnapshotRate(self.rate_config, time.monotonic())
+        self.players[addr] = player
+        self.addresses.add(addr)
+        print(f"Player {new_id} joined room {self.room_id} from {addr} (protocol v{version})")
+
+        # Send join acknowledgment
+        ack_payload = json.dumps({"player_id": new_id, "room_id": self.room_id}).encode()
+        self.seq_num += 1
+        self.outgoing.queue(addr, message(MSG_JOIN_ACK, ack_payload, seq_num=self.seq_num,
+                                          version=version, timestamp=header.timestamp))
+
+    def handle_ready_req(self, addr, header):
+        if addr in self.players:
+            if not self.players[addr].ready:
+                self.players[addr].ready = True
+                self.ready_count += 1
+                print(f"Player {self.players[addr].id} is ready ({self.ready_count}/{len(self.players)})")
+            
+            self.seq_num += 1
+            self.outgoing.queue(addr, message(MSG_READY_ACK, seq_num=self.seq_num,
+                                              version=self.players[addr].version, timestamp=header.timestamp))
+
+    def handle_acquire_event(self, addr, header, payload):
+
+        player = self.players.get(addr)
+        if not player:
+            return
+        # Sequenced requests are resolved once and SACKed; resends of the
+        # same sequence number only get the SACK again
+        if header.seq_num and player.version >= VERSION:
+            if player.acquire_window is None:
+                player.acquire_window = ReceiveWindow()
+            if not player.acquire_window.receive(header.seq_num, header.timestamp):
+                return
+        payload_dict = json.loads(bytes(payload))
+        cell_x, cell_y = int(payload_dict["x"]), int(payload_dict["y"])
+        if not self.grid.contains(cell_x, cell_y):
+            print(f"Ignoring acquire of ({cell_x}, {cell_y}) outside the grid from Player {player.id}")
+            return
+
+        self.acquires_received += 1
+        self.queue_acquire(header.timestamp, player, cell_x, cell_y)
+
+    def queue_acquire(self, timestamp, player, cell_x, cell_y):
+        # Queued until the next tick under its arrival index; the client
+        # timestamp is only echoed in the ACK
+        self.pending_acquires.append(
+            (len(self.pending_acquires), player.id, timestamp, cell_x, cell_y, player))
+
+    def resolve_acquires(self):
+        # Settles this tick's acquires in (server arrival, player id) order:
+        # the first request to reach the server wins a contested cell, and a
+        # client cannot jump the queue by back-dating its header timestamp.
+        # Returns {address: {(x, y): (result, timestamp)}} with one entry per
+        # distinct request; the ACK echoes the timestamp of its first copy.
+        acks = {}
+        self.pending_acquires.sort()
+        for _, player_id, timestamp, cell_x, cell_y, player in self.pending_acquires:
+            if self.grid.claim(cell_x, cell_y, player_id):
+                self.dirty_indices.append(cell_y * self.grid_size + cell_x)
+                self.dirty_owners.append(player_id)
+                player.score += 1
+                self.telemetry.pos_server(player_id, cell_x, cell_y, time.time())
+                result = ACQUIRE_GRANTED
+            elif self.grid.owner(cell_x, cell_y) == player_id:
+                # Resend of a request granted earlier
+                result = ACQUIRE_GRANTED
+            else:
+                result = ACQUIRE_DENIED
+            acks.setdefault(player.address, {}).setdefault((cell_x, cell_y), (result, timestamp))
+        self.pending_acquires = []
+        return acks
+
+    def send_legacy_acks(self, player, results):
+        # Version 1 clients expect one JSON ACK per request. Like the version
+        # 2 ACKs, it names the snapshot of this tick, the first to show it.
+        for (cell_x, cell_y), (_, timestamp) in results.items():
+            ack_payload = json.dumps({"x": cell_x, "y": cell_y}).encode()
+            self.outgoing.queue(player.address, message(MSG_ACQUIRE_ACK, ack_payload,
+                                                        snapshot_id=self.snapshot_id, seq_num=self.seq_num,
+                                                        version=player.version, timestamp=timestamp))
+
+    def handle_snapshot_ack(self, addr, header, payload):
+        player = self.players.get(addr)
+        if not player:
+            return
+        bitmap = 0
+        ack_delay = 0.0
+        if len(payload) >= SNAPSHOT_ACK_STRUCT.size:
+            bitmap, delay = SNAPSHOT_ACK_STRUCT.unpack_from(payload)
+            ack_delay = delay * SNAPSHOT_ACK_DELAY_UNIT
+        acked = acked_snapshots(header.snapshot_id, bitmap)
+        player.delivery.on_ack(acked)
+
+        # Only move the baseline forward, to the newest acked snapshot whose
+        # grid version is still kept
+        for snapshot_id in acked:
+            if snapshot_id <= player.last_snapshot_id:
+                break
+            if self.grid_versions.has(snapshot_id):
+                player.last_snapshot_id = snapshot_id
+                player.last_update_time = time.time()
+                break
+        if player.rate is not None:
+            # Only the newest snapshot is timed, less the client's hold time;
+            # the older ones in the bitmap arrived before it and would add
+            # the gap between snapshots to the sample
+            now = time.monotonic()
+            player.rate.on_ack(acked[0], now, ack_delay)
+            for snapshot_id in acked[1:]:
+                player.rate.on_ack(snapshot_id, now)
+
+    def handle_resync_req(self, addr, header, payload):
+        player = self.players.get(addr)
+        if not player:
+            return
+        self.resync_requests += 1
+        now = time.monotonic()
+        if player.resync_due or now < player.resync_at:
+            # One answer per interval; the client asks again if it is lost
+            self.resyncs_ignored += 1
+            return
+
+        base = NO_BASE
+        if len(payload) >= RESYNC_REQ_STRUCT.size:
+            base, = RESYNC_REQ_STRUCT.unpack_from(payload)
+        player.resync_due = True
+        player.resync_base = base if base != NO_BASE and self.grid_versions.has(base) else None
+        player.resync_at = now + self.resync_interval
+        kind = "full" if player.resync_base is None else f"delta from #{player.resync_base}"
+        print(f"Player {player.id} asked for a resync at snapshot {header.snapshot_id} ({kind})")
+
+
+
+    def update_waiting_for_join(self):
+
+        time_elapsed = time.time() - self.join_start_time
+        #time_condition = (time_elapsed >= self.join_time_gap_allowed and len(self.players) > 1)
+        ready_condition = (len(self.players) >= self.room_size and self.ready_count == self.room_size)
+        time_condition = False  # Disable time condition for testing
+        for address, player in self.players.items():
+            if  not player.ready:
+                self.seq_num += 1
+                self.outgoing.queue(address, message(MSG_READY_ACK, seq_num=self.seq_num,
+                                                     version=player.version))
+          
+
+        if time_condition or ready_condition:
+            print(f"Room {self.room_id}: conditions met, moving to INIT state.")
+            self.state = ServerState.WAITING_FOR_INIT
+
+    def run_state_waiting_for_init(self):
+        print("Sending initial snapshot")
+
+        self.grid.reset()
+        self.grid_versions.reset(self.snapshot_id)
+
+        self.seq_num += 1
+        targets = [SnapshotTarget(player.id, player.address, player.version, None)
+                   for player in self.players.values()]
+        self.submit_snapshots(self.snapshot_id, targets)
+        for index, player in enumerate(self.players.values()):
+            print(f"Sent initial snapshot to Player {player.id}")
+            # Stagger the players' keyframes over the interval
+            player.last_snapshot_id = self.snapshot_id
+            player.keyframe_id = self.snapshot_id - index * self.keyframe_interval // len(self.players)
+
+        self.snapshot_id += 1
+        self.game_running = True
+        self.game_start_time = time.time()
+        
+       
+        self.state = ServerState.GAME_LOOP
+        print("Entering GAME_LOOP")
+
+    def update_game_loop(self, ticks=1):
+        
+        acks = self.resolve_acquires()
+        # One broadcast per due tick (more than one only under burst catch-up)
+        for _ in range(ticks):
+            self.broadcast_snapshots(acks)
+            acks = {}
+
+
+        if self.grid.is_full():
+            print("All cells claimed ending game.")
+            self.game_running = False
+            self.state = ServerState.GAME_OVER
+
+    def broadcast_snapshots(self, acks=None):
+        # acks: resolved acquires per player address, from resolve_acquires
+      
+        acks = acks or {}
+        self.seq_num += 1
+        server_snapshot_id = self.snapshot_id 
+        
+        # This tick's version is the last one plus the journal of claimed cells
+        self.grid_versions.push(server_snapshot_id,
+                                np.array(self.dirty_indices, dtype=np.int64),
+                                np.array(self.dirty_owners, dtype=np.int64))
+        self.dirty_indices = []
+        self.dirty_owners = []
+
+        # Only the per-player choices are made here; payloads and packets are
+        # built by the encoder
+        targets = []
+        changes = {}
+        now = time.monotonic()
+        for player in self.players.values():
+            results = acks.get(player.address)
+            sack_reply = self.take_sack(player)
+            if player.rate is not None:
+                player.rate.update(now)
+                # Ticks with ACKs to deliver are always sent
+                if not player.rate.due() and not results and sack_reply is None and not player.resync_due:
+                    continue
+
+            if player.resync_due:
+                from_id = player.resync_base
+                player.resync_due = False
+            elif (self.keyframe_interval > 0 and
+                  server_snapshot_id - player.keyframe_id >= self.keyframe_interval):
+                from_id = None
+            else:
+                from_id = player.last_snapshot_id
+
+            if from_id is not None and self.grid_versions.has(from_id):
+                if from_id not in changes:
+                    changes[from_id] = self.grid_versions.diff(from_id)
+            else:
+                from_id = None
+                player.keyframe_id = server_snapshot_id
+
+            entries = ()
+            ack_timestamp = None
+            sack = None
+            if sack_reply is not None:
+                # Sequenced requests are acknowledged by the SACK alone
+                sack, ack_timestamp = sack_reply
+            elif results and player.version < VERSION:
+                self.send_legacy_acks(player, results)
+            elif results:
+                entries = tuple((x, y, result) for (x, y), (result, _) in results.items())
+                # The aggregated ACK echoes the newest request it answers
+                ack_timestamp = max(timestamp for _, timestamp in results.values())
+            targets.append(SnapshotTarget(player.id, player.address, player.version, from_id,
+                                          entries, ack_timestamp, sack))
+
+        self.grid_versions.release({player.last_snapshot_id for player in self.players.values()})
+        self.submit_snapshots(server_snapshot_id, targets, changes)
+        self.snapshot_id += 1 
+
+    def take_sack(self, player):
+        # (sack, echoed timestamp) for this broadcast, None if nothing is due.
+        # Every acquire received so far was resolved by this tick.
+        window = player.acquire_window
+        if window is None or not window.ack_due:
+            return None
+        return window.take_sack()
+
+    def submit_snapshots(self, snapshot_id, targets, changes=None):
+        # Hands one broadcast to the encoder along with a copy of the grid
+        job = self.snapshot_job(snapshot_id, targets, changes, self.grid.cells.copy())
+        self.encoder.submit(job, functools.partial(self.send_snapshots, job))
+
+    def snapshot_job(self, snapshot_id, targets, changes, cells):
+        return SnapshotJob(snapshot_id, self.seq_num, cells, self.grid.rows, self.grid.cols,
+                           changes or {}, tuple(targets), self.piggyback_acks, time.monotonic(),
+                           self.grid.hash)
+
+    def send_snapshots(self, job, encoded):
+        now = time.monotonic()
+        for target, messages in encoded:
+            for msg, bundle in messages:
+                self.outgoing.queue(target.address, msg, bundle)
+            self.telemetry.snapshot_send(target.player_id, job.snapshot_id, job.seq_num, time.time())
+            player = self.players.get(target.address)
+            if player is None:
+                continue
+            player.delivery.on_send(job.snapshot_id)
+            if player.rate is not None:
+                player.rate.on_send(job.snapshot_id, now)
+        self.snapshots_sent += len(encoded)
+
+    def handle_leaderboard(self,players):
+
+        leaderboard = sorted(self.players.values(), key=lambda p: p.score, reverse=True)
+
+        print("\n=== FINAL LEADERBOARD ===")
+        for rank, player in enumerate(leaderboard, start=1):
+            print(f"{rank}. Player {player.id} — Score: {player.score}")
+        print("==========================\n")
+
+        leaderboard_data = {
+            "type": "leaderboard",
+            "results": [
+                {"rank": rank, "player_id": player.id, "score": player.score}
+                for rank, player in enumerate(leaderboard, start=1)
+            ]
+        }
+
+        leaderboard_payload = json.dumps(leaderboard_data).encode()
+
+
+        for player in leaderboard:
+            self.outgoing.queue(player.address, message(MSG_LEADERBOARD, leaderboard_payload,
+                                                        version=player.version))
+            print(f"Leaderboard sent to Player {player.id}")
+
+
+    def run_state_game_over(self):
+        now = time.time()
+
+        if not self.game_over_time:
+            print(f"\n--- GAME OVER (room {self.room_id}) ---")
+
+            end_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+            print(f"Game ended at: {end_time}")
+
+            duration = round(now - self.game_start_time, 2)
+            print(f"Total game duration: {duration} seconds")
+            self.print_rate_stats()
+            print(f"INBOUND_STATS packets={self.packets_received} acquires={self.acquires_received} "
+                  f"packets_per_s={self.packets_received / max(duration, 1e-3):.1f} "
+                  f"resync_requests={self.resync_requests} resyncs_ignored={self.resyncs_ignored}")
+            for player in self.players.values():
+                delivery = player.delivery
+                print(f"SNAPSHOT_DELIVERY player={player.id} sent={delivery.sent} "
+                      f"delivered={delivery.delivered} lost={delivery.lost} loss={delivery.loss():.4f}")
+
+            self.handle_leaderboard(self.players)
+            self.game_over_time = now
+            self.last_leaderboard_time = now
+            return
+
+        # Resend the leaderboard without blocking until everyone acknowledged
+        # it or patience runs out
+        if not self.players or now - self.game_over_time >= self.game_over_patience:
+            self.close()
+        elif now - self.last_leaderboard_time >= self.leaderboard_resend:
+            self.handle_leaderboard(self.players)
+            self.last_leaderboard_time = now
+
+    def print_rate_stats(self):
+        for player in self.players.values():
+            rate = player.rate
+            if rate is not None:
+                srtt = (rate.srtt or 0.0) * 1000
+                print(f"RATE_STATS player={player.id} rate={rate.rate:.1f} loss={rate.loss:.3f} "
+                      f"srtt_ms={srtt:.1f} skipped={rate.skipped}")
+
+    def close(self):
+        print(f"Game session in room {self.room_id} ended.")
+        
+        self.players.clear()
+        self.pending_acquires = []
+        self.game_running = False
+        self.closed = True
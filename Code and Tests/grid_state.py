@@ -0,0 +1,169 @@
+import numpy as np
+
+
+# Zobrist hashing of a grid: the hash is the XOR of a 64-bit key per claimed
+# (cell, owner) pair, so a claim is one XOR and server and client can keep it
+# up to date as changes arrive. Keys are splitmix64 of index << 16 | owner
+# rather than a random table, so both sides agree for any grid size.
+MASK64 = (1 << 64) - 1
+
+
+def zobrist_key(index, owner):
+    if not owner:
+        return 0
+    z = ((int(index) << 16 | int(owner)) + 0x9E3779B97F4A7C15) & MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+    return z ^ (z >> 31)
+
+
+def zobrist_hash(indices, owners):
+    # XOR of zobrist_key over arrays of cells
+    owners = np.asarray(owners, dtype=np.uint64)
+    z = np.asarray(indices, dtype=np.uint64) << np.uint64(16) | owners
+    with np.errstate(over="ignore"):
+        z = z + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    z ^= z >> np.uint64(31)
+    z[owners == 0] = 0
+    return int(np.bitwise_xor.reduce(z)) if z.size else 0
+
+
+class GridState:
+    # Owner id of every cell in one contiguous row-major array. counts[p] is
+    # the number of cells owned by player p (counts[0] = unclaimed cells) and
+    # hash the Zobrist hash of the cells; both are updated with every change,
+    # so scores, the end condition and the hash are O(1) to read.
+    # With `buffer` the cells live in that memory (e.g. shared memory) and
+    # are cleared on creation. Clients may also predict claims of their own;
+    # predictions sit beside the cells and never touch cells or counts.
+
+    def __init__(self, rows=20, cols=20, dtype=np.uint8, buffer=None):
+        self.rows = rows
+        self.cols = cols
+        self.shared = buffer is not None
+        if buffer is None:
+            self.cells = np.zeros(rows * cols, dtype=dtype)
+        else:
+            self.cells = np.ndarray(rows * cols, dtype=dtype, buffer=buffer)
+            self.cells[:] = 0
+        # 2D view sharing memory with cells
+        self.view = self.cells.reshape(rows, cols)
+        self.counts = np.zeros(np.iinfo(dtype).max + 1, dtype=np.int64)
+        self.counts[0] = rows * cols
+        self.hash = 0
+        # Flat index -> owner of claims predicted but not yet confirmed
+        self.predicted = {}
+
+    @property
+    def size(self):
+        return self.cells.size
+
+    @property
+    def unclaimed(self):
+        return int(self.counts[0])
+
+    def is_full(self):
+        return self.counts[0] == 0
+
+    def score(self, owner):
+        if not owner or owner >= self.counts.size:
+            return 0
+        return int(self.counts[owner])
+
+    def scores(self):
+        owners = np.flatnonzero(self.counts[1:]) + 1
+        return {int(owner): int(self.counts[owner]) for owner in owners}
+
+    def contains(self, x, y):
+        return 0 <= x < self.cols and 0 <= y < self.rows
+
+    def owner(self, x, y):
+        return int(self.cells[y * self.cols + x])
+
+    def claim(self, x, y, owner):
+        # Claims an unclaimed cell; returns False if it is taken or off-grid
+        if not self.contains(x, y):
+            return False
+        index = y * self.cols + x
+        if self.cells[index] != 0:
+            return False
+        self.ensure_capacity(owner)
+        self.cells[index] = owner
+        self.counts[0] -= 1
+        self.counts[owner] += 1
+        self.hash ^= zobrist_key(index, owner)
+        return True
+
+    def predict(self, x, y, owner):
+        # Predicts a claim of an unclaimed cell; False if it is taken, already
+        # predicted or off-grid
+        if not self.contains(x, y):
+            return False
+        index = y * self.cols + x
+        if self.cells[index] != 0 or index in self.predicted:
+            return False
+        self.predicted[index] = owner
+        return True
+
+    def unpredict(self, index):
+        self.predicted.pop(index, None)
+
+    def apply_delta(self, indices, owners):
+        indices = np.asarray(indices, dtype=np.int64)
+        if not indices.size:
+            return
+        owners = np.asarray(owners)
+        self.ensure_capacity(int(owners.max()))
+
+        # Count each touched cell once even if the delta repeats it
+        touched = np.unique(indices)
+        minlength = self.counts.size
+        before = self.cells[touched]
+        self.counts -= np.bincount(before, minlength=minlength)
+        self.cells[indices] = owners
+        after = self.cells[touched]
+        self.counts += np.bincount(after, minlength=minlength)
+        self.hash ^= zobrist_hash(touched, before) ^ zobrist_hash(touched, after)
+
+    def apply_full(self, cells):
+        cells = np.asarray(cells)
+        if cells.ndim == 2 and cells.shape != (self.rows, self.cols):
+            self.resize(*cells.shape)
+        cells = cells.reshape(-1)
+        if cells.size != self.cells.size:
+            raise ValueError("Full snapshot does not match the grid size")
+        if cells.size:
+            self.ensure_capacity(int(cells.max()))
+        self.cells[:] = cells
+        self.counts[:] = np.bincount(self.cells, minlength=self.counts.size)
+        self.hash = zobrist_hash(np.arange(self.cells.size), self.cells)
+
+    def ensure_capacity(self, max_owner):
+        # Widen to uint16 the first time an owner id does not fit in uint8
+        if max_owner < self.counts.size:
+            return
+        if max_owner > np.iinfo(np.uint16).max or self.shared:
+            raise ValueError(f"Owner id {max_owner} too large for the grid")
+        self.cells = self.cells.astype(np.uint16)
+        self.view = self.cells.reshape(self.rows, self.cols)
+        counts = np.zeros(np.iinfo(np.uint16).max + 1, dtype=np.int64)
+        counts[:self.counts.size] = self.counts
+        self.counts = counts
+
+    def resize(self, rows, cols):
+        self.rows = rows
+        self.cols = cols
+        self.cells = np.zeros(rows * cols, dtype=self.cells.dtype)
+        self.view = self.cells.reshape(rows, cols)
+        self.counts[:] = 0
+        self.counts[0] = rows * cols
+        self.hash = 0
+
+    def reset(self):
+        self.predicted.clear()
+        self.cells[:] = 0
+        self.counts[:] = 0
+        self.counts[0] = self.cells.size
+        self.hash = 0
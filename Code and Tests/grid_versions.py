@@ -0,0 +1,91 @@
+import numpy as np
+
+
+class GridVersions:
+    # Copy-on-write versions of a room's grid, one per snapshot id, to diff a
+    # player's packet against the snapshot it last acked (its baseline).
+    # The grid is cut into fixed pages and a version is a tuple of read-only
+    # pages: a tick copies only the pages it claimed cells in and shares the
+    # rest with the previous version, so a version costs a tuple and a page
+    # or two. Pages shared by two versions are skipped when diffing them.
+    #
+    # The newest `depth` versions are kept so acks still in flight can become
+    # baselines, plus every version pinned as some player's baseline however
+    # old. diff() is cached per baseline until the next push, so players that
+    # acked the same snapshot share the work.
+
+    def __init__(self, size, depth=32, page_size=64, dtype=np.uint16):
+        if depth < 1:
+            raise ValueError("Grid version depth must be at least 1")
+        self.size = size
+        self.depth = depth
+        self.page_size = page_size
+        self.dtype = dtype
+        self.versions = {}
+        self.newest = -1
+        self.cache = {}
+
+    def reset(self, snapshot_id):
+        # Starts over from an empty grid at snapshot_id
+        pages = []
+        for start in range(0, self.size, self.page_size):
+            page = np.zeros(min(self.page_size, self.size - start), dtype=self.dtype)
+            page.flags.writeable = False
+            pages.append(page)
+        self.versions = {snapshot_id: tuple(pages)}
+        self.newest = snapshot_id
+        self.cache.clear()
+
+    def push(self, snapshot_id, indices, owners):
+        # The next version: the newest one with this tick's claims applied
+        if snapshot_id != self.newest + 1 or self.newest not in self.versions:
+            raise ValueError(f"Snapshot {snapshot_id} does not follow {self.newest}")
+        pages = list(self.versions[self.newest])
+        if len(indices):
+            page_ids = indices // self.page_size
+            for page_id in np.unique(page_ids):
+                page = pages[page_id].copy()
+                in_page = page_ids == page_id
+                page[indices[in_page] - page_id * self.page_size] = owners[in_page]
+                page.flags.writeable = False
+                pages[page_id] = page
+        self.versions[snapshot_id] = tuple(pages)
+        self.newest = snapshot_id
+        self.cache.clear()
+
+    def has(self, snapshot_id):
+        return snapshot_id in self.versions
+
+    def diff(self, from_id):
+        # (indices, owners) of the cells that differ from version from_id to
+        # the newest one
+        cached = self.cache.get(from_id)
+        if cached is not None:
+            return cached
+        base = self.versions.get(from_id)
+        if base is None:
+            raise KeyError(f"No grid version for snapshot {from_id}")
+
+        indices = []
+        owners = []
+        for page_id, (old, new) in enumerate(zip(base, self.versions[self.newest])):
+            if old is new:
+                continue
+            changed = np.flatnonzero(old != new)
+            indices.append(changed + page_id * self.page_size)
+            owners.append(new[changed])
+        if indices:
+            indices = np.concatenate(indices)
+            owners = np.concatenate(owners)
+        else:
+            indices = np.empty(0, dtype=np.int64)
+            owners = np.empty(0, dtype=self.dtype)
+
+        self.cache[from_id] = (indices, owners)
+        return indices, owners
+
+    def release(self, pinned):
+        # Drops versions past the depth that no player holds as its baseline
+        oldest = self.newest - self.depth + 1
+        for snapshot_id in [s for s in self.versions if s < oldest and s not in pinned]:
+            del self.versions[snapshot_id]
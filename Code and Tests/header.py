@@ -1,12 +1,28 @@
 import struct
 import time
+from collections import namedtuple
 
 
 # Protocol information
 PROTOCOL_ID = b'VAP1'       
-VERSION = 1                 
+VERSION = 2                 
+# Version 1 peers use JSON+zlib snapshot payloads
+LEGACY_VERSION = 1
 HEADER_FORMAT = "!4s B B I I d H"
-HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+HEADER_STRUCT = struct.Struct(HEADER_FORMAT)
+HEADER_SIZE = HEADER_STRUCT.size
+
+# Largest UDP payload, used to size receive buffers
+MAX_DATAGRAM_SIZE = 65507
+
+PacketHeader = namedtuple(
+    "PacketHeader",
+    ["protocol_id", "version", "msg_type", "snapshot_id", "seq_num", "timestamp", "payload_len"]
+)
+
+_pack_header = HEADER_STRUCT.pack
+_unpack_header_from = HEADER_STRUCT.unpack_from
+_tuple_new = tuple.__new__
 
 #join
 MSG_JOIN_REQ   = 1    
@@ -21,26 +37,96 @@ MSG_START_GAME = 5  #useless
 MSG_SNAPSHOT_FULL   = 6  
 MSG_SNAPSHOT_DELTA   = 7  
 MSG_SNAPSHOT_ACK = 8  
+# Client missed a delta's base or its grid hash disagreed; asks for a resync
+MSG_RESYNC_REQ = 15
 
 #events
 MSG_ACQUIRE_EVENT =  9 
 MSG_ACQUIRE_ACK = 13
+MSG_ACQUIRE_SACK = 14
 
 #termination
 MSG_END_GAME   = 10
 MSG_LEADERBOARD = 11
 MSG_TERMINATE  = 12
 
+#framing
+# Several messages for one peer in one datagram (see frame_messages)
+MSG_BUNDLE = 16
+
+# Aggregated MSG_ACQUIRE_ACK payload (protocol version 2): one entry per
+# acquire resolved in a tick, x (H) | y (H) | result (B)
+ACQUIRE_ACK_ENTRY_STRUCT = struct.Struct("!H H B")
+ACQUIRE_DENIED = 0
+ACQUIRE_GRANTED = 1
+
+# MSG_ACQUIRE_SACK payload (protocol version 2), the reply to acquires that
+# carry a per-client sequence number in seq_num: every request up to the
+# cumulative sequence number arrived, and bit i of the bitmap is set when
+# request cumulative + 1 + i did too
+ACQUIRE_SACK_STRUCT = struct.Struct("!I I")
+SACK_BITS = 32
 
+# MSG_SNAPSHOT_ACK payload (protocol version 2): one cumulative ack for the
+# snapshots received since the last one. The header's snapshot_id is the
+# newest received, and bit i of the bitmap is set when snapshot
+# snapshot_id - 1 - i arrived too. The delay is how long the client held
+# the ack back after the newest snapshot arrived, in SNAPSHOT_ACK_DELAY_UNIT
+# seconds, so the server can take it off its RTT sample (as QUIC does).
+# Version 1 acks name one snapshot and carry no payload.
+SNAPSHOT_ACK_STRUCT = struct.Struct("!I H")
+SNAPSHOT_ACK_DELAY_UNIT = 0.0001
+SNAPSHOT_ACK_DELAY_MAX = 0xFFFF
+SNAPSHOT_ACK_BITS = 32
+SNAPSHOT_ACK_MASK = (1 << SNAPSHOT_ACK_BITS) - 1
 
+# Version 2 MSG_SNAPSHOT_FULL and MSG_SNAPSHOT_DELTA payloads start with the
+# 64-bit Zobrist hash of the grid the snapshot leaves (see grid_state.py) and
+# the snapshot_id a delta was taken from (NO_BASE in full snapshots),
+# followed by the snapshot_codec.py body
+SNAPSHOT_PREFIX_STRUCT = struct.Struct("!Q I")
+NO_BASE = 0xFFFFFFFF
 
-def pack_header(msg_type, snapshot_id=0, seq_num=0, payload_len=0):
+# MSG_RESYNC_REQ payload (protocol version 2): the snapshot_id whose grid
+# the client still holds intact, to get a delta from, or NO_BASE for a full
+# snapshot. The header's snapshot_id is the snapshot that showed the problem.
+RESYNC_REQ_STRUCT = struct.Struct("!I")
 
-    timestamp = time.time()  
-    return struct.pack(
-        HEADER_FORMAT,
+# MSG_BUNDLE payload (protocol version 2): one entry per message, each a
+# sub-header msg_type (B) | flags (B) | payload_len (H), then the header
+# fields its flags mark as present, then its payload. A field left out is
+# zero when its ZERO flag is set and otherwise takes the value in the bundle
+# header, which holds the first nonzero snapshot_id and seq_num of the
+# bundle and the send time. Most messages set one of the two fields and
+# leave the other zero, so an acquire and a SNAPSHOT_ACK cost their
+# sub-headers alone.
+BUNDLE_ENTRY_STRUCT = struct.Struct("!B B H")
+BUNDLE_SNAPSHOT_ID = 0x01
+BUNDLE_SEQ_NUM = 0x02
+BUNDLE_TIMESTAMP = 0x04
+BUNDLE_ZERO_SNAPSHOT_ID = 0x08
+BUNDLE_ZERO_SEQ_NUM = 0x10
+BUNDLE_U32_STRUCT = struct.Struct("!I")
+BUNDLE_TIMESTAMP_STRUCT = struct.Struct("!d")
+# Bundles stay within a datagram that crosses common paths unfragmented
+BUNDLE_MTU = 1200
+
+# A message waiting in a PeerOutbox
+Message = namedtuple(
+    "Message",
+    ["msg_type", "payload", "snapshot_id", "seq_num", "version", "timestamp"]
+)
+
+
+
+def pack_header(msg_type, snapshot_id=0, seq_num=0, payload_len=0, version=VERSION, timestamp=None):
+    # The timestamp is the send time, except in ACKs, which echo the
+    # timestamp of the request they answer so the client can time it
+    if timestamp is None:
+        timestamp = time.time()
+    return _pack_header(
         PROTOCOL_ID,
-        VERSION,
+        version,
         msg_type,
         snapshot_id,
         seq_num,
@@ -54,41 +140,244 @@ def unpack_header(data):
     if len(data) < HEADER_SIZE:
         raise ValueError("Data too short to contain valid header")
 
-    fields = struct.unpack(HEADER_FORMAT, data[:HEADER_SIZE])
-
-    return {
-        "protocol_id": fields[0],
-        "version": fields[1],
-        "msg_type": fields[2],
-        "snapshot_id": fields[3],
-        "seq_num": fields[4],
-        "timestamp": fields[5],
-        "payload_len": fields[6],
-    }
+    # tuple.__new__ skips the Python-level namedtuple constructor
+    return _tuple_new(PacketHeader, _unpack_header_from(data))
 
 
 
 
-def make_packet(msg_type, payload=b"", snapshot_id=0, seq_num=0):
+def make_packet(msg_type, payload=b"", snapshot_id=0, seq_num=0, version=VERSION, timestamp=None):
     
-    if not isinstance(payload, (bytes, bytearray)):
+    if not isinstance(payload, (bytes, bytearray, memoryview)):
         raise TypeError("Payload must be bytes")
 
     header = pack_header(
         msg_type=msg_type,
         snapshot_id=snapshot_id,
         seq_num=seq_num,
-        payload_len=len(payload)
+        payload_len=len(payload),
+        version=version,
+        timestamp=timestamp
     )
     return header + payload
 
 
 def parse_packet(data):
-   
+    # When data is a memoryview the payload is a zero-copy view into it
     header = unpack_header(data)
     payload_start = HEADER_SIZE
-    payload_end = HEADER_SIZE + header["payload_len"]
+    payload_end = HEADER_SIZE + header.payload_len
     payload = data[payload_start:payload_end]
     return header, payload
 
 
+def parse_packets(data):
+    # A datagram may carry several packets back to back (older senders
+    # piggyback this way) or a MSG_BUNDLE, which is expanded into the
+    # packets it carries
+    packets = []
+    offset = 0
+    while len(data) - offset >= HEADER_SIZE:
+        header, payload = parse_packet(data[offset:])
+        if header.protocol_id != PROTOCOL_ID:
+            break
+        if header.msg_type == MSG_BUNDLE:
+            packets.extend(unpack_bundle(header, payload))
+        else:
+            packets.append((header, payload))
+        offset += HEADER_SIZE + header.payload_len
+    return packets
+
+
+def message(msg_type, payload=b"", snapshot_id=0, seq_num=0, version=VERSION, timestamp=None):
+    # timestamp None is filled in with the send time
+    return _tuple_new(Message, (msg_type, payload, snapshot_id, seq_num, version, timestamp))
+
+
+def bundle_header_fields(messages):
+    # (snapshot_id, seq_num) of a bundle header: the first nonzero of each
+    snapshot_id = next((msg.snapshot_id for msg in messages if msg.snapshot_id), 0)
+    seq_num = next((msg.seq_num for msg in messages if msg.seq_num), 0)
+    return snapshot_id, seq_num
+
+
+def bundle_entry_size(msg, snapshot_id, seq_num, timestamp):
+    # Bytes msg takes in a bundle whose header holds these fields
+    size = BUNDLE_ENTRY_STRUCT.size + len(msg.payload)
+    if msg.snapshot_id and msg.snapshot_id != snapshot_id:
+        size += BUNDLE_U32_STRUCT.size
+    if msg.seq_num and msg.seq_num != seq_num:
+        size += BUNDLE_U32_STRUCT.size
+    if msg.timestamp is not None and msg.timestamp != timestamp:
+        size += BUNDLE_TIMESTAMP_STRUCT.size
+    return size
+
+
+def pack_bundle(messages, timestamp):
+    snapshot_id, seq_num = bundle_header_fields(messages)
+    parts = []
+    for msg in messages:
+        flags = 0
+        fields = []
+        if msg.snapshot_id != snapshot_id:
+            if msg.snapshot_id:
+                flags |= BUNDLE_SNAPSHOT_ID
+                fields.append(BUNDLE_U32_STRUCT.pack(msg.snapshot_id))
+            else:
+                flags |= BUNDLE_ZERO_SNAPSHOT_ID
+        if msg.seq_num != seq_num:
+            if msg.seq_num:
+                flags |= BUNDLE_SEQ_NUM
+                fields.append(BUNDLE_U32_STRUCT.pack(msg.seq_num))
+            else:
+                flags |= BUNDLE_ZERO_SEQ_NUM
+        if msg.timestamp is not None and msg.timestamp != timestamp:
+            flags |= BUNDLE_TIMESTAMP
+            fields.append(BUNDLE_TIMESTAMP_STRUCT.pack(msg.timestamp))
+        parts.append(BUNDLE_ENTRY_STRUCT.pack(msg.msg_type, flags, len(msg.payload)))
+        parts.extend(fields)
+        parts.append(msg.payload)
+    payload = b"".join(parts)
+    return _pack_header(PROTOCOL_ID, VERSION, MSG_BUNDLE, snapshot_id, seq_num,
+                        timestamp, len(payload)) + payload
+
+
+def unpack_bundle(header, payload):
+    # [(header, payload)] of the messages in a bundle; a truncated entry
+    # ends it
+    packets = []
+    offset = 0
+    end = len(payload)
+    while end - offset >= BUNDLE_ENTRY_STRUCT.size:
+        msg_type, flags, payload_len = BUNDLE_ENTRY_STRUCT.unpack_from(payload, offset)
+        offset += BUNDLE_ENTRY_STRUCT.size
+        snapshot_id, seq_num, timestamp = header.snapshot_id, header.seq_num, header.timestamp
+        try:
+            if flags & BUNDLE_SNAPSHOT_ID:
+                snapshot_id, = BUNDLE_U32_STRUCT.unpack_from(payload, offset)
+                offset += BUNDLE_U32_STRUCT.size
+            elif flags & BUNDLE_ZERO_SNAPSHOT_ID:
+                snapshot_id = 0
+            if flags & BUNDLE_SEQ_NUM:
+                seq_num, = BUNDLE_U32_STRUCT.unpack_from(payload, offset)
+                offset += BUNDLE_U32_STRUCT.size
+            elif flags & BUNDLE_ZERO_SEQ_NUM:
+                seq_num = 0
+            if flags & BUNDLE_TIMESTAMP:
+                timestamp, = BUNDLE_TIMESTAMP_STRUCT.unpack_from(payload, offset)
+                offset += BUNDLE_TIMESTAMP_STRUCT.size
+        except struct.error:
+            break
+        if end - offset < payload_len:
+            break
+        packets.append((_tuple_new(PacketHeader, (header.protocol_id, header.version, msg_type,
+                                                  snapshot_id, seq_num, timestamp, payload_len)),
+                        payload[offset:offset + payload_len]))
+        offset += payload_len
+    return packets
+
+
+def frame_messages(messages, mtu=BUNDLE_MTU, timestamp=None):
+    # Datagrams carrying messages in order: runs of version 2 messages share
+    # MSG_BUNDLE datagrams of at most mtu bytes, and a message alone in its
+    # datagram (too big to share one, version 1, or the only one) goes out
+    # as a plain packet. messages: (Message, bundle) pairs; bundle False
+    # keeps that message to its own datagram.
+    if timestamp is None:
+        timestamp = time.time()
+    datagrams = []
+    run = []
+    size = HEADER_SIZE
+    # Header fields of the run so far (see bundle_header_fields)
+    snapshot_id = seq_num = 0
+
+    def close_run():
+        nonlocal snapshot_id, seq_num
+        snapshot_id = seq_num = 0
+        if len(run) == 1:
+            msg = run[0]
+            datagrams.append(_pack_header(PROTOCOL_ID, msg.version, msg.msg_type, msg.snapshot_id,
+                                          msg.seq_num, timestamp if msg.timestamp is None else msg.timestamp,
+                                          len(msg.payload)) + msg.payload)
+        elif run:
+            datagrams.append(pack_bundle(run, timestamp))
+        run.clear()
+
+    for msg, bundle in messages:
+        if not bundle or msg.version < VERSION:
+            close_run()
+            run.append(msg)
+            close_run()
+            continue
+        entry = bundle_entry_size(msg, snapshot_id or msg.snapshot_id, seq_num or msg.seq_num, timestamp)
+        if run and size + entry > mtu:
+            close_run()
+            entry = bundle_entry_size(msg, msg.snapshot_id, msg.seq_num, timestamp)
+        if not run:
+            size = HEADER_SIZE
+        size += entry
+        snapshot_id = snapshot_id or msg.snapshot_id
+        seq_num = seq_num or msg.seq_num
+        run.append(msg)
+    close_run()
+    return datagrams
+
+
+def encode_acquire_acks(entries):
+    # entries: (x, y, result) tuples
+    pack = ACQUIRE_ACK_ENTRY_STRUCT.pack
+    return b"".join([pack(x, y, result) for x, y, result in entries])
+
+
+def decode_acquire_acks(payload):
+    return list(ACQUIRE_ACK_ENTRY_STRUCT.iter_unpack(payload))
+
+
+def encode_acquire_sack(cumulative, bitmap):
+    return ACQUIRE_SACK_STRUCT.pack(cumulative, bitmap)
+
+
+def decode_acquire_sack(payload):
+    # (cumulative, bitmap)
+    return ACQUIRE_SACK_STRUCT.unpack_from(payload)
+
+
+class PeerOutbox:
+    # Outgoing messages per peer address, sent once per flush (the sender's
+    # tick) through frame_messages, so a peer's messages of one tick share
+    # as few datagrams as will hold them; mtu 0 sends each on its own.
+
+    def __init__(self, mtu=BUNDLE_MTU):
+        self.mtu = mtu
+        self.queues = {}
+        self.messages_sent = 0
+        self.datagrams_sent = 0
+        self.bytes_sent = 0
+        self.payload_bytes_sent = 0
+
+    def queue(self, addr, msg, bundle=True):
+        queue = self.queues.get(addr)
+        if queue is None:
+            queue = self.queues[addr] = []
+        queue.append((msg, bundle))
+
+    def pending(self):
+        return bool(self.queues)
+
+    def flush(self, sendto):
+        # sendto(datagram, addr), e.g. socket.sendto or a SocketIO's
+        timestamp = time.time()
+        for addr, messages in self.queues.items():
+            self.messages_sent += len(messages)
+            self.payload_bytes_sent += sum(len(msg.payload) for msg, _ in messages)
+            for datagram in frame_messages(messages, self.mtu, timestamp):
+                self.datagrams_sent += 1
+                self.bytes_sent += len(datagram)
+                sendto(datagram, addr)
+        self.queues.clear()
+
+    def stats(self):
+        # Header bytes are everything sent that is not a message payload
+        return {"messages_sent": self.messages_sent, "datagrams_sent": self.datagrams_sent,
+                "bytes_sent": self.bytes_sent,
+                "header_bytes": self.bytes_sent - self.payload_bytes_sent}
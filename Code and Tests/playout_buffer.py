@@ -0,0 +1,60 @@
+import collections
+
+
+class PlayoutBuffer:
+    # Holds received snapshots back until their playout time so network
+    # jitter does not reach the screen. A snapshot plays at
+    #   server timestamp + base transit + factor * jitter
+    # where the base transit is the smallest recv - server timestamp seen over
+    # the last base_window snapshots (clock offset plus the fastest path) and
+    # jitter is the RFC 3550 interarrival jitter estimate. factor trades
+    # latency for smoothness: 0 plays snapshots as they arrive, larger values
+    # ride out more jitter. A snapshot arriving after its playout time plays
+    # at once and counts as an underrun.
+    #
+    # Snapshots are pushed in snapshot_id order (the client drops outdated
+    # ones) and never dropped here: a delta may be the base of later ones.
+
+    def __init__(self, factor=3.0, max_delay=0.25, base_window=64, max_size=64):
+        self.factor = factor
+        self.max_delay = max_delay
+        self.max_size = max_size
+        # (playout time, snapshot) in snapshot_id order
+        self.items = collections.deque()
+        self.transits = collections.deque(maxlen=base_window)
+        self.last_transit = None
+        self.jitter = 0.0
+        self.received = 0
+        self.underruns = 0
+        self.total_delay = 0.0
+
+    def target_delay(self):
+        return min(self.max_delay, self.factor * self.jitter)
+
+    def push(self, snapshot, server_ts, now):
+        # Returns (time the snapshot will wait, whether it arrived late)
+        transit = now - server_ts
+        if self.last_transit is not None:
+            self.jitter += (abs(transit - self.last_transit) - self.jitter) / 16
+        self.last_transit = transit
+        self.transits.append(transit)
+
+        playout_at = server_ts + min(self.transits) + self.target_delay()
+        # Nothing is held back with factor 0, so nothing is late either
+        late = self.factor > 0 and playout_at < now
+        wait = max(0.0, playout_at - now)
+        self.received += 1
+        self.underruns += late
+        self.total_delay += wait
+        self.items.append((playout_at, snapshot))
+        return wait, late
+
+    def pop_due(self, now):
+        # Snapshots due by now, oldest first; a full buffer plays its oldest
+        due = []
+        while self.items and (self.items[0][0] <= now or len(self.items) > self.max_size):
+            due.append(self.items.popleft()[1])
+        return due
+
+    def mean_delay(self):
+        return self.total_delay / self.received if self.received else 0.0
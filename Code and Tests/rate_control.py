@@ -0,0 +1,94 @@
+import dataclasses
+
+
+@dataclasses.dataclass
+class RateConfig:
+    # Bounds and AIMD constants shared by every player of a server. Rates are
+    # snapshots per second; max_rate is normally the tick rate.
+    min_rate: float = 5.0
+    max_rate: float = 25.0
+    # Added after every window without congestion
+    increase: float = 2.0
+    # Applied on congestion, at most once per round trip
+    decrease: float = 0.5
+    # Share of snapshots lost in a window that counts as congestion
+    loss_threshold: float = 0.05
+    # Smoothed RTT this far above the smallest RTT seen counts as congestion
+    rtt_slack: float = 0.05
+    # Seconds between adjustments
+    window: float = 0.5
+
+
+class SnapshotRate:
+    # AIMD snapshot rate of one player, driven by its SNAPSHOT_ACKs. The
+    # global tick is unchanged: a player below the tick rate is skipped on
+    # some ticks, and since deltas are built from the player's last ack the
+    # next one it gets covers the skipped ticks.
+
+    def __init__(self, config, now):
+        self.config = config
+        self.rate = config.max_rate
+        self.credit = 1.0
+        self.srtt = None
+        self.min_rtt = None
+        # Snapshot id -> send time, until acked or counted as lost
+        self.sent = {}
+        self.acked = 0
+        self.lost = 0
+        self.loss = 0.0
+        self.window_end = now + config.window
+        self.last_decrease = 0.0
+        self.skipped = 0
+
+    def due(self):
+        # Whether this tick's snapshot goes to the player
+        self.credit = min(1.0, self.credit + self.rate / self.config.max_rate)
+        if self.credit >= 1.0 - 1e-9:
+            self.credit -= 1.0
+            return True
+        self.skipped += 1
+        return False
+
+    def on_send(self, snapshot_id, now):
+        self.sent[snapshot_id] = now
+
+    def on_ack(self, snapshot_id, now, ack_delay=None):
+        # Counts the snapshot as delivered. It is only timed when ack_delay
+        # is given (the newest snapshot of an ack). As in QUIC, min_rtt takes
+        # the raw sample and the smoothed RTT the sample less the client's
+        # hold time, never below min_rtt (the delay is rounded on the wire).
+        sent_at = self.sent.pop(snapshot_id, None)
+        if sent_at is None:
+            return
+        self.acked += 1
+        if ack_delay is None:
+            return
+        sample = now - sent_at
+        self.min_rtt = sample if self.min_rtt is None else min(self.min_rtt, sample)
+        sample = max(self.min_rtt, sample - ack_delay)
+        self.srtt = sample if self.srtt is None else 0.875 * self.srtt + 0.125 * sample
+
+    def update(self, now):
+        # Adjusts the rate once per window
+        if now < self.window_end:
+            return
+        self.window_end = now + self.config.window
+
+        # Unacked after twice the smoothed RTT counts as lost; the client
+        # also never acks a snapshot that arrived out of order
+        timeout = max(2 * (self.srtt or 0.1), 0.2)
+        for snapshot_id, sent_at in list(self.sent.items()):
+            if now - sent_at > timeout:
+                del self.sent[snapshot_id]
+                self.lost += 1
+        total = self.acked + self.lost
+        self.loss = self.lost / total if total else 0.0
+        self.acked = self.lost = 0
+
+        queueing = self.srtt is not None and self.srtt > self.min_rtt + self.config.rtt_slack
+        if total and (self.loss > self.config.loss_threshold or queueing):
+            if now - self.last_decrease >= (self.srtt or 0.0):
+                self.rate = max(self.config.min_rate, self.rate * self.config.decrease)
+                self.last_decrease = now
+        else:
+            self.rate = min(self.config.max_rate, self.rate + self.config.increase)
@@ -0,0 +1,55 @@
+import argparse
+import os
+import re
+
+
+PROFILES = ["baseline", "loss2", "loss5", "delay100"]
+
+
+def parse_summary(path):
+    # Bandwidth, position error and update rate from a stats_summary.txt
+    with open(path) as f:
+        content = f.read()
+    stats = {}
+    m = re.search(r"Bandwidth.*Total.*[:=]\s*([\d\.]+)", content)
+    stats["bandwidth"] = float(m.group(1)) if m else 0.0
+    m = re.search(r"Error: Mean=([\d\.]+), Median=([\d\.]+), 95th=([\d\.]+)", content)
+    stats["error_mean"] = float(m.group(1)) if m else 0.0
+    stats["error_95"] = float(m.group(3)) if m else 0.0
+    m = re.search(r"Update Rate:\s+([\d\.]+)", content)
+    stats["ups"] = float(m.group(1)) if m else 0.0
+    return stats
+
+
+def load(results_dir, profile, run):
+    path = os.path.join(results_dir, profile, run, "stats_summary.txt")
+    return parse_summary(path) if os.path.exists(path) else None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Bandwidth saved and position error of adaptive-rate runs against fixed-rate runs")
+    parser.add_argument("--fixed", default="results",
+                        help="results directory of the fixed-rate runs")
+    parser.add_argument("--adaptive", default="results_adaptive",
+                        help="results directory of the --adaptive-rate runs")
+    parser.add_argument("--run", default="run1")
+    args = parser.parse_args()
+
+    print(f"{'profile':10s} {'fixed kbps':>10s} {'adapt kbps':>10s} {'saved':>7s}   "
+          f"{'err mean fixed/adapt':>20s}   {'err p95 fixed/adapt':>19s}   {'ups fixed/adapt':>15s}")
+    for profile in PROFILES:
+        fixed = load(args.fixed, profile, args.run)
+        adaptive = load(args.adaptive, profile, args.run)
+        if fixed is None or adaptive is None:
+            print(f"{profile:10s} missing run")
+            continue
+        saved = 1 - adaptive["bandwidth"] / fixed["bandwidth"] if fixed["bandwidth"] else 0.0
+        print(f"{profile:10s} {fixed['bandwidth']:10.2f} {adaptive['bandwidth']:10.2f} {saved:7.1%}   "
+              f"{fixed['error_mean']:9.4f} / {adaptive['error_mean']:8.4f}   "
+              f"{fixed['error_95']:8.4f} / {adaptive['error_95']:8.4f}   "
+              f"{fixed['ups']:6.2f} / {adaptive['ups']:6.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+class RttEstimator:
+    # Retransmission timeout in the style of RFC 6298. RTT samples are smoothed
+    # into SRTT and RTTVAR, RTO = SRTT + max(G, K * RTTVAR) within
+    # [min_rto, max_rto], and timeouts back it off until the next sample.
+    # As with Linux thin-stream linear timeouts, the first linear_timeouts
+    # resends keep the RTO and later ones double it: a client has at most a
+    # request or two in flight, and two losses in a row must still make the
+    # 200 ms delivery target.
+    # Samples come from ACKs echoing the header timestamp of the copy they
+    # answer, so resent requests can be timed too (no Karn ambiguity).
+
+    def __init__(self, initial_rto=0.25, min_rto=0.05, max_rto=2.0, granularity=0.001,
+                 linear_timeouts=2):
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.granularity = granularity
+        self.linear_timeouts = linear_timeouts
+        self.srtt = None
+        self.rttvar = None
+        self.base_rto = initial_rto
+        self.backoff = 1
+        self.timeouts = 0
+        self.samples = 0
+
+    def rto(self):
+        return min(self.max_rto, self.base_rto * self.backoff)
+
+    def sample(self, rtt):
+        if rtt < 0:
+            # Wall clock stepped back
+            return
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.base_rto = max(self.min_rto, self.srtt + max(self.granularity, 4 * self.rttvar))
+        self.reset_backoff()
+        self.samples += 1
+
+    def on_timeout(self):
+        self.timeouts += 1
+        if self.timeouts > self.linear_timeouts and self.rto() < self.max_rto:
+            self.backoff *= 2
+
+    def reset_backoff(self):
+        # Also called when a request got through but its ACK gave no sample
+        self.backoff = 1
+        self.timeouts = 0
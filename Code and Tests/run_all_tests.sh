@@ -31,6 +31,8 @@ fi
 TEST_MODE=$1
 if [ -z "$TEST_MODE" ]; then
     echo "Usage: sudo ./run_tests.sh [baseline|loss2|loss5|delay100|all]"
+    echo "  SERVER_ARGS: extra server flags, e.g. --adaptive-rate"
+    echo "  RESULTS_DIR: where runs are saved (default: results)"
     exit 1
 fi
 
@@ -38,7 +40,7 @@ fi
 INTERFACE="lo"         
 RUN_DURATION=130      
 CLIENTS=4
-OUT_DIR="results/${TEST_MODE}/run1" 
+OUT_DIR="${RESULTS_DIR:-results}/${TEST_MODE}/run1" 
 
 echo "=== Starting Test: ${TEST_MODE} ==="
 echo "Cleaning old results in ${OUT_DIR}"
@@ -83,7 +85,7 @@ fi
 
 
 echo "Launching Server"
-python3 -u server.py > "${OUT_DIR}/server_log.txt" 2>&1 &
+python3 -u server.py ${SERVER_ARGS} --telemetry-log "${OUT_DIR}/server_events.csv" > "${OUT_DIR}/server_log.txt" 2>&1 &
 SERVER_PID=$!
 sleep 2  
 
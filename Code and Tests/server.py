@@ -1,399 +1,352 @@
 import select
 from socket import *
-import dataclasses
-import enum
+import argparse
+import asyncio
 import time
 import json
-import zlib
-import numpy as np
-import psutil
+import signal
+import sys
 from header import *
+from game_room import GameRoom, ServerState
+from tick_scheduler import TickScheduler, CATCH_UP_SKIP, CATCH_UP_BURST
+from telemetry import Telemetry
+from batched_io import make_socket_io, IO_AUTO, IO_MMSG, IO_PLAIN
+from encode_pipeline import make_encoder, EncodePool
+from rate_control import RateConfig
 
 
-@dataclasses.dataclass
-class Player:
-    id: int
-    address: tuple
-    ready: bool = False
-    last_update_time: float = 0
-    last_snapshot_id: int = 0
-    state_data: dict = dataclasses.field(default_factory=dict)
-    score: int = 0
+class ServerProtocol(asyncio.DatagramProtocol):
+    # Feeds datagrams straight into the server's packet handlers. Replies are
+    # flushed once the loop has handed over every datagram it read in this
+    # pass, as the polling loop does after each read.
 
+    def __init__(self, server):
+        self.server = server
+        self.flush_scheduled = False
 
-class ServerState(enum.Enum):
-    WAITING_FOR_JOIN = 1
-    WAITING_FOR_INIT = 2
-    GAME_LOOP = 3
-    GAME_OVER = 4
+    def datagram_received(self, data, addr):
+        self.server.handle_packet(data, addr)
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self):
+        self.flush_scheduled = False
+        self.server.deliver_encoded()
+
+    def error_received(self, exc):
+        print(f"Socket read error: {exc}")
+
+
+def valid_room_id(room_id):
+    # Rooms named in a JOIN are positive integers
+    return isinstance(room_id, int) and not isinstance(room_id, bool) and room_id > 0
 
 
 class GameServer:
-    def __init__(self):
-        # Server fields
-        self.server_socket = socket(AF_INET, SOCK_DGRAM)
-        self.server_socket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
-        self.server_socket.bind(('', 8888))
+    # Hosts up to max_rooms GameRooms on one socket. Packets are routed to the
+    # room of their sender; a JOIN_REQ from a new address picks the room named
+    # in its payload ({"room": id}, a positive integer) or the first room still
+    # waiting for players.
+    # One scheduler ticks every room. Datagrams are read in batches and each
+    # tick's snapshots are flushed together (recvmmsg/sendmmsg where available).
+    # With encode workers, snapshots are encoded off the tick thread and sent
+    # as each room's job comes back, at most encode_latency after the tick.
+
+    def __init__(self, port=8888, tick_rate=25, catch_up=CATCH_UP_SKIP, telemetry_log=None,
+                 piggyback_acks=True, delta_depth=32, room_size=4, sock=None, io_backend=IO_AUTO,
+                 encode_workers=0, encode_latency=None, adaptive_rate=False, min_rate=5.0,
+                 loss_threshold=0.05, keyframe_interval=0, bundle_mtu=BUNDLE_MTU, max_rooms=1024):
+        # Server fields; sock is an already bound socket (see sharded_server.py)
+        if sock is None:
+            sock = socket(AF_INET, SOCK_DGRAM)
+            sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+            sock.bind(('', port))
+        self.server_socket = sock
         self.server_socket.setblocking(False)
-        self.state = ServerState.WAITING_FOR_JOIN
-        self.seq_num = 0
-
-        # Game fields
-        self.players = {}
-        self.game_running = False
-        self.ready_count = 0
+        self.io = make_socket_io(self.server_socket, io_backend)
+        # Messages for each peer, framed into datagrams once per tick
+        self.outgoing = PeerOutbox(bundle_mtu)
+
+        # Room fields
+        self.rooms = {}
+        self.rooms_by_addr = {}
+        self.next_room_id = 1
+        self.room_size = room_size
+        # JOINs naming a new room are refused beyond this many rooms
+        self.max_rooms = max_rooms
+        self.piggyback_acks = piggyback_acks
+        self.delta_depth = delta_depth
+        self.keyframe_interval = keyframe_interval
+        # Snapshots sent by rooms that have since closed
+        self.closed_snapshots_sent = 0
 
         # Time fields
-        self.interval = 0.04  
-        self.join_time_gap_allowed = 10
-        self.join_start_time = time.time()
-        self.game_start_time = 0
-        self.last_broadcast_time = 0
-
-        # Snapshot fields
-        self.last_snapshot_deltas = []
-        self.current_snapshot = {}
-        self.previous_snapshot = {}
-        self.snapshot_id = 0
-        
+        self.interval = 1.0 / tick_rate
+        self.scheduler = TickScheduler(self.interval, catch_up=catch_up)
+
+        # Encode fields; by default a job may take half a tick
+        if encode_latency is None:
+            encode_latency = self.interval / 2
+        self.encoder = make_encoder(encode_workers, encode_latency)
+
+        # Per-player snapshot rates between min_rate and the tick rate
+        self.rate_config = None
+        if adaptive_rate:
+            self.rate_config = RateConfig(min_rate=min(min_rate, tick_rate), max_rate=tick_rate,
+                                          loss_threshold=loss_threshold)
+
+        # Metrics events are written by a background thread, off the tick path
+        self.telemetry = Telemetry(telemetry_log)
+
         print("Server started. Waiting for players...")
 
     def run(self):
         while True:
             self.run_one_frame()
-            time.sleep(0.001)
 
-    def run_one_frame(self):
-       
-        self.process_network_events()
-        
-        if self.state == ServerState.WAITING_FOR_JOIN:
-            self.update_waiting_for_join()
-        
-        elif self.state == ServerState.WAITING_FOR_INIT:
-            self.run_state_waiting_for_init()
-        
-        elif self.state == ServerState.GAME_LOOP:
-            self.update_game_loop()
-        
-        elif self.state == ServerState.GAME_OVER:
-            self.run_state_game_over()
-
-
-    def process_network_events(self):
-       
-        inputs = [self.server_socket]
-        readable, _, _ = select.select(inputs, [], [], 0.001)
-
-        for sock in readable:
+    async def run_async(self):
+        # Packets are handled as they arrive; the rooms are ticked by a task
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: ServerProtocol(self), sock=self.server_socket)
+        try:
+            for wake_socket in self.encoder.wake_sockets:
+                loop.add_reader(wake_socket, self.deliver_encoded)
             while True:
-                try:
-                    data, addr = sock.recvfrom(2048)
-                    self.handle_packet(data, addr)
-                except BlockingIOError:
-                    
-                    break
-                except Exception as e:
-                    print(f"Socket read error: {e}")
-                    break
+                await asyncio.sleep(self.wait_timeout(self.scheduler.time_until_next()))
+                self.deliver_encoded()
+                self.run_due_ticks()
+        finally:
+            for wake_socket in self.encoder.wake_sockets:
+                loop.remove_reader(wake_socket)
+            transport.close()
+
+    def run_one_frame(self):
+        # Block on the socket until the next tick deadline, then run the due ticks
+        self.process_network_events(self.scheduler.time_until_next())
+        self.run_due_ticks()
+
+    def run_due_ticks(self):
+        ticks = self.scheduler.poll()
+        if not ticks:
+            return
+        start = time.monotonic()
+        self.update_rooms(ticks)
+        self.deliver_encoded()
+        self.scheduler.record_duration(time.monotonic() - start)
+
+    def deliver_encoded(self):
+        # Sends whatever the encoder has finished, along with everything else
+        # queued for each peer since the last flush
+        self.encoder.complete()
+        if self.outgoing.pending():
+            self.outgoing.flush(self.io.sendto)
+        self.io.flush()
+
+    def wait_timeout(self, timeout):
+        # Wake up in time to wait for the oldest encode job when it is due
+        due = self.encoder.time_until_due()
+        return timeout if due is None else min(timeout, due)
+
+    def update_rooms(self, ticks=1):
+        in_game = False
+        for room in list(self.rooms.values()):
+            room.update_state(ticks)
+            if room.closed:
+                self.close_room(room)
+            elif room.state == ServerState.GAME_LOOP:
+                in_game = True
+        # CPU is sampled only while some match is being played
+        self.telemetry.set_cpu_sampling(in_game)
+
+    def process_network_events(self, timeout=0.001):
+        readable, _, _ = select.select(self.select_inputs(), [], [], self.wait_timeout(timeout))
+        self.handle_readable(readable)
+        self.deliver_encoded()
+
+    def select_inputs(self):
+        return [self.server_socket] + self.encoder.wake_sockets
+
+    def handle_readable(self, readable):
+        if self.server_socket in readable:
+            self.drain_socket()
+
+    def drain_socket(self):
+        while True:
+            try:
+                packets = self.io.recv_batch()
+            except Exception as e:
+                print(f"Socket read error: {e}")
+                break
+            if not packets:
+                break
+            for data, addr in packets:
+                self.handle_packet(data, addr)
 
     def handle_packet(self, data, addr):
         try:
-            header, payload = parse_packet(data)
-            msg_type = header["msg_type"]
-
-            
-            if self.state == ServerState.WAITING_FOR_JOIN:
-                if msg_type == MSG_JOIN_REQ:
-                    self.handle_join_req(addr)
-                elif msg_type == MSG_READY_REQ:
-                    self.handle_ready_req(addr)
-            
-            elif self.state == ServerState.GAME_LOOP:
-                if msg_type == MSG_ACQUIRE_EVENT:
-                    self.handle_acquire_event(addr, payload)
-                elif msg_type == MSG_SNAPSHOT_ACK:
-                    self.handle_snapshot_ack(addr, header)
-            
-            elif self.state == ServerState.GAME_OVER:
-                if msg_type==MSG_END_GAME:
-                    if self.players.pop(addr, None):
-                        print(f"Player at {addr} acknowledged Game Over.")
-                   
-
-            
+            # A datagram may carry several packets; the first one routes it
+            packets = parse_packets(data)
+            if not packets:
+                return
+            header, payload = packets[0]
+
+            room = self.rooms_by_addr.get(addr)
+            if room is None:
+                if header.msg_type != MSG_JOIN_REQ:
+                    return
+                room = self.find_room(payload)
+                if room is None:
+                    print(f"No open room for join from {addr}")
+                    return
+                self.rooms_by_addr[addr] = room
+
+            room.handle_datagram(addr, packets)
 
         except Exception as e:
             print(f"Error handling packet: {e}")
 
-    def handle_join_req(self, addr):
-        if addr in self.players:
-            print(f"Ignoring duplicate join from {addr}")
-            existing_player = self.players[addr]
-            ack_payload = json.dumps({"player_id": existing_player.id}).encode()
-            self.seq_num += 1
-            ack_packet = make_packet(MSG_JOIN_ACK, payload=ack_payload, seq_num=self.seq_num)
-            self.server_socket.sendto(ack_packet, addr)
-            return
-
-        new_id = len(self.players) + 1
-        player = Player(id=new_id, address=addr)
-        self.players[addr] = player
-        print(f"Player {new_id} joined from {addr}")
-
-        # Send join acknowledgment
-        ack_payload = json.dumps({"player_id": new_id}).encode()
-        self.seq_num += 1
-        ack_packet = make_packet(MSG_JOIN_ACK, payload=ack_payload, seq_num=self.seq_num)
-        self.server_socket.sendto(ack_packet, addr)
-
-    def handle_ready_req(self, addr):
-        if addr in self.players:
-            if not self.players[addr].ready:
-                self.players[addr].ready = True
-                self.ready_count += 1
-                print(f"Player {self.players[addr].id} is ready ({self.ready_count}/{len(self.players)})")
-            
-            self.seq_num += 1
-            ack_packet = make_packet(MSG_READY_ACK, seq_num=self.seq_num)
-            self.server_socket.sendto(ack_packet, addr)
-
-    def handle_acquire_event(self, addr, payload):
-
-        payload_dict = json.loads(payload.decode())
-        cell_x, cell_y = payload_dict["x"], payload_dict["y"]
-        
-        ack_payload=json.dumps({"x": cell_x,"y":cell_y}).encode()
-        ack_packet = make_packet(MSG_ACQUIRE_ACK, payload=ack_payload ,seq_num=self.seq_num)
-        self.server_socket.sendto(ack_packet,addr)
-        player = self.players.get(addr)
-
-        if player:
-            if self.current_snapshot["grid"][cell_y][cell_x] == 0:
-                self.current_snapshot["grid"][cell_y][cell_x] = player.id
-                player.score += 1
-                print(f"Player {player.id} acquired cell ({cell_x}, {cell_y})")
-                print(f"POS_SERVER id={player.id} x={cell_x} y={cell_y} ts={time.time()}")
-        #self.current_snapshot["timestamp"] = time.time()
-
-    def handle_snapshot_ack(self, addr, header):
-        snapshot_id = header["snapshot_id"]
-
-        player = self.players.get(addr)
-        if player:
-            # Only update if this is a newer or same ack
-            if snapshot_id >= player.last_snapshot_id:
-                player.last_snapshot_id = snapshot_id
-                player.last_update_time = time.time()
-                # print(f"ACK from Player {player.id} for snapshot {snapshot_id}")
-
-
-
-    def update_waiting_for_join(self):
-
-        time_elapsed = time.time() - self.join_start_time
-        #time_condition = (time_elapsed >= self.join_time_gap_allowed and len(self.players) > 1)
-        ready_condition = (len(self.players) >= 4 and self.ready_count == 4)
-        time_condition = False  # Disable time condition for testing
-        for address, player in self.players.items():
-            if  not player.ready:
-                self.seq_num += 1
-                ack_packet = make_packet(MSG_READY_ACK, seq_num=self.seq_num)
-                self.server_socket.sendto(ack_packet, address)
-          
-
-        if time_condition or ready_condition:
-            print("Conditions met, moving to INIT state.")
-            self.state = ServerState.WAITING_FOR_INIT
-
-    def run_state_waiting_for_init(self):
-        print("Sending initial snapshot")
-
-        self.current_snapshot = {
-            "grid": ([[0 for _ in range(20)] for _ in range(20)]),
-            "timestamp": time.time(),
-            "snapshot_id": self.snapshot_id
+    def find_room(self, join_payload):
+        # Requested room if the JOIN names one, otherwise matchmaking
+        room_id = None
+        if join_payload:
+            try:
+                room_id = json.loads(bytes(join_payload)).get("room")
+            except (ValueError, AttributeError):
+                room_id = None
+
+        if room_id is not None:
+            if not valid_room_id(room_id):
+                print(f"Refusing join to invalid room {room_id!r}")
+                return None
+            room = self.rooms.get(room_id)
+            if room is None:
+                return self.create_room(room_id)
+            return room if room.is_open() else None
+
+        for room in self.rooms.values():
+            if room.is_open():
+                return room
+        return self.create_room()
+
+    def create_room(self, room_id=None):
+        if len(self.rooms) >= self.max_rooms:
+            print(f"Room limit reached ({self.max_rooms} active)")
+            return None
+        if room_id is None:
+            while self.next_room_id in self.rooms:
+                self.next_room_id += 1
+            room_id = self.next_room_id
+            self.next_room_id += 1
+
+        room = self.new_room(room_id)
+        if room is None:
+            return None
+        self.rooms[room_id] = room
+        print(f"Opened room {room_id} ({len(self.rooms)} active)")
+        return room
+
+    def new_room(self, room_id):
+        return GameRoom(room_id, self.io, self.telemetry, room_size=self.room_size,
+                        piggyback_acks=self.piggyback_acks, delta_depth=self.delta_depth,
+                        encoder=self.encoder, rate_config=self.rate_config,
+                        keyframe_interval=self.keyframe_interval, outgoing=self.outgoing)
+
+    def close_room(self, room):
+        del self.rooms[room.room_id]
+        self.closed_snapshots_sent += room.snapshots_sent
+        for addr in room.addresses:
+            if self.rooms_by_addr.get(addr) is room:
+                del self.rooms_by_addr[addr]
+        self.print_tick_stats()
+        print(f"Closed room {room.room_id} ({len(self.rooms)} active). Ready for next round.")
+
+    def stats(self):
+        stats = {
+            "rooms": len(self.rooms),
+            "players": sum(len(room.players) for room in self.rooms.values()),
+            "snapshots_sent": self.closed_snapshots_sent + sum(
+                room.snapshots_sent for room in self.rooms.values()),
         }
-
-        snapshot_payload = json.dumps(self.current_snapshot).encode()
-        self.seq_num += 1
-        snapshot_payload=zlib.compress(snapshot_payload)
-        snapshot_packet = make_packet(MSG_SNAPSHOT_FULL, payload=snapshot_payload, snapshot_id=self.snapshot_id, seq_num=self.seq_num)
-
-        for player in self.players.values():
-            self.server_socket.sendto(snapshot_packet, player.address)
-            print(f"Sent initial snapshot to Player {player.id}")
-
-        self.snapshot_id += 1
-        self.game_running = True
-        self.game_start_time = time.time()
-        self.last_broadcast_time = time.time()  
-        
-       
-        self.state = ServerState.GAME_LOOP
-        print("Entering GAME_LOOP")
-
-    def update_game_loop(self):
-        
-        current_time = time.time()
-        
-      
-        if (current_time - self.last_broadcast_time) >= self.interval:
-            self.broadcast_snapshots()
-            self.last_broadcast_time = current_time 
-
-
-        grid_flat = np.array(self.current_snapshot["grid"]).flatten()
-        if np.all(grid_flat != 0):
-            print("All cells claimed ending game.")
-            self.game_running = False
-            self.state = ServerState.GAME_OVER
-
-    def broadcast_snapshots(self):
-      
-        self.seq_num += 1
-        server_snapshot_id = self.snapshot_id 
-        
-       
-        if self.previous_snapshot and "grid" in self.previous_snapshot:
-            old_grid = self.previous_snapshot["grid"]
-        else:
-            old_grid = [[0 for _ in range(20)] for _ in range(20)]
-
-        new_grid = self.current_snapshot["grid"]
-
-        old_arr = np.array(old_grid)
-        new_arr = np.array(new_grid)
-        diff_indices = np.argwhere(old_arr != new_arr)
-        delta_changes = [(int(y), int(x), int(new_arr[y, x])) for y, x in diff_indices]
-
-  
-        delta_entry = {
-                "snapshot_id": server_snapshot_id,
-                "delta": delta_changes,
-        }
-        self.last_snapshot_deltas.append(delta_entry)
-        if len(self.last_snapshot_deltas) > 3:
-             self.last_snapshot_deltas.pop(0)
-
-        
-        #self.current_snapshot["timestamp"] = time.time()
-        self.current_snapshot["snapshot_id"] = server_snapshot_id
-
-    
-        full_payload = json.dumps(self.current_snapshot).encode()
-        full_payload = zlib.compress(full_payload)
-        full_packet = make_packet(MSG_SNAPSHOT_FULL, payload=full_payload,
-                                  snapshot_id=server_snapshot_id, seq_num=self.seq_num)
-        
-        packet_ts = unpack_header(full_packet)['timestamp'] 
-        cpu = psutil.cpu_percent()
-        print(f"CPU_USAGE percent={cpu} ts={packet_ts}")
-
-        for player in self.players.values():
-            diff = server_snapshot_id - player.last_snapshot_id
-
-            if diff <= len(self.last_snapshot_deltas) and diff > 0 and self.last_snapshot_deltas:
-                missed = self.last_snapshot_deltas[-diff:]
-                combined_changes = [cell for delta in missed for cell in delta["delta"]]
-
-                delta_payload = json.dumps({
-                    "snapshot_id": server_snapshot_id,
-                    "changes": combined_changes
-                }).encode()
-
-                delta_packet = make_packet(MSG_SNAPSHOT_DELTA, payload=delta_payload,
-                                           snapshot_id=server_snapshot_id, seq_num=self.seq_num)
-
-                self.server_socket.sendto(delta_packet, player.address)
-                
-                # print(f"Sent DELTA snapshot to Player {player.id}")
-            else:
-                
-                self.server_socket.sendto(full_packet, player.address)
-               
-
-            print(f"SNAPSHOT_SEND server_ts={time.time()} snapshot_id={server_snapshot_id} seq={self.seq_num}")
-        
-  
-        self.previous_snapshot = {
-            "grid": [row.copy() for row in self.current_snapshot["grid"]],
-            #"timestamp": self.current_snapshot["timestamp"],
-            "snapshot_id": server_snapshot_id
-        }
-        
-        self.snapshot_id += 1 
-
-    def handle_leaderboard(self,players):
-
-        leaderboard = sorted(self.players.values(), key=lambda p: p.score, reverse=True)
-
-        print("\n=== FINAL LEADERBOARD ===")
-        for rank, player in enumerate(leaderboard, start=1):
-            print(f"{rank}. Player {player.id} — Score: {player.score}")
-        print("==========================\n")
-
-        leaderboard_data = {
-            "type": "leaderboard",
-            "results": [
-                {"rank": rank, "player_id": player.id, "score": player.score}
-                for rank, player in enumerate(leaderboard, start=1)
-            ]
-        }
-
-        leaderboard_payload = json.dumps(leaderboard_data).encode()
-        leaderboard_packet = make_packet(MSG_LEADERBOARD, payload=leaderboard_payload)
-
-
-        for player in leaderboard:
-            self.server_socket.sendto(leaderboard_packet, player.address)
-            print(f"Leaderboard sent to Player {player.id}")
-
-
-    def run_state_game_over(self):
-        print("\n--- GAME OVER ---")
-
-        end_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-        print(f"Game ended at: {end_time}")
-
-        duration = round(time.time() - self.game_start_time, 2)
-        print(f"Total game duration: {duration} seconds")
-
-        self.handle_leaderboard(self.players)
-
-        patience_time=3
-        timer_start=time.time()
-        
-        while self.players and time.time() - timer_start < patience_time:
-                
-                self.handle_leaderboard(self.players)
-                self.process_network_events()
-                time.sleep(0.1)
-
-       
-
-        self.reset_server_state()
-
-    def reset_server_state(self):
-        print("Game session ended. Ready for next round.")
-        
-        self.players.clear()
-        self.ready_count = 0
-        self.seq_num = 0
-        self.snapshot_id = 0
-        self.last_snapshot_deltas.clear()
-        self.current_snapshot = {}
-        self.previous_snapshot = {}
-        self.game_running = False
-        
-        self.state = ServerState.WAITING_FOR_JOIN
-        self.join_start_time = time.time()
+        stats.update(self.scheduler.stats())
+        stats["recv_calls"] = self.io.recv_calls
+        stats["send_calls"] = self.io.send_calls
+        stats.update(self.outgoing.stats())
+        return stats
+
+    def print_tick_stats(self):
+        stats = self.scheduler.stats()
+        print("TICK_STATS " + " ".join(
+            f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}"
+            for key, value in stats.items()))
+        print("TICK_HISTOGRAM " + self.scheduler.durations.format())
+        print("OUTBOUND_STATS " + " ".join(f"{key}={value}" for key, value in self.outgoing.stats().items()))
+        if isinstance(self.encoder, EncodePool):
+            print(f"ENCODE_HISTOGRAM forced_waits={self.encoder.forced_waits} "
+                  + self.encoder.latency.format())
+
+    def close(self):
+        self.encoder.close()
+        self.telemetry.close()
+        self.server_socket.close()
 
 
 if __name__ == "__main__":
-    server = GameServer()
+    parser = argparse.ArgumentParser(description="Grid Clash server")
+    parser.add_argument("--mode", choices=["poll", "async"], default="poll",
+                        help="select polling loop or asyncio event loop")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--room-size", type=int, default=4,
+                        help="players needed to start a match")
+    parser.add_argument("--max-rooms", type=int, default=1024,
+                        help="rooms hosted at once; joins that need another one are refused")
+    parser.add_argument("--delta-depth", type=int, default=32,
+                        help="recent grid versions kept for acks in flight; older ones are kept only as baselines")
+    parser.add_argument("--keyframe-interval", type=int, default=0,
+                        help="snapshots between forced full snapshots to each player "
+                             "(0: only when a client's grid hash disagrees)")
+    parser.add_argument("--separate-acks", action="store_true",
+                        help="send acquire ACKs in their own datagram instead of inside the snapshot")
+    parser.add_argument("--bundle-mtu", type=int, default=BUNDLE_MTU,
+                        help="largest datagram a client's messages of one tick may share "
+                             "(0: one message per datagram)")
+    parser.add_argument("--telemetry-log", default=None,
+                        help="write metrics events to this CSV file instead of stdout")
+    parser.add_argument("--tick-rate", type=float, default=25,
+                        help="snapshot broadcasts per second")
+    parser.add_argument("--catch-up", choices=[CATCH_UP_SKIP, CATCH_UP_BURST], default=CATCH_UP_SKIP,
+                        help="drop missed ticks or run them back to back")
+    parser.add_argument("--io", choices=[IO_AUTO, IO_MMSG, IO_PLAIN], default=IO_AUTO,
+                        help="batched recvmmsg/sendmmsg socket I/O or one syscall per datagram")
+    parser.add_argument("--encode-workers", type=int, default=0,
+                        help="threads encoding snapshots off the tick thread (0: encode inline)")
+    parser.add_argument("--encode-latency-ms", type=float, default=None,
+                        help="longest an encode job may hold back a tick's packets (default: half a tick)")
+    parser.add_argument("--adaptive-rate", action="store_true",
+                        help="adapt each player's snapshot rate to its acks (AIMD)")
+    parser.add_argument("--min-rate", type=float, default=5.0,
+                        help="lowest adaptive snapshot rate per player, in Hz")
+    parser.add_argument("--loss-threshold", type=float, default=0.05,
+                        help="snapshot loss share that makes the adaptive rate back off")
+    args = parser.parse_args()
+
+    server = GameServer(port=args.port, tick_rate=args.tick_rate, catch_up=args.catch_up,
+                        telemetry_log=args.telemetry_log, piggyback_acks=not args.separate_acks,
+                        delta_depth=args.delta_depth, room_size=args.room_size, max_rooms=args.max_rooms, io_backend=args.io,
+                        encode_workers=args.encode_workers,
+                        encode_latency=None if args.encode_latency_ms is None else args.encode_latency_ms / 1000,
+                        adaptive_rate=args.adaptive_rate, min_rate=args.min_rate,
+                        loss_threshold=args.loss_threshold, keyframe_interval=args.keyframe_interval,
+                        bundle_mtu=args.bundle_mtu)
+    # Exit through the finally block on kill so buffered telemetry is written
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     try:
-        server.run()
+        if args.mode == "async":
+            asyncio.run(server.run_async())
+        else:
+            server.run()
     except KeyboardInterrupt:
         print("\nServer shutting down.")
-        server.server_socket.close()
\ No newline at end of file
+    finally:
+        server.close()
@@ -0,0 +1,340 @@
+import argparse
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import struct
+import sys
+import time
+from socket import *
+from header import *
+from server import GameServer, valid_room_id
+from tick_scheduler import CATCH_UP_SKIP, CATCH_UP_BURST
+from batched_io import IO_AUTO, IO_MMSG, IO_PLAIN
+
+
+# A datagram forwarded between workers: client IPv4 address and port, then
+# the client's datagram unchanged
+FORWARD_STRUCT = struct.Struct("!4s H")
+# Seconds without a packet after which a client's forwarding route is
+# dropped; clients in a room send several packets a second
+FORWARD_IDLE_TIMEOUT = 30.0
+# Send buffer of the forward socket, so a burst of forwarded packets does not
+# fill it while the owning worker is busy ticking
+FORWARD_SNDBUF = 1 << 20
+
+
+def forward_address(port, index):
+    # Abstract-namespace Unix socket of worker `index`
+    return f"\0gridclash-{port}-{index}"
+
+
+def room_owner(room_id, worker_count):
+    # Worker that hosts a room. Automatic room ids are handed out so that
+    # worker i only creates ids equal to i modulo the worker count.
+    return room_id % worker_count
+
+
+class WorkerServer(GameServer):
+    # One shard of the sharded server. The kernel spreads clients over the
+    # workers' SO_REUSEPORT sockets by flow hash, so every packet from a client
+    # reaches the same worker and matchmade rooms simply live there. A JOIN
+    # naming a room owned by another worker is forwarded to it, together with
+    # everything else that client sends; the owner replies straight from its
+    # own socket on the shared port. A route is dropped once the client has
+    # been quiet for forward_idle seconds, e.g. after its room closed.
+    # Forwarding is as lossy as UDP: a packet the owner's queue has no room
+    # for is dropped and counted.
+
+    def __init__(self, index, worker_count, sock, forward_socket, port,
+                 forward_idle=FORWARD_IDLE_TIMEOUT, **kwargs):
+        super().__init__(port=port, sock=sock, **kwargs)
+        self.index = index
+        self.worker_count = worker_count
+        self.port = port
+        self.forward_socket = forward_socket
+        self.forward_socket.setblocking(False)
+        self.forward_socket.setsockopt(SOL_SOCKET, SO_SNDBUF, FORWARD_SNDBUF)
+        self.forward_dropped = 0
+        # Client address -> worker its packets are forwarded to, and when the
+        # client last sent one (monotonic)
+        self.forwarded = {}
+        self.forwarded_seen = {}
+        self.forward_idle = forward_idle
+        self.next_forward_expiry = time.monotonic() + forward_idle
+        self.next_room_id = index if index else worker_count
+
+    def create_room(self, room_id=None):
+        if room_id is None:
+            while self.next_room_id in self.rooms:
+                self.next_room_id += self.worker_count
+            room_id = self.next_room_id
+            self.next_room_id += self.worker_count
+        return super().create_room(room_id)
+
+    def select_inputs(self):
+        return super().select_inputs() + [self.forward_socket]
+
+    def handle_readable(self, readable):
+        if self.forward_socket in readable:
+            while True:
+                try:
+                    data = self.forward_socket.recv(MAX_DATAGRAM_SIZE)
+                except BlockingIOError:
+                    break
+                ip, client_port = FORWARD_STRUCT.unpack_from(data)
+                addr = (inet_ntoa(ip), client_port)
+                GameServer.handle_packet(self, memoryview(data)[FORWARD_STRUCT.size:], addr)
+        super().handle_readable(readable)
+
+    def handle_packet(self, data, addr):
+        if addr not in self.rooms_by_addr:
+            try:
+                owner = self.route(data, addr)
+            except Exception as e:
+                print(f"Error routing packet: {e}")
+                return
+            if owner != self.index:
+                self.forwarded[addr] = owner
+                self.forwarded_seen[addr] = time.monotonic()
+                packet = FORWARD_STRUCT.pack(inet_aton(addr[0]), addr[1]) + bytes(data)
+                try:
+                    self.forward_socket.sendto(packet, forward_address(self.port, owner))
+                except OSError:
+                    # Owner's queue is full (or the owner is restarting)
+                    self.forward_dropped += 1
+                return
+            self.forwarded.pop(addr, None)
+            self.forwarded_seen.pop(addr, None)
+        super().handle_packet(data, addr)
+
+    def update_rooms(self, ticks=1):
+        super().update_rooms(ticks)
+        now = time.monotonic()
+        if now >= self.next_forward_expiry:
+            self.expire_forwarded(now)
+            self.next_forward_expiry = now + self.forward_idle
+
+    def expire_forwarded(self, now):
+        for addr in [addr for addr, seen in self.forwarded_seen.items()
+                     if now - seen > self.forward_idle]:
+            del self.forwarded[addr]
+            del self.forwarded_seen[addr]
+
+    def route(self, data, addr):
+        # Worker that should handle a packet from a client with no room here
+        header, payload = parse_packet(data)
+        if header.msg_type == MSG_JOIN_REQ and payload:
+            try:
+                room_id = json.loads(bytes(payload)).get("room")
+            except (ValueError, AttributeError):
+                room_id = None
+            # Invalid room ids are refused here
+            if valid_room_id(room_id):
+                return room_owner(room_id, self.worker_count)
+            return self.index
+        return self.forwarded.get(addr, self.index)
+
+
+def run_worker(index, worker_count, port, sock, forward_socket, stats_conn, stats_interval, server_args):
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server = WorkerServer(index, worker_count, sock, forward_socket, port, **server_args)
+    next_stats = time.monotonic()
+    try:
+        while True:
+            server.run_one_frame()
+            now = time.monotonic()
+            if now >= next_stats:
+                next_stats = now + stats_interval
+                stats = server.stats()
+                stats["worker"] = index
+                stats["pid"] = os.getpid()
+                stats["forwarded_clients"] = len(server.forwarded)
+                stats["forward_dropped"] = server.forward_dropped
+                stats["time"] = now
+                stats_conn.send(stats)
+    finally:
+        server.encoder.close()
+        server.telemetry.close()
+
+
+class Supervisor:
+    # Owns every worker's sockets so they outlive the workers: a restarted
+    # worker picks up the same SO_REUSEPORT socket, which keeps the kernel's
+    # flow-to-socket mapping unchanged. Restarts crashed workers and prints
+    # aggregated stats.
+
+    def __init__(self, worker_count, port, server_args, stats_interval=1.0, restart_delay=0.5):
+        self.worker_count = worker_count
+        self.port = port
+        self.server_args = server_args
+        self.stats_interval = stats_interval
+        self.restart_delay = restart_delay
+        self.context = multiprocessing.get_context("fork")
+
+        self.sockets = []
+        self.forward_sockets = []
+        for index in range(worker_count):
+            sock = socket(AF_INET, SOCK_DGRAM)
+            sock.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1)
+            sock.bind(('', port))
+            self.sockets.append(sock)
+            forward_socket = socket(AF_UNIX, SOCK_DGRAM)
+            forward_socket.bind(forward_address(port, index))
+            self.forward_sockets.append(forward_socket)
+
+        self.processes = [None] * worker_count
+        self.stats_conns = [None] * worker_count
+        self.stats = [{} for _ in range(worker_count)]
+        # Last (snapshots_sent, time) report and the rate between the last two
+        self.last_sent = [None] * worker_count
+        self.rates = [0.0] * worker_count
+        self.restarts = 0
+        self.running = True
+
+    def start_worker(self, index):
+        # Worker telemetry logs get the worker index appended
+        server_args = dict(self.server_args)
+        if server_args.get("telemetry_log"):
+            base, ext = os.path.splitext(server_args["telemetry_log"])
+            server_args["telemetry_log"] = f"{base}-w{index}{ext}"
+
+        stats_recv, stats_send = self.context.Pipe(duplex=False)
+        process = self.context.Process(
+            target=run_worker, name=f"worker-{index}",
+            args=(index, self.worker_count, self.port, self.sockets[index], self.forward_sockets[index],
+                  stats_send, self.stats_interval, server_args))
+        process.start()
+        stats_send.close()
+        self.processes[index] = process
+        self.stats_conns[index] = stats_recv
+        self.last_sent[index] = None
+        self.rates[index] = 0.0
+        print(f"Started worker {index} (pid {process.pid})")
+
+    def run(self):
+        for index in range(self.worker_count):
+            self.start_worker(index)
+
+        next_report = time.monotonic() + self.stats_interval
+        while self.running:
+            conns = [conn for conn in self.stats_conns if conn is not None]
+            ready = multiprocessing.connection.wait(conns, timeout=self.stats_interval)
+            for conn in ready:
+                index = self.stats_conns.index(conn)
+                try:
+                    self.record_stats(index, conn.recv())
+                except (EOFError, OSError):
+                    self.stats_conns[index] = None
+
+            for index, process in enumerate(self.processes):
+                if self.running and not process.is_alive():
+                    print(f"Worker {index} (pid {process.pid}) exited with code {process.exitcode}; restarting")
+                    self.restarts += 1
+                    time.sleep(self.restart_delay)
+                    self.start_worker(index)
+
+            now = time.monotonic()
+            if now >= next_report:
+                self.report()
+                next_report = now + self.stats_interval
+
+    def record_stats(self, index, stats):
+        # Workers stamp reports with the system-wide monotonic clock
+        last = self.last_sent[index]
+        if last is not None and stats["time"] > last[1]:
+            self.rates[index] = (stats["snapshots_sent"] - last[0]) / (stats["time"] - last[1])
+        self.last_sent[index] = (stats["snapshots_sent"], stats["time"])
+        self.stats[index] = stats
+
+    def report(self):
+        total_rate = 0
+        for index, stats in enumerate(self.stats):
+            rate = self.rates[index]
+            total_rate += rate
+            if stats:
+                print(f"WORKER_STATS worker={index} pid={stats['pid']} rooms={stats['rooms']} "
+                      f"players={stats['players']} forwarded={stats['forwarded_clients']} "
+                      f"forward_dropped={stats['forward_dropped']} "
+                      f"snapshots_per_sec={rate:.0f} late_ticks={stats['late_ticks']} "
+                      f"max_duration_ms={stats['max_duration_ms']:.3f}")
+        alive = sum(1 for process in self.processes if process.is_alive())
+        print(f"SHARD_STATS workers={self.worker_count} alive={alive} restarts={self.restarts} "
+              f"rooms={sum(s.get('rooms', 0) for s in self.stats)} "
+              f"players={sum(s.get('players', 0) for s in self.stats)} "
+              f"snapshots_per_sec={total_rate:.0f}", flush=True)
+
+    def stop(self):
+        self.running = False
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self.processes:
+            if process is not None:
+                process.join(timeout=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Grid Clash server sharded over SO_REUSEPORT workers")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--stats-interval", type=float, default=1.0,
+                        help="seconds between aggregated stats reports")
+    parser.add_argument("--room-size", type=int, default=4,
+                        help="players needed to start a match")
+    parser.add_argument("--max-rooms", type=int, default=1024,
+                        help="rooms each worker hosts at once; joins that need another one are refused")
+    parser.add_argument("--delta-depth", type=int, default=32,
+                        help="recent grid versions kept for acks in flight; older ones are kept only as baselines")
+    parser.add_argument("--keyframe-interval", type=int, default=0,
+                        help="snapshots between forced full snapshots to each player "
+                             "(0: only when a client's grid hash disagrees)")
+    parser.add_argument("--separate-acks", action="store_true",
+                        help="send acquire ACKs in their own datagram instead of inside the snapshot")
+    parser.add_argument("--bundle-mtu", type=int, default=BUNDLE_MTU,
+                        help="largest datagram a client's messages of one tick may share "
+                             "(0: one message per datagram)")
+    parser.add_argument("--telemetry-log", default=None,
+                        help="write each worker's metrics events to this CSV path, suffixed -w<index>")
+    parser.add_argument("--tick-rate", type=float, default=25,
+                        help="snapshot broadcasts per second")
+    parser.add_argument("--catch-up", choices=[CATCH_UP_SKIP, CATCH_UP_BURST], default=CATCH_UP_SKIP,
+                        help="drop missed ticks or run them back to back")
+    parser.add_argument("--io", choices=[IO_AUTO, IO_MMSG, IO_PLAIN], default=IO_AUTO,
+                        help="batched recvmmsg/sendmmsg socket I/O or one syscall per datagram")
+    parser.add_argument("--encode-workers", type=int, default=0,
+                        help="threads per worker encoding snapshots off the tick thread (0: encode inline)")
+    parser.add_argument("--encode-latency-ms", type=float, default=None,
+                        help="longest an encode job may hold back a tick's packets (default: half a tick)")
+    parser.add_argument("--adaptive-rate", action="store_true",
+                        help="adapt each player's snapshot rate to its acks (AIMD)")
+    parser.add_argument("--min-rate", type=float, default=5.0,
+                        help="lowest adaptive snapshot rate per player, in Hz")
+    args = parser.parse_args()
+
+    server_args = {
+        "tick_rate": args.tick_rate,
+        "catch_up": args.catch_up,
+        "telemetry_log": args.telemetry_log,
+        "piggyback_acks": not args.separate_acks,
+        "delta_depth": args.delta_depth,
+        "keyframe_interval": args.keyframe_interval,
+        "bundle_mtu": args.bundle_mtu,
+        "room_size": args.room_size,
+        "max_rooms": args.max_rooms,
+        "io_backend": args.io,
+        "encode_workers": args.encode_workers,
+        "encode_latency": None if args.encode_latency_ms is None else args.encode_latency_ms / 1000,
+        "adaptive_rate": args.adaptive_rate,
+        "min_rate": args.min_rate,
+    }
+    supervisor = Supervisor(args.workers, args.port, server_args, stats_interval=args.stats_interval)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        supervisor.run()
+    except (KeyboardInterrupt, SystemExit):
+        print("\nServer shutting down.")
+    finally:
+        supervisor.stop()
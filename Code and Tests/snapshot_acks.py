@@ -0,0 +1,100 @@
+from header import *
+
+
+class SnapshotReceipts:
+    # Client side: snapshots received, acknowledged together by one
+    # SNAPSHOT_ACK naming the newest snapshot and, in a bitmap, which of the
+    # SNAPSHOT_ACK_BITS before it arrived too. Like a TCP delayed ACK, a
+    # standalone ack waits until `every` snapshots are unacked or the oldest
+    # of them has waited `delay` seconds; an acquire sent meanwhile carries
+    # it for free. delay 0 acks every drain cycle.
+
+    def __init__(self, delay=0.05, every=2):
+        self.delay = delay
+        self.every = every
+        self.newest = None
+        # When the newest snapshot arrived, for the ack delay
+        self.newest_at = 0.0
+        # Bit i set: snapshot newest - 1 - i arrived
+        self.bitmap = 0
+        # Something arrived since the last ack
+        self.ack_due = False
+        self.unacked = 0
+        self.first_unacked_at = 0.0
+
+    def due(self, now):
+        # Whether a standalone ack should go out now
+        return self.ack_due and (self.unacked >= self.every or
+                                 now - self.first_unacked_at >= self.delay)
+
+    def record(self, snapshot_id, now):
+        if self.newest is None or snapshot_id > self.newest:
+            if self.newest is not None:
+                shift = snapshot_id - self.newest
+                self.bitmap = (self.bitmap << shift | 1 << (shift - 1)) & SNAPSHOT_ACK_MASK
+            self.newest = snapshot_id
+            self.newest_at = now
+        elif snapshot_id < self.newest:
+            offset = self.newest - snapshot_id - 1
+            if offset < SNAPSHOT_ACK_BITS:
+                self.bitmap |= 1 << offset
+        if not self.ack_due:
+            self.first_unacked_at = now
+        self.ack_due = True
+        self.unacked += 1
+
+    def take_ack(self, now):
+        # (newest snapshot_id, bitmap, seconds the newest waited for this
+        # ack) for the next SNAPSHOT_ACK
+        self.ack_due = False
+        self.unacked = 0
+        return self.newest, self.bitmap, max(0.0, now - self.newest_at)
+
+
+def acked_snapshots(newest, bitmap):
+    # Every snapshot_id a SNAPSHOT_ACK reports, newest first
+    acked = [newest]
+    offset = 0
+    while bitmap:
+        if bitmap & 1:
+            acked.append(newest - 1 - offset)
+        bitmap >>= 1
+        offset += 1
+    return acked
+
+
+class SnapshotDelivery:
+    # Server side: which snapshots sent to one player its acks reported. A
+    # snapshot still unreported once it falls out of the ack bitmap of the
+    # newest ack is counted as lost (the client never acks one that arrived
+    # behind a newer snapshot, so reordering counts as loss too).
+
+    def __init__(self):
+        self.outstanding = set()
+        self.newest_acked = -1
+        self.sent = 0
+        self.delivered = 0
+        self.lost = 0
+
+    def on_send(self, snapshot_id):
+        self.sent += 1
+        self.outstanding.add(snapshot_id)
+        # Bounds the set for a player that stopped acking
+        self.expire(snapshot_id - 2 * SNAPSHOT_ACK_BITS)
+
+    def on_ack(self, acked):
+        for snapshot_id in acked:
+            if snapshot_id in self.outstanding:
+                self.outstanding.remove(snapshot_id)
+                self.delivered += 1
+        self.newest_acked = max(self.newest_acked, acked[0])
+        self.expire(self.newest_acked - SNAPSHOT_ACK_BITS)
+
+    def expire(self, before):
+        lost = [snapshot_id for snapshot_id in self.outstanding if snapshot_id < before]
+        self.outstanding.difference_update(lost)
+        self.lost += len(lost)
+
+    def loss(self):
+        total = self.delivered + self.lost
+        return self.lost / total if total else 0.0
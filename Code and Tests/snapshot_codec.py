@@ -0,0 +1,206 @@
+import struct
+import numpy as np
+
+
+# Binary MSG_SNAPSHOT_FULL payload (protocol version 2):
+#   encoding (B) | cell_bits (B) | rows (H) | cols (H) | body
+# ENCODING_RAW    body: rows*cols owner ids, uint8 or big-endian uint16
+# ENCODING_PACKED body: rows*cols owner ids of cell_bits (1-7) bits each, MSB first
+# ENCODING_RLE    body: (run_length uint16, owner) pairs in row-major order
+FULL_SNAPSHOT_FORMAT = "!B B H H"
+FULL_SNAPSHOT_STRUCT = struct.Struct(FULL_SNAPSHOT_FORMAT)
+
+# Binary MSG_SNAPSHOT_DELTA payload (protocol version 2):
+#   encoding (B) | cell_bits (B) | body
+# ENCODING_SPARSE body: (cell index, owner) pairs; the index is a big-endian
+#                       uint16, or uint32 for grids above 65536 cells
+# ENCODING_BITMAP body: one bit per grid cell marking changed cells, then the
+#                       owners of the marked cells in index order, bit-packed
+#                       at cell_bits (1-7) or raw at 8/16 bits
+# The receiver supplies the grid size, known from its last full snapshot.
+DELTA_SNAPSHOT_FORMAT = "!B B"
+DELTA_SNAPSHOT_STRUCT = struct.Struct(DELTA_SNAPSHOT_FORMAT)
+
+ENCODING_RAW = 0
+ENCODING_RLE = 1
+ENCODING_PACKED = 2
+ENCODING_SPARSE = 3
+ENCODING_BITMAP = 4
+
+MAX_RUN = 0xFFFF
+
+CELL_DTYPES = {
+    8: np.dtype(np.uint8),
+    16: np.dtype(">u2"),
+}
+
+
+def run_dtype_for(cell_dtype):
+    return np.dtype([("length", ">u2"), ("owner", cell_dtype)])
+
+
+def index_dtype_for(cell_count):
+    return np.dtype(">u2") if cell_count <= 0x10000 else np.dtype(">u4")
+
+
+def owner_bits_for(max_owner):
+    # Narrowest owner width: bit-packed below 8 bits, else uint8/uint16
+    bits = max(1, max_owner.bit_length())
+    if bits < 8:
+        return bits
+    return 16 if max_owner > 0xFF else 8
+
+
+def encode_owners(owners, bits):
+    if bits < 8:
+        # Keep the low `bits` bits of every owner id
+        unpacked = np.unpackbits(owners.astype(np.uint8).reshape(-1, 1), axis=1)[:, 8 - bits:]
+        return np.packbits(unpacked).tobytes()
+    return owners.astype(CELL_DTYPES[bits], copy=False).tobytes()
+
+
+def decode_owners(body, bits, count):
+    if 1 <= bits < 8:
+        unpacked = np.unpackbits(np.frombuffer(body, dtype=np.uint8), count=count * bits)
+        return np.packbits(unpacked.reshape(count, bits), axis=1).reshape(-1) >> (8 - bits)
+
+    cell_dtype = CELL_DTYPES.get(bits)
+    if cell_dtype is None:
+        raise ValueError(f"Unsupported cell width {bits}")
+    owners = np.frombuffer(body, dtype=cell_dtype, count=count)
+    return owners.astype(cell_dtype.newbyteorder("="), copy=False)
+
+
+def encoded_owners_size(count, bits):
+    return (count * bits + 7) // 8
+
+
+def encode_rle(cells, cell_dtype):
+    n = cells.size
+    starts = np.flatnonzero(cells[1:] != cells[:-1]) + 1
+    starts = np.concatenate(([0], starts))
+    lengths = np.diff(np.append(starts, n))
+    owners = cells[starts]
+
+    # Split runs that do not fit in a uint16 length
+    if lengths.max() > MAX_RUN:
+        pieces = (lengths + MAX_RUN - 1) // MAX_RUN
+        owners = np.repeat(owners, pieces)
+        split_lengths = np.full(int(pieces.sum()), MAX_RUN, dtype=np.int64)
+        split_lengths[np.cumsum(pieces) - 1] = lengths - (pieces - 1) * MAX_RUN
+        lengths = split_lengths
+
+    runs = np.empty(lengths.size, dtype=run_dtype_for(cell_dtype))
+    runs["length"] = lengths
+    runs["owner"] = owners
+    return runs.tobytes()
+
+
+def decode_rle(body, cell_dtype, count):
+    runs = np.frombuffer(body, dtype=run_dtype_for(cell_dtype))
+    cells = np.repeat(runs["owner"], runs["length"])
+    if cells.size != count:
+        raise ValueError("RLE snapshot does not cover the grid")
+    return cells.astype(cell_dtype.newbyteorder("="), copy=False)
+
+
+def encode_full_snapshot(cells, rows, cols, use_rle=True):
+    cells = np.asarray(cells).reshape(-1)
+    n = cells.size
+    if n != rows * cols:
+        raise ValueError("Grid does not match the given dimensions")
+
+    max_owner = int(cells.max()) if n else 0
+    bits = owner_bits_for(max_owner)
+    encoding = ENCODING_PACKED if bits < 8 else ENCODING_RAW
+    size = encoded_owners_size(n, bits)
+
+    # Pick the smallest body from its size alone, then build only that one
+    if use_rle and n:
+        cell_dtype = CELL_DTYPES[16 if max_owner > 0xFF else 8]
+        run_count = int(np.count_nonzero(cells[1:] != cells[:-1])) + 1
+        if run_count * run_dtype_for(cell_dtype).itemsize < size:
+            rle_body = encode_rle(cells, cell_dtype)
+            return FULL_SNAPSHOT_STRUCT.pack(ENCODING_RLE, cell_dtype.itemsize * 8, rows, cols) + rle_body
+
+    return FULL_SNAPSHOT_STRUCT.pack(encoding, bits, rows, cols) + encode_owners(cells, bits)
+
+
+def decode_full_snapshot(payload):
+    # Returns a (rows, cols) array of native-endian owner ids
+    if len(payload) < FULL_SNAPSHOT_STRUCT.size:
+        raise ValueError("Snapshot payload too short")
+
+    encoding, bits, rows, cols = FULL_SNAPSHOT_STRUCT.unpack_from(payload)
+    body = payload[FULL_SNAPSHOT_STRUCT.size:]
+    count = rows * cols
+
+    if encoding in (ENCODING_RAW, ENCODING_PACKED):
+        cells = decode_owners(body, bits, count)
+    elif encoding == ENCODING_RLE:
+        cell_dtype = CELL_DTYPES.get(bits)
+        if cell_dtype is None:
+            raise ValueError(f"Unsupported cell width {bits}")
+        cells = decode_rle(body, cell_dtype, count)
+    else:
+        raise ValueError(f"Unknown snapshot encoding {encoding}")
+
+    return cells.reshape(rows, cols)
+
+
+def encode_delta_snapshot(indices, owners, cell_count):
+    # indices are flat row-major cell indices; a cell listed more than once
+    # keeps its last owner
+    indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+    owners = np.asarray(owners).reshape(-1)
+    if indices.size > 1:
+        indices, last = np.unique(indices[::-1], return_index=True)
+        owners = owners[::-1][last]
+
+    count = indices.size
+    max_owner = int(owners.max()) if count else 0
+    cell_bits = 16 if max_owner > 0xFF else 8
+    packed_bits = owner_bits_for(max_owner)
+    index_dtype = index_dtype_for(cell_count)
+
+    sparse_size = count * (index_dtype.itemsize + cell_bits // 8)
+    bitmap_size = (cell_count + 7) // 8 + encoded_owners_size(count, packed_bits)
+
+    if sparse_size <= bitmap_size:
+        entries = np.empty(count, dtype=[("index", index_dtype), ("owner", CELL_DTYPES[cell_bits])])
+        entries["index"] = indices
+        entries["owner"] = owners
+        return DELTA_SNAPSHOT_STRUCT.pack(ENCODING_SPARSE, cell_bits) + entries.tobytes()
+
+    bitmap = np.zeros(cell_count, dtype=np.uint8)
+    bitmap[indices] = 1
+    body = np.packbits(bitmap).tobytes() + encode_owners(owners, packed_bits)
+    return DELTA_SNAPSHOT_STRUCT.pack(ENCODING_BITMAP, packed_bits) + body
+
+
+def decode_delta_snapshot(payload, cell_count):
+    # Returns (indices, owners) as int64 flat cell indices and owner ids
+    if len(payload) < DELTA_SNAPSHOT_STRUCT.size:
+        raise ValueError("Delta payload too short")
+
+    encoding, bits = DELTA_SNAPSHOT_STRUCT.unpack_from(payload)
+    body = payload[DELTA_SNAPSHOT_STRUCT.size:]
+
+    if encoding == ENCODING_SPARSE:
+        cell_dtype = CELL_DTYPES.get(bits)
+        if cell_dtype is None:
+            raise ValueError(f"Unsupported cell width {bits}")
+        entries = np.frombuffer(body, dtype=[("index", index_dtype_for(cell_count)), ("owner", cell_dtype)])
+        indices = entries["index"].astype(np.int64)
+        owners = entries["owner"].astype(cell_dtype.newbyteorder("="))
+    elif encoding == ENCODING_BITMAP:
+        bitmap_size = (cell_count + 7) // 8
+        bitmap = np.unpackbits(np.frombuffer(body[:bitmap_size], dtype=np.uint8), count=cell_count)
+        indices = np.flatnonzero(bitmap)
+        owners = decode_owners(body[bitmap_size:], bits, indices.size)
+    else:
+        raise ValueError(f"Unknown delta encoding {encoding}")
+
+    if indices.size and indices.max() >= cell_count:
+        raise ValueError("Delta cell index outside the grid")
+    return indices, owners
@@ -0,0 +1,487 @@
+import argparse
+import functools
+import multiprocessing
+import select
+import signal
+import struct
+import sys
+import time
+import numpy as np
+from multiprocessing import shared_memory
+from socket import socketpair
+from header import *
+from game_room import GameRoom, ServerState
+from grid_state import GridState, zobrist_key
+from server import GameServer
+from encode_pipeline import InlineEncoder, encode_snapshot_job
+from batched_io import IO_AUTO, IO_MMSG, IO_PLAIN
+from tick_scheduler import CATCH_UP_SKIP, CATCH_UP_BURST
+
+
+# Network -> simulation events: kind, room slot, player, x, y, tick or
+# arrival index, client timestamp
+EVENT_STRUCT = struct.Struct("=B x H H h h I d")
+EVENT_ACQUIRE = 1
+EVENT_TICK = 2
+EVENT_RESET = 3
+
+# Simulation -> network results: kind, room slot, player, x, y, result,
+# newly claimed, tick, client timestamp of the request
+RESULT_STRUCT = struct.Struct("=B x H H h h B B I d")
+RESULT_CLAIM = 1
+RESULT_TICK_DONE = 2
+RESULT_RESET_DONE = 3
+
+# Ring counters sit on their own cache lines
+RING_HEAD_OFFSET = 0
+RING_TAIL_OFFSET = 64
+RING_DATA_OFFSET = 128
+_counter = struct.Struct("=Q")
+
+# Per-slot grid layout: seqlock counter, then the cells
+SLOT_HEADER_SIZE = 64
+
+
+class ShmRing:
+    # Single-producer single-consumer ring of fixed-size records in shared
+    # memory. head counts records written and tail records read; each side
+    # stores only its own counter, after the record itself, so neither side
+    # takes a lock.
+
+    def __init__(self, buf, offset, record_struct, capacity):
+        self.buf = buf
+        self.offset = offset
+        self.record = record_struct
+        self.capacity = capacity
+        self.head = _counter.unpack_from(buf, offset + RING_HEAD_OFFSET)[0]
+        self.tail = _counter.unpack_from(buf, offset + RING_TAIL_OFFSET)[0]
+
+    @staticmethod
+    def size(record_struct, capacity):
+        return RING_DATA_OFFSET + record_struct.size * capacity
+
+    def push(self, *fields):
+        # Producer side; False when the ring is full
+        tail = _counter.unpack_from(self.buf, self.offset + RING_TAIL_OFFSET)[0]
+        if self.head - tail >= self.capacity:
+            return False
+        position = self.offset + RING_DATA_OFFSET + (self.head % self.capacity) * self.record.size
+        self.record.pack_into(self.buf, position, *fields)
+        self.head += 1
+        _counter.pack_into(self.buf, self.offset + RING_HEAD_OFFSET, self.head)
+        return True
+
+    def pop_all(self):
+        # Consumer side; every record written so far, oldest first
+        head = _counter.unpack_from(self.buf, self.offset + RING_HEAD_OFFSET)[0]
+        records = []
+        base = self.offset + RING_DATA_OFFSET
+        while self.tail < head:
+            start = self.tail % self.capacity
+            count = min(head - self.tail, self.capacity - start)
+            data = self.buf[base + start * self.record.size:base + (start + count) * self.record.size]
+            records.extend(self.record.iter_unpack(data))
+            self.tail += count
+        _counter.pack_into(self.buf, self.offset + RING_TAIL_OFFSET, self.tail)
+        return records
+
+
+class SharedGrids:
+    # One shared memory block holding a grid per room slot and both rings.
+    # Every slot starts with a seqlock counter: the simulation makes it odd
+    # while it writes the cells and even again when done, and readers retry
+    # if it was odd or changed under them.
+
+    def __init__(self, slots, rows, cols, ring_capacity=65536):
+        self.slots = slots
+        self.rows = rows
+        self.cols = cols
+        self.slot_size = SLOT_HEADER_SIZE + -(-rows * cols // 64) * 64
+        self.events_offset = slots * self.slot_size
+        self.results_offset = self.events_offset + ShmRing.size(EVENT_STRUCT, ring_capacity)
+        size = self.results_offset + ShmRing.size(RESULT_STRUCT, ring_capacity)
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.buf = self.shm.buf
+        self.ring_capacity = ring_capacity
+
+    def events(self):
+        return ShmRing(self.buf, self.events_offset, EVENT_STRUCT, self.ring_capacity)
+
+    def results(self):
+        return ShmRing(self.buf, self.results_offset, RESULT_STRUCT, self.ring_capacity)
+
+    def sequence(self, slot):
+        start = slot * self.slot_size
+        return np.ndarray(1, dtype=np.uint64, buffer=self.buf, offset=start)
+
+    def cells_buffer(self, slot):
+        start = slot * self.slot_size + SLOT_HEADER_SIZE
+        return self.buf[start:start + self.rows * self.cols]
+
+    def close(self):
+        self.buf = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # Views are still alive; the mapping goes away with the process
+            pass
+        self.shm.unlink()
+
+
+class SharedGridView:
+    # The network side's read-only view of one room's grid. It stands in for
+    # GridState in a SplitRoom; only the simulation writes the cells.
+
+    def __init__(self, grids, slot):
+        self.rows = grids.rows
+        self.cols = grids.cols
+        self.sequence = grids.sequence(slot)
+        self.cells = np.ndarray(self.rows * self.cols, dtype=np.uint8, buffer=grids.cells_buffer(slot))
+        # Zobrist hash of the cells, kept by the room from the claims it is sent
+        self.hash = 0
+
+    def contains(self, x, y):
+        return 0 <= x < self.cols and 0 <= y < self.rows
+
+    def is_full(self):
+        # Cells only ever go from unclaimed to claimed, so no lock is needed
+        return bool(self.cells.all())
+
+    def reset(self):
+        # The simulation clears the slot when the room is assigned to it
+        self.hash = 0
+
+    def read(self, fn):
+        # fn(cells) on a consistent grid, retried if the simulation wrote meanwhile
+        while True:
+            before = int(self.sequence[0])
+            if before & 1:
+                time.sleep(0)
+                continue
+            result = fn(self.cells)
+            if int(self.sequence[0]) == before:
+                return result
+
+
+class Simulation:
+    # The authoritative side: owns every room's grid, queues acquires as the
+    # network process forwards them and resolves them when told a room ticked,
+    # in the same (server arrival, player id) order as GameRoom.
+
+    def __init__(self, grids, doorbell):
+        self.grids = grids
+        self.events = grids.events()
+        self.results = grids.results()
+        self.doorbell = doorbell
+        self.rooms = {}
+        self.pending = {}
+
+    def run(self):
+        while True:
+            select.select([self.doorbell], [], [], 1.0)
+            try:
+                if self.doorbell.recv(4096) == b"":
+                    return
+            except BlockingIOError:
+                pass
+            records = self.events.pop_all()
+            for record in records:
+                self.handle_event(*record)
+            if records:
+                self.notify()
+
+    def handle_event(self, kind, slot, player_id, x, y, number, timestamp):
+        if kind == EVENT_ACQUIRE:
+            self.pending.setdefault(slot, []).append((number, player_id, timestamp, x, y))
+        elif kind == EVENT_TICK:
+            self.resolve(slot, number)
+        elif kind == EVENT_RESET:
+            self.reset(slot)
+
+    def resolve(self, slot, tick):
+        grid = self.rooms[slot]
+        sequence = self.grids.sequence(slot)
+        pending = sorted(self.pending.pop(slot, []))
+        sequence[0] += 1
+        try:
+            for _, player_id, timestamp, x, y in pending:
+                if grid.claim(x, y, player_id):
+                    self.push(RESULT_CLAIM, slot, player_id, x, y, ACQUIRE_GRANTED, 1, tick, timestamp)
+                elif grid.owner(x, y) == player_id:
+                    # Resend of a request granted earlier
+                    self.push(RESULT_CLAIM, slot, player_id, x, y, ACQUIRE_GRANTED, 0, tick, timestamp)
+                else:
+                    self.push(RESULT_CLAIM, slot, player_id, x, y, ACQUIRE_DENIED, 0, tick, timestamp)
+        finally:
+            sequence[0] += 1
+        self.push(RESULT_TICK_DONE, slot, 0, 0, 0, 0, 0, tick, 0.0)
+
+    def reset(self, slot):
+        sequence = self.grids.sequence(slot)
+        sequence[0] += 1
+        self.rooms[slot] = GridState(self.grids.rows, self.grids.cols, buffer=self.grids.cells_buffer(slot))
+        sequence[0] += 1
+        self.pending.pop(slot, None)
+        self.push(RESULT_RESET_DONE, slot, 0, 0, 0, 0, 0, 0, 0.0)
+
+    def push(self, *fields):
+        # Results are never dropped: wait for the network process to catch up
+        while not self.results.push(*fields):
+            self.notify()
+            time.sleep(0.0005)
+
+    def notify(self):
+        try:
+            self.doorbell.send(b"\0")
+        except BlockingIOError:
+            pass
+
+
+def run_simulation(grids, doorbell, inherited):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Close the network side's sockets copied by fork, so the simulation sees
+    # its doorbell close when the network process goes away
+    for sock in inherited:
+        sock.close()
+    Simulation(grids, doorbell).run()
+
+
+class SplitRoom(GameRoom):
+    # A GameRoom whose grid lives in the simulation process. Acquires are
+    # decoded here and forwarded; a tick asks the simulation to resolve them
+    # and the broadcast goes out when its results come back.
+
+    def __init__(self, room_id, io, telemetry, server, slot, **kwargs):
+        super().__init__(room_id, io, telemetry, **kwargs)
+        self.server = server
+        self.slot = slot
+        self.grid = SharedGridView(server.grids, slot)
+        self.grid_size = self.grid.cols
+        self.arrivals = 0
+        # Set once the simulation cleared this room's slot
+        self.reset_done = False
+        self.tick_in_flight = False
+        self.ticks_due = 0
+        self.claims = []
+        # Player id -> SACK of the acquires pushed before the tick in flight
+        self.tick_sacks = {}
+
+    def update_state(self, ticks=1):
+        if self.state == ServerState.WAITING_FOR_INIT and not self.reset_done:
+            return
+        super().update_state(ticks)
+
+    def queue_acquire(self, timestamp, player, cell_x, cell_y):
+        self.arrivals += 1
+        if not self.server.push_event(EVENT_ACQUIRE, self.slot, player.id, cell_x, cell_y,
+                                      self.arrivals, timestamp):
+            print(f"Simulation queue full; dropping acquire from Player {player.id}")
+
+    def update_game_loop(self, ticks=1):
+        self.ticks_due += ticks
+        if self.tick_in_flight:
+            return
+        if self.server.push_event(EVENT_TICK, self.slot, 0, 0, 0, self.snapshot_id, 0.0):
+            self.tick_in_flight = True
+            # Acquires decoded from here on resolve on the next tick, so only
+            # those already pushed are acknowledged with this one
+            self.tick_sacks = {}
+            for player in self.players.values():
+                self.tick_sacks[player.id] = super().take_sack(player)
+
+    def handle_result(self, kind, player_id, x, y, result, claimed, timestamp):
+        if kind == RESULT_CLAIM:
+            self.claims.append((player_id, x, y, result, claimed, timestamp))
+        elif kind == RESULT_TICK_DONE:
+            self.finish_tick()
+        elif kind == RESULT_RESET_DONE:
+            self.reset_done = True
+
+    def finish_tick(self):
+        players = {player.id: player for player in self.players.values()}
+        acks = {}
+        for player_id, x, y, result, claimed, timestamp in self.claims:
+            player = players.get(player_id)
+            if player is None:
+                continue
+            if claimed:
+                index = y * self.grid_size + x
+                self.dirty_indices.append(index)
+                self.dirty_owners.append(player_id)
+                self.grid.hash ^= zobrist_key(index, player_id)
+                player.score += 1
+                self.telemetry.pos_server(player_id, x, y, time.time())
+            acks.setdefault(player.address, {}).setdefault((x, y), (result, timestamp))
+        self.claims = []
+        self.tick_in_flight = False
+
+        if self.state != ServerState.GAME_LOOP:
+            return
+        # One broadcast per due tick (more than one only under burst catch-up)
+        for _ in range(self.ticks_due):
+            self.broadcast_snapshots(acks)
+            acks = {}
+        self.ticks_due = 0
+
+        if self.grid.is_full():
+            print("All cells claimed ending game.")
+            self.game_running = False
+            self.state = ServerState.GAME_OVER
+
+    def take_sack(self, player):
+        return self.tick_sacks.pop(player.id, None)
+
+    def submit_snapshots(self, snapshot_id, targets, changes=None):
+        if not isinstance(self.encoder, InlineEncoder):
+            # Encode workers may still run once the simulation writes again
+            job = self.snapshot_job(snapshot_id, targets, changes, self.grid.read(np.copy))
+            self.encoder.submit(job, functools.partial(self.send_snapshots, job))
+            return
+        # Encoded straight from shared memory without a copy
+        job = self.snapshot_job(snapshot_id, targets, changes, self.grid.cells)
+        encoded = self.grid.read(lambda cells: encode_snapshot_job(job))
+        self.send_snapshots(job, encoded)
+
+
+class SplitServer(GameServer):
+    # Network process of the split architecture: sockets, packet parsing, JSON
+    # decoding, matchmaking and snapshot encoding. The grids belong to a
+    # simulation process and are shared through shared memory; events go to
+    # it and results come back through rings, with a socketpair as doorbell.
+
+    def __init__(self, max_rooms=64, ring_capacity=65536, **kwargs):
+        super().__init__(max_rooms=max_rooms, **kwargs)
+        self.grids = SharedGrids(max_rooms, 20, 20, ring_capacity)
+        self.events = self.grids.events()
+        self.results = self.grids.results()
+        self.free_slots = list(range(max_rooms - 1, -1, -1))
+        self.rooms_by_slot = {}
+        self.doorbell, simulation_doorbell = socketpair()
+        self.doorbell.setblocking(False)
+        simulation_doorbell.setblocking(False)
+        self.ring_doorbell = False
+
+        context = multiprocessing.get_context("fork")
+        self.simulation = context.Process(target=run_simulation, name="simulation",
+                                          args=(self.grids, simulation_doorbell,
+                                                (self.doorbell, self.server_socket)),
+                                          daemon=True)
+        self.simulation.start()
+        simulation_doorbell.close()
+        print(f"Simulation process started (pid {self.simulation.pid})")
+
+    def new_room(self, room_id):
+        if not self.free_slots:
+            print("No free simulation slot for a new room")
+            return None
+        slot = self.free_slots.pop()
+        room = SplitRoom(room_id, self.io, self.telemetry, self, slot, room_size=self.room_size,
+                         piggyback_acks=self.piggyback_acks, delta_depth=self.delta_depth,
+                         encoder=self.encoder, rate_config=self.rate_config,
+                         keyframe_interval=self.keyframe_interval, outgoing=self.outgoing)
+        self.rooms_by_slot[slot] = room
+        self.push_event(EVENT_RESET, slot, 0, 0, 0, 0, 0.0)
+        self.notify_simulation()
+        return room
+
+    def close_room(self, room):
+        super().close_room(room)
+        del self.rooms_by_slot[room.slot]
+        self.free_slots.append(room.slot)
+
+    def push_event(self, *fields):
+        if not self.events.push(*fields):
+            return False
+        if fields[0] != EVENT_ACQUIRE:
+            self.ring_doorbell = True
+        return True
+
+    def notify_simulation(self):
+        # One doorbell per batch of tick and reset events
+        if not self.ring_doorbell:
+            return
+        self.ring_doorbell = False
+        try:
+            self.doorbell.send(b"\0")
+        except BlockingIOError:
+            pass
+
+    def update_rooms(self, ticks=1):
+        super().update_rooms(ticks)
+        self.notify_simulation()
+
+    def select_inputs(self):
+        return super().select_inputs() + [self.doorbell]
+
+    def handle_readable(self, readable):
+        if self.doorbell in readable:
+            try:
+                while self.doorbell.recv(4096):
+                    pass
+            except BlockingIOError:
+                pass
+            for kind, slot, player_id, x, y, result, claimed, _, timestamp in self.results.pop_all():
+                room = self.rooms_by_slot.get(slot)
+                if room is not None:
+                    room.handle_result(kind, player_id, x, y, result, claimed, timestamp)
+            # Rooms waiting for a full queue may tick now
+            self.notify_simulation()
+        super().handle_readable(readable)
+
+    def close(self):
+        self.doorbell.close()
+        self.simulation.join(timeout=2)
+        super().close()
+        self.rooms.clear()
+        self.rooms_by_slot.clear()
+        self.events = self.results = None
+        self.grids.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Grid Clash server split into network and simulation processes")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--max-rooms", type=int, default=64,
+                        help="room grids kept in shared memory")
+    parser.add_argument("--room-size", type=int, default=4,
+                        help="players needed to start a match")
+    parser.add_argument("--delta-depth", type=int, default=32,
+                        help="recent grid versions kept for acks in flight; older ones are kept only as baselines")
+    parser.add_argument("--keyframe-interval", type=int, default=0,
+                        help="snapshots between forced full snapshots to each player "
+                             "(0: only when a client's grid hash disagrees)")
+    parser.add_argument("--separate-acks", action="store_true",
+                        help="send acquire ACKs in their own datagram instead of inside the snapshot")
+    parser.add_argument("--bundle-mtu", type=int, default=BUNDLE_MTU,
+                        help="largest datagram a client's messages of one tick may share "
+                             "(0: one message per datagram)")
+    parser.add_argument("--telemetry-log", default=None,
+                        help="write metrics events to this CSV file instead of stdout")
+    parser.add_argument("--tick-rate", type=float, default=25,
+                        help="snapshot broadcasts per second")
+    parser.add_argument("--catch-up", choices=[CATCH_UP_SKIP, CATCH_UP_BURST], default=CATCH_UP_SKIP,
+                        help="drop missed ticks or run them back to back")
+    parser.add_argument("--io", choices=[IO_AUTO, IO_MMSG, IO_PLAIN], default=IO_AUTO,
+                        help="batched recvmmsg/sendmmsg socket I/O or one syscall per datagram")
+    parser.add_argument("--encode-workers", type=int, default=0,
+                        help="threads encoding snapshots off the tick thread (0: encode inline)")
+    parser.add_argument("--adaptive-rate", action="store_true",
+                        help="adapt each player's snapshot rate to its acks (AIMD)")
+    parser.add_argument("--min-rate", type=float, default=5.0,
+                        help="lowest adaptive snapshot rate per player, in Hz")
+    args = parser.parse_args()
+
+    server = SplitServer(max_rooms=args.max_rooms, port=args.port, tick_rate=args.tick_rate,
+                         catch_up=args.catch_up, telemetry_log=args.telemetry_log,
+                         piggyback_acks=not args.separate_acks, delta_depth=args.delta_depth,
+                         room_size=args.room_size, io_backend=args.io,
+                         encode_workers=args.encode_workers, adaptive_rate=args.adaptive_rate,
+                         min_rate=args.min_rate, keyframe_interval=args.keyframe_interval,
+                         bundle_mtu=args.bundle_mtu)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        print("\nServer shutting down.")
+    finally:
+        server.close()
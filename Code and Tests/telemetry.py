@@ -0,0 +1,135 @@
+import struct
+import sys
+import threading
+import time
+import psutil
+
+
+EVENT_CPU_USAGE = 1
+EVENT_POS_SERVER = 2
+EVENT_SNAPSHOT_SEND = 3
+
+# One fixed-size record per event:
+#   kind (B) | pad | player (i) | a (i) | b (i) | ts (d) | value (d)
+# POS_SERVER uses a=x, b=y; SNAPSHOT_SEND uses a=snapshot_id, b=seq
+RECORD_FORMAT = "=B3x i i i d d"
+RECORD_STRUCT = struct.Struct(RECORD_FORMAT)
+RECORD_SIZE = RECORD_STRUCT.size
+
+CSV_COLUMNS = "event,ts,player,x,y,snapshot_id,seq,percent\n"
+
+
+class Telemetry:
+    # The tick thread packs records into a preallocated ring buffer; a
+    # background thread drains it in batches, samples CPU on its own cadence
+    # and writes the event log. With no path the events are written to stdout
+    # in the old "NAME key=value" line format, otherwise as CSV.
+    # One producer (the tick thread) and one consumer (the writer thread).
+
+    def __init__(self, path=None, capacity=65536, flush_interval=0.1, cpu_interval=0.25):
+        self.path = path
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.cpu_interval = cpu_interval
+        self.buffer = bytearray(capacity * RECORD_SIZE)
+        # head and tail only ever grow; slot = count % capacity
+        self.head = 0
+        self.tail = 0
+        self.dropped = 0
+        # CPU is only sampled while a game is running, as before
+        self.sample_cpu = False
+        self.last_cpu_time = 0
+
+        if path:
+            self.out = open(path, "w", buffering=1 << 16)
+            self.out.write(CSV_COLUMNS)
+            self.format_record = self.format_csv
+        else:
+            self.out = sys.stdout
+            self.format_record = self.format_text
+
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="telemetry", daemon=True)
+        self.thread.start()
+
+    def push(self, kind, player=0, a=0, b=0, ts=0.0, value=0.0):
+        head = self.head
+        if head - self.tail >= self.capacity:
+            # The writer fell behind; never block the tick thread
+            self.dropped += 1
+            return
+        RECORD_STRUCT.pack_into(self.buffer, (head % self.capacity) * RECORD_SIZE,
+                                kind, player, a, b, ts, value)
+        self.head = head + 1
+
+    def pos_server(self, player, x, y, ts):
+        self.push(EVENT_POS_SERVER, player, x, y, ts)
+
+    def snapshot_send(self, player, snapshot_id, seq, ts):
+        self.push(EVENT_SNAPSHOT_SEND, player, snapshot_id, seq, ts)
+
+    def set_cpu_sampling(self, enabled):
+        if enabled and not self.sample_cpu:
+            # Prime psutil so the first sample covers the game, not idle time
+            psutil.cpu_percent()
+            self.last_cpu_time = time.time()
+        self.sample_cpu = enabled
+
+    def run(self):
+        while not self.stop_event.wait(self.flush_interval):
+            self.flush()
+
+    def drain(self):
+        # Copies the pending records out of the ring and frees their slots
+        head = self.head
+        tail = self.tail
+        if head == tail:
+            return b""
+        start = (tail % self.capacity) * RECORD_SIZE
+        end = (head % self.capacity) * RECORD_SIZE
+        if end > start:
+            data = bytes(self.buffer[start:end])
+        else:
+            data = bytes(self.buffer[start:]) + bytes(self.buffer[:end])
+        self.tail = head
+        return data
+
+    def flush(self):
+        lines = []
+        now = time.time()
+        if self.sample_cpu and now - self.last_cpu_time >= self.cpu_interval:
+            self.last_cpu_time = now
+            lines.append(self.format_record(EVENT_CPU_USAGE, 0, 0, 0, now, psutil.cpu_percent()))
+
+        for record in RECORD_STRUCT.iter_unpack(self.drain()):
+            lines.append(self.format_record(*record))
+
+        if lines:
+            self.out.write("".join(lines))
+            self.out.flush()
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.flush()
+        if self.dropped:
+            print(f"Telemetry dropped {self.dropped} events")
+        if self.out is not sys.stdout:
+            self.out.close()
+
+    @staticmethod
+    def format_text(kind, player, a, b, ts, value):
+        if kind == EVENT_POS_SERVER:
+            return f"POS_SERVER id={player} x={a} y={b} ts={ts}\n"
+        if kind == EVENT_SNAPSHOT_SEND:
+            return f"SNAPSHOT_SEND server_ts={ts} snapshot_id={a} seq={b} player={player}\n"
+        return f"CPU_USAGE percent={value} ts={ts}\n"
+
+    @staticmethod
+    def format_csv(kind, player, a, b, ts, value):
+        if kind == EVENT_POS_SERVER:
+            return f"POS_SERVER,{ts},{player},{a},{b},,,\n"
+        if kind == EVENT_SNAPSHOT_SEND:
+            return f"SNAPSHOT_SEND,{ts},{player},,,{a},{b},\n"
+        return f"CPU_USAGE,{ts},,,,,,{value}\n"
+
@@ -0,0 +1,51 @@
+import contextlib
+import io
+import json
+import socket
+
+from header import *
+from sharded_server import WorkerServer, forward_address
+
+
+# More datagrams than an AF_UNIX datagram queue holds by default
+# (net.unix.max_dgram_qlen is 10 on most hosts)
+FLOOD_SIZE = 200
+
+
+def make_workers(port, count=2):
+    workers = []
+    for index in range(count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", port + index))
+        forward_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        forward_socket.bind(forward_address(port, index))
+        workers.append(WorkerServer(index, count, sock, forward_socket, port))
+    return workers
+
+
+def test_forward_flood(port=9931):
+    # Worker 0 forwards JOINs for rooms owned by worker 1 (odd ids) faster
+    # than worker 1 reads them; the overflow is dropped, not raised
+    with contextlib.redirect_stdout(io.StringIO()):
+        workers = make_workers(port)
+    try:
+        for room_id in range(1, 2 * FLOOD_SIZE, 2):
+            packet = make_packet(MSG_JOIN_REQ, json.dumps({"room": room_id}).encode())
+            # Distinct client addresses, as if from FLOOD_SIZE players
+            workers[0].handle_packet(packet, ("127.0.0.1", 20000 + room_id))
+        assert len(workers[0].forwarded) == FLOOD_SIZE
+        assert workers[0].forward_dropped > 0
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            workers[1].handle_readable([workers[1].forward_socket])
+        # Every forwarded JOIN that got through opened its room on the owner
+        assert len(workers[1].rooms) == FLOOD_SIZE - workers[0].forward_dropped
+    finally:
+        for worker in workers:
+            worker.forward_socket.close()
+            worker.close()
+
+
+if __name__ == "__main__":
+    test_forward_flood()
+    print("ok")
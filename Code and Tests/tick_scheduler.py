@@ -0,0 +1,132 @@
+import bisect
+import time
+
+
+CATCH_UP_SKIP = "skip"
+CATCH_UP_BURST = "burst"
+
+# Upper bounds of the duration histogram buckets, in milliseconds
+HISTOGRAM_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64)
+
+
+class DurationHistogram:
+    # Durations counted into fixed buckets; the last bucket is everything
+    # above the largest bound
+
+    def __init__(self, bounds_ms=HISTOGRAM_BOUNDS_MS):
+        self.bounds_ms = bounds_ms
+        self.bounds = [bound / 1000 for bound in bounds_ms]
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.total += 1
+
+    def percentile(self, q):
+        # Upper bound in ms of the bucket holding the q-th quantile
+        if not self.total:
+            return 0.0
+        target = q * self.total
+        seen = 0
+        for bound, count in zip(self.bounds_ms, self.counts):
+            seen += count
+            if seen >= target:
+                return float(bound)
+        return float("inf")
+
+    def format(self):
+        buckets = [f"le_{bound}ms={count}" for bound, count in zip(self.bounds_ms, self.counts)]
+        buckets.append(f"gt_{self.bounds_ms[-1]}ms={self.counts[-1]}")
+        return " ".join(buckets)
+
+
+class TickScheduler:
+    # Fixed-timestep scheduler. Tick k is due at t0 + k*interval on the
+    # monotonic clock, so a late tick does not push back the ones after it.
+    # When deadlines are missed entirely the catch-up policy decides whether
+    # to drop them (skip) or run up to max_catch_up of them back to back (burst).
+
+    def __init__(self, interval, catch_up=CATCH_UP_SKIP, max_catch_up=4,
+                 late_threshold=0.001, clock=time.monotonic):
+        if catch_up not in (CATCH_UP_SKIP, CATCH_UP_BURST):
+            raise ValueError(f"Unknown catch-up policy {catch_up}")
+        self.interval = interval
+        self.catch_up = catch_up
+        self.max_catch_up = max_catch_up
+        self.late_threshold = late_threshold
+        self.clock = clock
+        self.start()
+
+    def start(self, now=None):
+        # The first tick is due one interval from now
+        self.t0 = self.clock() if now is None else now
+        self.tick_index = 1
+        self.next_deadline = self.t0 + self.interval
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.polls = 0
+        self.ticks = 0
+        self.late_ticks = 0
+        self.missed_deadlines = 0
+        self.overruns = 0
+        self.total_lateness = 0.0
+        self.max_lateness = 0.0
+        self.total_duration = 0.0
+        self.max_duration = 0.0
+        self.durations = DurationHistogram()
+
+    def time_until_next(self, now=None):
+        now = self.clock() if now is None else now
+        return max(0.0, self.next_deadline - now)
+
+    def poll(self, now=None):
+        # Returns how many ticks to run now (0 when the next one is not due)
+        now = self.clock() if now is None else now
+        if now < self.next_deadline:
+            return 0
+
+        lateness = now - self.next_deadline
+        missed = int(lateness // self.interval)
+        if missed and self.catch_up == CATCH_UP_BURST:
+            due = min(missed + 1, self.max_catch_up)
+        else:
+            due = 1
+
+        self.polls += 1
+        self.ticks += due
+        self.missed_deadlines += missed + 1 - due
+        self.total_lateness += lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+        if lateness > self.late_threshold:
+            self.late_ticks += 1
+
+        # Skipped deadlines are dropped; the grid itself never shifts
+        self.tick_index += missed + 1
+        self.next_deadline = self.t0 + self.tick_index * self.interval
+        return due
+
+    def record_duration(self, duration):
+        # Time spent running the ticks of one poll; longer than interval is an overrun
+        self.total_duration += duration
+        self.max_duration = max(self.max_duration, duration)
+        self.durations.record(duration)
+        if duration > self.interval:
+            self.overruns += 1
+
+    def stats(self):
+        polls = max(1, self.polls)
+        return {
+            "ticks": self.ticks,
+            "late_ticks": self.late_ticks,
+            "missed_deadlines": self.missed_deadlines,
+            "overruns": self.overruns,
+            "mean_lateness_ms": self.total_lateness / polls * 1000,
+            "max_lateness_ms": self.max_lateness * 1000,
+            "mean_duration_ms": self.total_duration / polls * 1000,
+            "max_duration_ms": self.max_duration * 1000,
+        }